@@ -0,0 +1,385 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the time caffemachine itself needs: rendering, scanning network
+directories, parsing logs and scheduling.
+
+    $ python benchmarks/bench_overhead.py --sizes 10,100,1000 --save-baseline
+
+caffe is replaced by a shell script that writes logs like the real one but
+does no work, and the template is a local git repository. Every case runs in
+its own process with `HOME` in a temporary directory, so the caches,
+networks and the registry of the user are not touched.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+from caffemachine import CACHE_DIR, Caffe, CaffeNet, CaffeTemplate
+from caffemachine.benchmark import BaselineStore, find_regressions, summarize
+from caffemachine.network import SnapshotIndex
+from caffemachine.test.helpers import make_template_repo, write_fake_caffe
+
+CASES = ('render', 'weights', 'get_timings', 'train', 'evaluate')
+default_sizes = (10, 100, 1000, 10000)
+# not mixed with the baselines of `caffemachine benchmark`
+BASELINES_FILE = os.path.join(CACHE_DIR, "overhead_baselines.json")
+
+# glog prints to stderr, the formats match what `caffemachine` parses
+fake_caffe_source = r'''#!/bin/sh
+command=$1
+shift
+while [ $# -gt 1 ]; do
+    case $1 in
+        -solver) solver=$2 ;;
+        -model) model=$2 ;;
+        -iterations) iterations=$2 ;;
+    esac
+    shift 2
+done
+
+log() {
+    printf 'I0101 00:00:00.000000  4242 %s\n' "$1" >&2
+}
+
+case $command in
+train)
+    max_iter=$(sed -n 's/^max_iter: *//p' "$solver")
+    prefix=$(sed -n 's/^snapshot_prefix: *"\(.*\)"/\1/p' "$solver")
+    it=0
+    while [ "$it" -lt "$max_iter" ]; do
+        if [ $((it % 50)) -eq 0 ]; then
+            log "solver.cpp:337] Iteration $it, Testing net (#0)"
+            log "solver.cpp:404]     Test net output #0: accuracy = 0.9"
+            log "solver.cpp:404]     Test net output #1: loss = 0.3 (* 1 = 0.3 loss)"
+        fi
+        log "solver.cpp:228] Iteration $it, loss = 0.5"
+        log "solver.cpp:244]     Train net output #0: loss = 0.5 (* 1 = 0.5 loss)"
+        log "sgd_solver.cpp:106] Iteration $it, lr = 0.01"
+        it=$((it + 10))
+    done
+    log "solver.cpp:454] Snapshotting to binary proto file ${prefix}_iter_${max_iter}.caffemodel"
+    : > "${prefix}_iter_${max_iter}.caffemodel"
+    : > "${prefix}_iter_${max_iter}.solverstate"
+    log "solver.cpp:326] Optimization Done."
+    ;;
+test)
+    i=0
+    while [ "$i" -lt "${iterations:-50}" ]; do
+        log "caffe.cpp:304] Batch $i, accuracy = 0.9"
+        i=$((i + 1))
+    done
+    log "caffe.cpp:313] accuracy = 0.9"
+    ;;
+time)
+    for layer in $(sed -n 's/^layer { name: "\([^"]*\)".*/\1/p' "$model"); do
+        log "caffe.cpp:406] $(printf '%10s' "$layer")	forward: 0.5 ms."
+        log "caffe.cpp:409] $(printf '%10s' "$layer")	backward: 0.7 ms."
+    done
+    log "caffe.cpp:412] Average Forward pass: 4.5 ms."
+    log "caffe.cpp:414] Average Backward pass: 5.5 ms."
+    log "caffe.cpp:418] Total Time: 100 ms."
+    ;;
+esac
+'''
+
+overhead_template_files = {
+    "train.prototxt.j2": "name: \"LeNet\"\n{% include 'layers.inc' %}\n",
+    "deploy.prototxt.j2": "name: \"LeNet-deploy\"\n"
+                          "{% include 'layers.inc' %}\n",
+    "solver.prototxt.j2": "net: \"train.prototxt\"\n"
+                          "test_iter: 100\n"
+                          "test_interval: 50\n"
+                          "base_lr: 0.01\n"
+                          "display: 10\n"
+                          "max_iter: {{ max_iter }}\n"
+                          "snapshot_prefix: \"lenet\"\n",
+    "layers.inc":
+        "layer { name: \"conv1\" type: \"Convolution\" bottom: \"data\" "
+        "top: \"conv1\" convolution_param { num_output: 20 "
+        "kernel_size: 5 } }\n"
+        "layer { name: \"pool1\" type: \"Pooling\" bottom: \"conv1\" "
+        "top: \"pool1\" pooling_param { pool: MAX kernel_size: 2 "
+        "stride: 2 } }\n"
+        "layer { name: \"ip1\" type: \"InnerProduct\" bottom: \"pool1\" "
+        "top: \"ip1\" inner_product_param { num_output: {{ num_output }} "
+        "} }\n"
+        "layer { name: \"relu1\" type: \"ReLU\" bottom: \"ip1\" "
+        "top: \"ip1\" }\n"
+        "layer { name: \"ip2\" type: \"InnerProduct\" bottom: \"ip1\" "
+        "top: \"ip2\" inner_product_param { num_output: 10 } }\n",
+    "README.md": "Template of the caffemachine overhead benchmark.\n",
+}
+
+
+def timing_log(n_layers):
+    """The stderr of `caffe time` for a network with `n_layers` layers."""
+    lines = []
+    for direction in ("forward", "backward"):
+        for i in range(n_layers):
+            lines.append("I0101 00:00:00.000000  4242 caffe.cpp:406] "
+                         "{:>10}\t{}: 0.5 ms.".format("conv{}".format(i),
+                                                      direction))
+    lines.append("I0101 00:00:00.000000  4242 caffe.cpp:412] Average "
+                 "Forward pass: 4.5 ms.")
+    lines.append("I0101 00:00:00.000000  4242 caffe.cpp:414] Average "
+                 "Backward pass: 5.5 ms.")
+    return "\n".join(lines) + "\n"
+
+
+def network_args(size, trial=0, max_iter=100):
+    return {"net{}".format(i): {"num_output": 10 + i, "trial": trial,
+                                "max_iter": max_iter}
+            for i in range(size)}
+
+
+class _Case(object):
+    """Prepares the inputs of a case in `workdir`, `measure` times one
+    trial."""
+
+    def __init__(self, workdir, size):
+        self.workdir = workdir
+        self.size = size
+
+    def _template(self):
+        return CaffeTemplate(make_template_repo(
+            os.path.join(self.workdir, "template"), overhead_template_files))
+
+    def _config_file(self):
+        git_url = make_template_repo(os.path.join(self.workdir, "template"),
+                                     overhead_template_files)
+        config_file = os.path.join(self.workdir, "config.yml")
+        with open(config_file, "w") as f:
+            yaml.safe_dump({'git_url': git_url, 'git_tag': "master",
+                            'networks': network_args(self.size)}, f)
+        return config_file
+
+    def _command(self, *args):
+        return subprocess.call([sys.executable, "-m", "caffemachine.main"] +
+                               list(args), stdout=subprocess.DEVNULL)
+
+
+class _RenderCase(_Case):
+    def setup(self):
+        self.tmpl = self._template()
+        self.trial = 0
+
+    def measure(self):
+        # new args every trial, otherwise the networks already exist
+        self.trial += 1
+        networks = network_args(self.size, self.trial)
+        start = time.perf_counter()
+        for name, args in networks.items():
+            self.tmpl.render(name, args)
+        return time.perf_counter() - start
+
+
+class _WeightsCase(_Case):
+    def setup(self):
+        directory = os.path.join(self.workdir, "net")
+        os.makedirs(directory)
+        for i in range(self.size):
+            for kind in ("caffemodel", "solverstate"):
+                open(os.path.join(directory, "lenet_iter_{}.{}".format(
+                    100 * i, kind)), "w").close()
+        self.net = CaffeNet(directory, template_args={})
+
+    def measure(self):
+        # a cold scan, like the first call in a new process
+        SnapshotIndex._indices.clear()
+        start = time.perf_counter()
+        weights = self.net.weights()
+        duration = time.perf_counter() - start
+        assert len(weights) == self.size
+        return duration
+
+
+class _GetTimingsCase(_Case):
+    def setup(self):
+        self.caffe = Caffe()
+        self.log = timing_log(self.size)
+
+    def measure(self):
+        start = time.perf_counter()
+        self.caffe._get_timings(self.log)
+        return time.perf_counter() - start
+
+
+class _TrainCase(_Case):
+    def setup(self):
+        self.config_file = self._config_file()
+
+    def measure(self):
+        start = time.perf_counter()
+        returncode = self._command("train", "--restart", self.config_file)
+        duration = time.perf_counter() - start
+        assert returncode == 0, "caffemachine train failed"
+        return duration
+
+
+class _EvaluateCase(_TrainCase):
+    def setup(self):
+        super().setup()
+        assert self._command("train", self.config_file) == 0, \
+            "caffemachine train failed"
+
+    def measure(self):
+        start = time.perf_counter()
+        returncode = self._command("evaluate", "--no-cache",
+                                   self.config_file)
+        duration = time.perf_counter() - start
+        assert returncode == 0, "caffemachine evaluate failed"
+        return duration
+
+
+_cases = {
+    'render': _RenderCase,
+    'weights': _WeightsCase,
+    'get_timings': _GetTimingsCase,
+    'train': _TrainCase,
+    'evaluate': _EvaluateCase,
+}
+
+
+def measure(case, size, trials, workdir, warmup=1):
+    """Runs `case` in this process and returns the seconds of every trial.
+    Use `run_case`, it isolates the case from the caches of the user."""
+    runner = _cases[case](workdir, size)
+    runner.setup()
+    for _ in range(warmup):
+        runner.measure()
+    return [runner.measure() for _ in range(trials)]
+
+
+def run_case(case, size, trials=3, warmup=1, keep=False):
+    """Measures `case` with `size` networks, layers or snapshots in a new
+    process with a temporary `HOME` and the fake caffe on the `PATH`."""
+    assert case in _cases, "unknown case {}".format(case)
+    workdir = tempfile.mkdtemp(prefix="caffemachine-overhead-")
+    try:
+        home = os.path.join(workdir, "home")
+        os.makedirs(home)
+        bin_dir = os.path.join(workdir, "bin")
+        write_fake_caffe(bin_dir, fake_caffe_source)
+        package_dir = os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__)))
+        env = dict(os.environ, HOME=home,
+                   PATH=bin_dir + os.pathsep + os.environ.get('PATH', ''),
+                   PYTHONPATH=os.pathsep.join(
+                       p for p in (package_dir, os.environ.get('PYTHONPATH'))
+                       if p))
+        output = os.path.join(workdir, "samples.json")
+        subprocess.check_call(
+            [sys.executable, os.path.abspath(__file__), "--measure", case,
+             str(size), str(trials), str(warmup), workdir, output], env=env)
+        with open(output, "r") as f:
+            samples = json.load(f)
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {'case': case, 'size': size, 'seconds': summarize(samples)}
+
+
+def baseline_key(case, size):
+    return "{}/{}".format(case, size)
+
+
+def compare(args):
+    cases = args.cases.split(",") if args.cases else list(CASES)
+    sizes = [int(s) for s in args.sizes.split(",")]
+    store = BaselineStore(BASELINES_FILE)
+    results = {}
+    regressed = False
+    print("{:^12}|{:^10}|{:^30}|{:^16}|{:^12}".format(
+        "case", "size", "total [ms] median (CI)", "per item [us]",
+        "status"))
+    print("-" * 12 + "+" + "-" * 10 + "+" + "-" * 30 + "+" + "-" * 16 + "+" +
+          "-" * 12)
+    for case in cases:
+        for size in sizes:
+            result = run_case(case, size, trials=args.trials,
+                              warmup=args.warmup)
+            key = baseline_key(case, size)
+            results[key] = result
+            baseline = store.get(key)
+            regressions = []
+            if baseline is None:
+                status = "new"
+            else:
+                regressions = find_regressions(baseline, result,
+                                               args.threshold, ('seconds',))
+                status = "REGRESSED" if regressions else "ok"
+                regressed = regressed or bool(regressions)
+            seconds = result['seconds']
+            total = "{:.3f} ({:.3f}-{:.3f})".format(
+                1000 * seconds['median'], 1000 * seconds['ci_low'],
+                1000 * seconds['ci_high'])
+            print("{:^12}|{:^10}|{:^30}|{:^16.3f}|{:^12}".format(
+                case, size, total, 1e6 * seconds['median'] / size, status),
+                flush=True)
+            for metric, old, new, change in regressions:
+                print("    {} {}: {:.3f} ms -> {:.3f} ms (+{:.1f}%)".format(
+                    case, size, 1000 * old, 1000 * new, 100 * change))
+    if args.save_baseline:
+        store.save(results)
+    if regressed:
+        sys.exit(1)
+
+
+def main():
+    if sys.argv[1:2] == ["--measure"]:
+        # one case in the isolated process started by `run_case`
+        case, size, trials, warmup, workdir, output = sys.argv[2:]
+        samples = measure(case, int(size), int(trials), workdir, int(warmup))
+        with open(output, "w") as f:
+            json.dump(samples, f)
+        return
+    parser = argparse.ArgumentParser(
+        description="Measures the time caffemachine itself needs with a "
+                    "fake caffe and compares it to the stored baselines.")
+    parser.add_argument(
+        '--cases',
+        help='comma separated subset of {}. (default: all)'.format(
+            ", ".join(CASES)))
+    parser.add_argument(
+        '--sizes', default=",".join(str(s) for s in default_sizes),
+        help='comma separated numbers of networks, snapshots or layers. '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--trials', type=int, default=3,
+        help='number of measured runs per case and size. (default: 3)')
+    parser.add_argument(
+        '--warmup', type=int, default=1,
+        help='number of discarded warmup runs. (default: 1)')
+    parser.add_argument(
+        '--threshold', type=float, default=0.05,
+        help='relative slowdown of the median that counts as a regression. '
+             '(default: 0.05)')
+    parser.add_argument(
+        '--save-baseline', action='store_true',
+        help='store the results as the new baselines in {}.'.format(
+            BASELINES_FILE))
+    compare(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares the single pass `caffe time` log parser with the old regex based
+`_get_timings` on synthetic logs.
+
+    $ python benchmarks/bench_timings.py --lines 1000000
+"""
+
+import argparse
+import os
+import re
+import tempfile
+import time
+
+from caffemachine.logparser import parse_timings
+
+_re_forward_layer = re.compile(r"]\s+(\w+)\tforward: ([\d\.]+)")
+_re_backward_layer = re.compile(r"]\s+(\w+)\tbackward: ([\d\.]+)")
+_re_avg_forward_layer = re.compile(r"] Average Forward pass: ([\d\.]+)")
+_re_avg_backward_layer = re.compile(r"] Average Backward pass: ([\d\.]+)")
+
+
+def regex_timings(log):
+    # the implementation of `Caffe._get_timings` before the single pass parser
+    layers = {}
+    for match in re.finditer(_re_forward_layer, log):
+        layers[match.group(1)] = {'forward': float(match.group(2))}
+    for match in re.finditer(_re_backward_layer, log):
+        layers[match.group(1)]['backward'] = float(match.group(2))
+    avg_forward = float(re.search(_re_avg_forward_layer, log).group(1))
+    avg_backward = float(re.search(_re_avg_backward_layer, log).group(1))
+    return {
+        'layers': layers,
+        'avg_forward': avg_forward,
+        'avg_backward': avg_backward
+    }
+
+
+def write_synthetic_log(f, n_lines, n_layers=20):
+    prefix = "I0915 10:00:00.000000  1234 caffe.cpp:"
+    f.write(prefix + "333] *** Benchmark begins ***\n")
+    n_iterations = max(n_lines - 2 * n_layers - 6, 0)
+    for i in range(n_iterations):
+        f.write(prefix + "362] Iteration: {} forward-backward time: {} ms.\n"
+                .format(i + 1, 10 + i % 7))
+    f.write(prefix + "365] Average time per layer: \n")
+    for i in range(n_layers):
+        f.write(prefix + "368]      layer{}\tforward: {:.5f} ms.\n"
+                .format(i, 0.1 * i))
+        f.write(prefix + "371]      layer{}\tbackward: {:.5f} ms.\n"
+                .format(i, 0.2 * i))
+    f.write(prefix + "376] Average Forward pass: 4.1152 ms.\n")
+    f.write(prefix + "378] Average Backward pass: 5.5342 ms.\n")
+    f.write(prefix + "380] Average Forward-Backward: 9.8 ms.\n")
+    f.write(prefix + "382] Total Time: 98 ms.\n")
+    f.write(prefix + "383] *** Benchmark ends ***\n")
+
+
+def best_of(repeat, func, *args):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def parse_file(filename):
+    with open(filename, "r") as f:
+        return parse_timings(f)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile("w", suffix=".log",
+                                     delete=False) as f:
+        write_synthetic_log(f, args.lines)
+        filename = f.name
+    try:
+        with open(filename, "r") as f:
+            log = f.read()
+        regex_time, regex_report = best_of(args.repeat, regex_timings, log)
+        str_time, str_report = best_of(args.repeat, parse_timings, log)
+        file_time, file_report = best_of(args.repeat, parse_file, filename)
+        assert regex_report == str_report == file_report
+        print("{} lines, {:.1f} MB".format(
+            args.lines, os.path.getsize(filename) / 2**20))
+        print("{:<28}{:>10.3f}s".format("regex (old _get_timings)",
+                                        regex_time))
+        print("{:<28}{:>10.3f}s".format("single pass, string", str_time))
+        print("{:<28}{:>10.3f}s".format("single pass, streamed file",
+                                        file_time))
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,7 +17,12 @@ import os
 CACHE_DIR = os.path.expanduser("~/.caffemachine")
 CAFFE_CACHE_DIR = os.path.expanduser("~/.caffemachine/caffe")
 TEMPLATE_CACHE_DIR = os.path.expanduser("~/.caffemachine/templates/")
+BYTECODE_CACHE_DIR = os.path.expanduser("~/.caffemachine/bytecode/")
 NETWORKS_DIR = os.path.expanduser("~/.caffemachine/networks/")
+RESULT_CACHE_DIR = os.path.expanduser("~/.caffemachine/results/")
+BLOB_STORE_DIR = os.path.expanduser("~/.caffemachine/blobs/")
+REGISTRY_FILE = os.path.expanduser("~/.caffemachine/registry.sqlite")
+BASELINES_FILE = os.path.expanduser("~/.caffemachine/baselines.json")
 
 
 from .template import CaffeTemplate
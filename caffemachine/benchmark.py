@@ -0,0 +1,138 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import json
+import math
+import os
+import statistics
+import tempfile
+
+from caffemachine import BASELINES_FILE
+
+
+def reject_outliers(samples, threshold=3.5):
+    """Removes samples whose modified z-score, based on the median absolute
+    deviation, exceeds `threshold`."""
+    if len(samples) < 3:
+        return list(samples)
+    median = statistics.median(samples)
+    mad = statistics.median([abs(s - median) for s in samples])
+    if mad == 0:
+        return list(samples)
+    return [s for s in samples if 0.6745 * abs(s - median) / mad <= threshold]
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    if len(samples) == 1:
+        return samples[0]
+    pos = (len(samples) - 1) * q / 100
+    lo = math.floor(pos)
+    hi = math.ceil(pos)
+    return samples[lo] + (samples[hi] - samples[lo]) * (pos - lo)
+
+
+def median_confidence_interval(samples, confidence=0.95):
+    # distribution free interval between two order statistics, using the
+    # normal approximation of the binomial distribution.
+    samples = sorted(samples)
+    n = len(samples)
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    lo = int(math.floor(n / 2 - z * math.sqrt(n) / 2))
+    hi = int(math.ceil(n / 2 + z * math.sqrt(n) / 2))
+    return samples[max(lo, 0)], samples[min(hi, n - 1)]
+
+
+def summarize(samples, confidence=0.95):
+    kept = reject_outliers(samples)
+    ci_low, ci_high = median_confidence_interval(kept, confidence)
+    return {
+        'n': len(kept),
+        'rejected': len(samples) - len(kept),
+        'median': statistics.median(kept),
+        'mean': statistics.mean(kept),
+        'stdev': statistics.stdev(kept) if len(kept) > 1 else 0.,
+        'p10': percentile(kept, 10),
+        'p90': percentile(kept, 90),
+        'p99': percentile(kept, 99),
+        'ci_low': ci_low,
+        'ci_high': ci_high,
+        'samples': list(samples),
+    }
+
+
+class Benchmark(object):
+    def __init__(self, caffe, trials=10, warmup=1, iterations=10):
+        # every trial has to run caffe, results must not come from the cache
+        self.caffe = copy.copy(caffe)
+        self.caffe.set_cache(None)
+        self.trials = trials
+        self.warmup = warmup
+        self.iterations = iterations
+
+    def run(self, net):
+        for _ in range(self.warmup):
+            self.caffe.time(net, iterations=self.iterations)
+        forward = []
+        backward = []
+        for _ in range(self.trials):
+            report = self.caffe.time(net, iterations=self.iterations)
+            forward.append(report['avg_forward'])
+            backward.append(report['avg_backward'])
+        return {
+            'iterations': self.iterations,
+            'forward': summarize(forward),
+            'backward': summarize(backward),
+        }
+
+
+def find_regressions(baseline, result, threshold=0.05,
+                     metrics=('forward', 'backward')):
+    """Returns the metrics whose median got slower than the baseline by more
+    than `threshold` and whose confidence intervals do not overlap."""
+    regressions = []
+    for metric in metrics:
+        old = baseline[metric]
+        new = result[metric]
+        change = new['median'] / old['median'] - 1 if old['median'] else 0.
+        if change > threshold and new['ci_low'] > old['ci_high']:
+            regressions.append((metric, old['median'], new['median'],
+                                change))
+    return regressions
+
+
+class BaselineStore(object):
+    def __init__(self, filename=BASELINES_FILE):
+        self.filename = filename
+
+    def load(self):
+        try:
+            with open(self.filename, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key):
+        return self.load().get(key)
+
+    def save(self, results):
+        baselines = self.load()
+        baselines.update(results)
+        directory = os.path.dirname(self.filename)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.filename)
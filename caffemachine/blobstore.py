@@ -0,0 +1,211 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from caffemachine import BLOB_STORE_DIR
+from caffemachine.cache import _atomic_write_json
+
+# ioctl request of linux to share the extents of two files, see ioctl_ficlone(2)
+_FICLONE = 0x40049409
+_manifest_name = "blobs.json"
+
+
+def manifest_file(directory):
+    return os.path.join(directory, _manifest_name)
+
+
+def read_manifest(directory):
+    """Returns `{filename: {'digest': ..., 'source': ...}}` of the files in
+    `directory` that are linked to the blob store."""
+    try:
+        with open(manifest_file(directory), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _hash_file(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _reflink(src, dst):
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+
+
+class BlobStore(object):
+    """Content addressed store of the files that are shared by the rendered
+    networks. The network directories only hold hardlinks to the blobs, or
+    reflinks if hardlinks are not possible."""
+
+    def __init__(self, directory=BLOB_STORE_DIR):
+        self.directory = directory
+        self._objects_dir = os.path.join(directory, "objects")
+        # path -> (size, mtime_ns, digest)
+        self._digests = {}
+
+    def blob_path(self, digest):
+        return os.path.join(self._objects_dir, digest[:2], digest[2:])
+
+    def digest(self, filename):
+        stat = os.stat(filename)
+        memo = self._digests.get(filename)
+        if memo and memo[:2] == (stat.st_size, stat.st_mtime_ns):
+            return memo[2]
+        digest = _hash_file(filename)
+        self._digests[filename] = (stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+
+    def add(self, filename):
+        digest = self.digest(filename)
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(filename, tmp)
+            # all networks share the blob, nobody may change it in place
+            os.chmod(tmp, 0o444)
+            try:
+                os.link(tmp, path)
+            except FileExistsError:
+                # added concurrently by another render process
+                pass
+        finally:
+            os.remove(tmp)
+        return digest
+
+    def link(self, digest, dest):
+        """Creates `dest` with the content of the blob. Returns how:
+        `hardlink`, `reflink` or `copy`."""
+        path = self.blob_path(digest)
+        try:
+            os.link(path, dest)
+            return "hardlink"
+        except OSError as e:
+            # EMLINK: the blob has too many links already
+            # EXDEV: the networks are on another filesystem
+            if e.errno not in (errno.EMLINK, errno.EXDEV, errno.EPERM):
+                raise
+        try:
+            _reflink(path, dest)
+            return "reflink"
+        except OSError:
+            shutil.copyfile(path, dest)
+            return "copy"
+
+    def link_files(self, sources, directory):
+        """Populates `directory` with the files `{name: source_path}` and
+        records them in the manifest of the directory."""
+        manifest = read_manifest(directory)
+        for name, source in sources.items():
+            dest = os.path.join(directory, name)
+            if os.path.exists(dest):
+                continue
+            digest = self.add(source)
+            self.link(digest, dest)
+            manifest[name] = {'digest': digest, 'source': source}
+        _atomic_write_json(manifest_file(directory), manifest)
+
+    def _blob_ok(self, digest, checked):
+        if digest not in checked:
+            path = self.blob_path(digest)
+            checked[digest] = os.path.exists(path) and \
+                _hash_file(path) == digest
+        return checked[digest]
+
+    def verify(self, directories, repair=False):
+        """Checks the linked files of the network `directories` against the
+        blob store. Returns a list of `(directory, name, problem)`. With
+        `repair`, broken blobs are added again from their source and broken
+        files are linked again."""
+        problems = []
+        checked = {}
+        for directory in directories:
+            for name, entry in sorted(read_manifest(directory).items()):
+                digest = entry['digest']
+                dest = os.path.join(directory, name)
+                if not self._blob_ok(digest, checked):
+                    problem = "blob-corrupt"
+                    if repair and self._repair_blob(entry):
+                        checked[digest] = True
+                        problem += ", repaired"
+                    problems.append((directory, name, problem))
+                if not checked[digest]:
+                    continue
+                problem = self._check_file(dest, digest)
+                if problem is None:
+                    continue
+                if repair:
+                    if os.path.lexists(dest):
+                        os.remove(dest)
+                    self.link(digest, dest)
+                    problem += ", repaired"
+                problems.append((directory, name, problem))
+        return problems
+
+    def _check_file(self, dest, digest):
+        try:
+            stat = os.stat(dest)
+        except FileNotFoundError:
+            return "missing"
+        blob_stat = os.stat(self.blob_path(digest))
+        if (stat.st_dev, stat.st_ino) == (blob_stat.st_dev, blob_stat.st_ino):
+            return None
+        if _hash_file(dest) != digest:
+            return "modified"
+        return None
+
+    def _repair_blob(self, entry):
+        source = entry.get('source')
+        if not source or not os.path.isfile(source) or \
+                _hash_file(source) != entry['digest']:
+            return False
+        path = self.blob_path(entry['digest'])
+        if os.path.exists(path):
+            # other network files may still be hardlinked to the broken blob
+            os.remove(path)
+        self._digests.pop(source, None)
+        self.add(source)
+        return True
+
+    def prune(self, directories):
+        """Removes the blobs that no manifest of the network `directories`
+        refers to. Returns the number of removed blobs."""
+        used = set()
+        for directory in directories:
+            used.update(entry['digest']
+                        for entry in read_manifest(directory).values())
+        removed = 0
+        if not os.path.isdir(self._objects_dir):
+            return removed
+        for prefix in os.scandir(self._objects_dir):
+            for blob in os.scandir(prefix.path):
+                if prefix.name + blob.name not in used:
+                    os.remove(blob.path)
+                    removed += 1
+        return removed
@@ -0,0 +1,137 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from caffemachine import RESULT_CACHE_DIR
+
+
+def _atomic_write_json(filename, obj):
+    directory = os.path.dirname(filename)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp, filename)
+
+
+def _sha1_of_str(s):
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    def __init__(self, directory=RESULT_CACHE_DIR, max_size=512 * 2**20):
+        self.directory = directory
+        self.max_size = max_size
+        # total size of the entries, scanned lazily on the first put.
+        self._size = None
+        self._entries_dir = os.path.join(directory, "entries")
+        self._hashes_dir = os.path.join(directory, "hashes")
+        os.makedirs(self._entries_dir, exist_ok=True)
+        os.makedirs(self._hashes_dir, exist_ok=True)
+
+    def file_digest(self, filename):
+        # hashing big caffemodels is slow, so the digest is remembered
+        # as long as the size and mtime of the file stay the same.
+        filename = os.path.realpath(filename)
+        stat = os.stat(filename)
+        memo_file = os.path.join(self._hashes_dir,
+                                 _sha1_of_str(filename) + ".json")
+        try:
+            with open(memo_file, "r") as f:
+                memo = json.load(f)
+            if memo['size'] == stat.st_size and \
+                    memo['mtime_ns'] == stat.st_mtime_ns:
+                return memo['digest']
+        except (OSError, ValueError, KeyError):
+            pass
+        sha1 = hashlib.sha1()
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        digest = sha1.hexdigest()
+        _atomic_write_json(memo_file, {'size': stat.st_size,
+                                       'mtime_ns': stat.st_mtime_ns,
+                                       'digest': digest})
+        return digest
+
+    @staticmethod
+    def executable_identity(executable, caffe_ld_path=None):
+        path = os.path.realpath(shutil.which(executable) or executable)
+        stat = os.stat(path)
+        return [path, stat.st_size, stat.st_mtime_ns, caffe_ld_path]
+
+    @staticmethod
+    def key(**parts):
+        return _sha1_of_str(json.dumps(parts, sort_keys=True))
+
+    def _entry_file(self, key):
+        return os.path.join(self._entries_dir, key + ".json")
+
+    def get(self, key):
+        entry_file = self._entry_file(key)
+        try:
+            with open(entry_file, "r") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # the mtime marks the last use for the LRU eviction
+        os.utime(entry_file)
+        return value
+
+    def put(self, key, value):
+        entry_file = self._entry_file(key)
+        if self._size is None:
+            self._size = self.size()
+        try:
+            self._size -= os.stat(entry_file).st_size
+        except FileNotFoundError:
+            pass
+        _atomic_write_json(entry_file, value)
+        self._size += os.stat(entry_file).st_size
+        # only scan the entries when the tracked size exceeds the limit.
+        # Entries written by other processes are picked up by that scan.
+        if self._size > self.max_size:
+            self.evict()
+
+    def size(self):
+        return sum(entry.stat().st_size
+                   for entry in os.scandir(self._entries_dir))
+
+    def evict(self):
+        # evict down to 3/4 of the limit, so that a full cache is not
+        # scanned again on every following put.
+        target = self.max_size * 3 // 4
+        entries = [(e.stat().st_mtime, e.stat().st_size, e.path)
+                   for e in os.scandir(self._entries_dir)]
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_size:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        self._size = total
+
+    def clear(self):
+        for entry in os.scandir(self._entries_dir):
+            os.remove(entry.path)
+        self._size = 0
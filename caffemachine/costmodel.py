@@ -0,0 +1,371 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+from collections import namedtuple
+from functools import reduce
+
+from . import prototxt
+from .prototxt import get
+
+LayerCost = namedtuple('LayerCost', ['name', 'type', 'output_shapes',
+                                     'params', 'flops', 'estimated'])
+
+_bytes_per_value = 4
+
+_elementwise = {
+    'ReLU', 'PReLU', 'ELU', 'Sigmoid', 'TanH', 'AbsVal', 'BNLL', 'Power',
+    'Exp', 'Log', 'Threshold', 'Dropout', 'BatchNorm', 'Scale', 'Bias',
+    'LRN', 'Softmax', 'MVN',
+}
+_losses = {
+    'SoftmaxWithLoss', 'EuclideanLoss', 'SigmoidCrossEntropyLoss',
+    'HingeLoss', 'InfogainLoss', 'MultinomialLogisticLoss',
+    'ContrastiveLoss',
+}
+_data_layers = {'Data', 'ImageData', 'HDF5Data', 'WindowData', 'MemoryData',
+                'DummyData', 'Python'}
+
+
+def _prod(values):
+    return reduce(lambda a, b: a * b, values, 1)
+
+
+def _spatial(param, name, default):
+    # caffe accepts `kernel_size: 3`, `kernel_size: [3, 5]` or `kernel_h` and
+    # `kernel_w`
+    prefix = name[:-len("_size")] if name.endswith("_size") else name
+    h = get(param, prefix + "_h")
+    w = get(param, prefix + "_w")
+    if h is not None and w is not None:
+        return [h, w]
+    values = param.get(name, [])
+    if not values:
+        return [default] * 2
+    if len(values) == 1:
+        return values * 2
+    return values[:2]
+
+
+class NetCost(object):
+    def __init__(self, name, layers, blobs):
+        self.name = name
+        self.layers = layers
+        self.blobs = blobs
+
+    @property
+    def params(self):
+        return sum(layer.params for layer in self.layers)
+
+    @property
+    def flops(self):
+        return sum(layer.flops for layer in self.layers)
+
+    @property
+    def activation_bytes(self):
+        return sum(_prod(shape) for shape in self.blobs.values()) * \
+            _bytes_per_value
+
+    @property
+    def param_bytes(self):
+        return self.params * _bytes_per_value
+
+    @property
+    def memory_bytes(self):
+        return self.activation_bytes + self.param_bytes
+
+    def as_dict(self):
+        return {'params': self.params, 'flops': self.flops,
+                'activation_bytes': self.activation_bytes,
+                'param_bytes': self.param_bytes}
+
+
+def _in_phase(layer, phase):
+    # like caffe, a layer with include rules needs one that matches
+    includes = layer.get('include', [])
+    if includes and not any(get(rule, 'phase') in (None, phase)
+                            for rule in includes):
+        return False
+    for rule in layer.get('exclude', []):
+        if get(rule, 'phase') == phase:
+            return False
+    return True
+
+
+def _data_shapes(layer, tops, input_shapes):
+    shapes = []
+    batch_size = None
+    for param_name in ('data_param', 'image_data_param', 'hdf5_data_param',
+                       'window_data_param', 'memory_data_param'):
+        if param_name in layer:
+            batch_size = get(get(layer, param_name), 'batch_size')
+    memory = get(layer, 'memory_data_param')
+    dummy = get(layer, 'dummy_data_param')
+    for i, top in enumerate(tops):
+        if top in input_shapes:
+            shape = list(input_shapes[top])
+            if batch_size is not None:
+                shape[0] = batch_size
+        elif memory is not None and i == 0:
+            shape = [batch_size, get(memory, 'channels'),
+                     get(memory, 'height'), get(memory, 'width')]
+        elif dummy is not None and dummy.get('shape'):
+            shape = dummy['shape'][min(i, len(dummy['shape']) - 1)]['dim']
+        elif i > 0 and batch_size is not None:
+            # the label blob
+            shape = [batch_size]
+        else:
+            raise ValueError(
+                "The shape of the `{}` blob of the {} layer `{}` is "
+                "unknown, pass it with `input_shapes`.".format(
+                    top, get(layer, 'type'), get(layer, 'name')))
+        shapes.append(list(shape))
+    return shapes
+
+
+def _conv(layer, bottom, deconv=False):
+    param = get(layer, 'convolution_param', {})
+    num_output = get(param, 'num_output')
+    group = get(param, 'group', 1)
+    kernel = _spatial(param, 'kernel_size', 1)
+    stride = _spatial(param, 'stride', 1)
+    pad = _spatial(param, 'pad', 0)
+    dilation = _spatial(param, 'dilation', 1)
+    n, channels = bottom[0], bottom[1]
+    spatial = []
+    for size, k, s, p, d in zip(bottom[2:], kernel, stride, pad, dilation):
+        extent = d * (k - 1) + 1
+        if deconv:
+            spatial.append(s * (size - 1) + extent - 2 * p)
+        else:
+            spatial.append((size + 2 * p - extent) // s + 1)
+    top = [n, num_output] + spatial
+    kernel_volume = channels // group * _prod(kernel)
+    params = num_output * kernel_volume
+    if deconv:
+        params = channels * num_output // group * _prod(kernel)
+    if get(param, 'bias_term', True):
+        params += num_output
+    # two flops per multiply-add
+    if deconv:
+        flops = 2 * n * channels * _prod(bottom[2:]) * \
+            num_output // group * _prod(kernel)
+    else:
+        flops = 2 * _prod(top) * kernel_volume
+    return [top], params, flops
+
+
+def _pool(layer, bottom):
+    param = get(layer, 'pooling_param', {})
+    n, channels = bottom[0], bottom[1]
+    if get(param, 'global_pooling', False):
+        kernel = bottom[2:]
+        stride = [1, 1]
+        pad = [0, 0]
+    else:
+        kernel = _spatial(param, 'kernel_size', 1)
+        stride = _spatial(param, 'stride', 1)
+        pad = _spatial(param, 'pad', 0)
+    spatial = []
+    for size, k, s, p in zip(bottom[2:], kernel, stride, pad):
+        # caffe rounds up, but the last window has to start inside the image
+        out = int(math.ceil((size + 2 * p - k) / s)) + 1
+        if p and (out - 1) * s >= size + p:
+            out -= 1
+        spatial.append(out)
+    top = [n, channels] + spatial
+    return [top], 0, _prod(top) * _prod(kernel)
+
+
+def _inner_product(layer, bottom):
+    param = get(layer, 'inner_product_param', {})
+    num_output = get(param, 'num_output')
+    axis = get(param, 'axis', 1)
+    k = _prod(bottom[axis:])
+    top = bottom[:axis] + [num_output]
+    params = k * num_output
+    if get(param, 'bias_term', True):
+        params += num_output
+    return [top], params, 2 * _prod(bottom[:axis]) * k * num_output
+
+
+def _concat(layer, bottoms):
+    axis = get(get(layer, 'concat_param', {}), 'axis', 1)
+    top = list(bottoms[0])
+    top[axis] = sum(b[axis] for b in bottoms)
+    return [top], 0, 0
+
+
+def _reshape(layer, bottom):
+    dims = get(get(layer, 'reshape_param', {}), 'shape', {}).get('dim', [])
+    top = [bottom[i] if d == 0 else d for i, d in enumerate(dims)]
+    if -1 in top:
+        known = _prod(d for d in top if d != -1)
+        top[top.index(-1)] = _prod(bottom) // known
+    return [top], 0, 0
+
+
+def _slice(layer, bottom, n_tops):
+    param = get(layer, 'slice_param', {})
+    axis = get(param, 'axis', 1)
+    points = param.get('slice_point', [])
+    if not points:
+        step = bottom[axis] // n_tops
+        points = [step * i for i in range(1, n_tops)]
+    bounds = [0] + points + [bottom[axis]]
+    tops = []
+    for lo, hi in zip(bounds, bounds[1:]):
+        top = list(bottom)
+        top[axis] = hi - lo
+        tops.append(top)
+    return tops, 0, 0
+
+
+def _elementwise_params(layer, bottom):
+    layer_type = get(layer, 'type')
+    channels = bottom[1] if len(bottom) > 1 else 1
+    if layer_type in ('PReLU', 'Bias'):
+        return channels
+    if layer_type == 'BatchNorm':
+        return 2 * channels + 1
+    if layer_type == 'Scale':
+        if get(get(layer, 'scale_param', {}), 'bias_term', False):
+            return 2 * channels
+        return channels
+    return 0
+
+
+def _layer_cost(layer, shapes, input_shapes):
+    layer_type = get(layer, 'type')
+    for b in layer.get('bottom', []):
+        if b not in shapes:
+            raise ValueError(
+                "unknown blob `{}`, the bottom of the layer `{}`. Pass its "
+                "shape with `input_shapes`.".format(b, get(layer, 'name')))
+    bottoms = [shapes[b] for b in layer.get('bottom', [])]
+    tops = layer.get('top', [])
+    if not bottoms and layer_type != 'Input' and \
+            layer_type not in _data_layers:
+        raise ValueError("unsupported layer `{}` of type {} without a "
+                         "bottom.".format(get(layer, 'name'), layer_type))
+    estimated = False
+    if layer_type == 'Input':
+        param = get(layer, 'input_param', {})
+        dims = [s['dim'] for s in param.get('shape', [])]
+        out = [list(input_shapes.get(top, dims[min(i, len(dims) - 1)]))
+               for i, top in enumerate(tops)]
+        params, flops = 0, 0
+    elif layer_type in _data_layers:
+        out = _data_shapes(layer, tops, input_shapes)
+        params, flops = 0, 0
+    elif layer_type == 'Convolution':
+        out, params, flops = _conv(layer, bottoms[0])
+    elif layer_type == 'Deconvolution':
+        out, params, flops = _conv(layer, bottoms[0], deconv=True)
+    elif layer_type == 'Pooling':
+        out, params, flops = _pool(layer, bottoms[0])
+    elif layer_type == 'InnerProduct':
+        out, params, flops = _inner_product(layer, bottoms[0])
+    elif layer_type == 'Concat':
+        out, params, flops = _concat(layer, bottoms)
+    elif layer_type == 'Flatten':
+        out = [bottoms[0][:1] + [_prod(bottoms[0][1:])]]
+        params, flops = 0, 0
+    elif layer_type == 'Reshape':
+        out, params, flops = _reshape(layer, bottoms[0])
+    elif layer_type == 'Slice':
+        out, params, flops = _slice(layer, bottoms[0], len(tops))
+    elif layer_type == 'Split':
+        out = [list(bottoms[0]) for _ in tops]
+        params, flops = 0, 0
+    elif layer_type == 'Eltwise':
+        out = [list(bottoms[0])]
+        params, flops = 0, _prod(bottoms[0]) * (len(bottoms) - 1)
+    elif layer_type in _losses or layer_type == 'Accuracy':
+        out = [[] for _ in tops]
+        params, flops = 0, _prod(bottoms[0])
+    elif layer_type == 'Silence':
+        out, params, flops = [], 0, 0
+    else:
+        # unknown layers are assumed to be elementwise
+        estimated = layer_type not in _elementwise
+        out = [list(bottoms[0]) for _ in tops]
+        params = _elementwise_params(layer, bottoms[0])
+        flops = _prod(bottoms[0])
+        if layer_type == 'LRN':
+            flops *= get(get(layer, 'lrn_param', {}), 'local_size', 5)
+    return LayerCost(get(layer, 'name'), layer_type, out, params, flops,
+                     estimated)
+
+
+def analyze(net_param, input_shapes=None, phase='TEST'):
+    """Estimates the output shapes, parameters, flops and activation memory
+    of every layer of a parsed prototxt without running caffe."""
+    if input_shapes is None:
+        input_shapes = {}
+    # blobs without a producing layer, e.g. fed from python
+    shapes = {name: list(shape) for name, shape in input_shapes.items()}
+    # deprecated `input` / `input_dim` / `input_shape` fields of the net
+    inputs = net_param.get('input', [])
+    input_dims = net_param.get('input_dim', [])
+    for i, name in enumerate(inputs):
+        if name in input_shapes:
+            shapes[name] = list(input_shapes[name])
+        elif net_param.get('input_shape'):
+            shapes[name] = list(net_param['input_shape'][i]['dim'])
+        else:
+            shapes[name] = list(input_dims[4 * i:4 * i + 4])
+    layers = []
+    blobs = {name: shapes[name] for name in inputs}
+    for layer in net_param.get('layer', []) + net_param.get('layers', []):
+        if not _in_phase(layer, phase):
+            continue
+        cost = _layer_cost(layer, shapes, input_shapes)
+        bottoms = set(layer.get('bottom', []))
+        for bottom in bottoms:
+            blobs.setdefault(bottom, shapes[bottom])
+        for top, shape in zip(layer.get('top', []), cost.output_shapes):
+            shapes[top] = shape
+            # in-place layers like ReLU do not allocate a new blob
+            if top not in bottoms:
+                blobs[top] = shape
+        layers.append(cost)
+    return NetCost(get(net_param, 'name'), layers, blobs)
+
+
+def analyze_file(filename, input_shapes=None, phase='TEST'):
+    return analyze(prototxt.parse_file(filename), input_shapes, phase)
+
+
+def analyze_net(net, input_shapes=None, use_train_model=False):
+    if use_train_model:
+        return analyze_file(net.train_file(), input_shapes, phase='TRAIN')
+    return analyze_file(net.test_file(), input_shapes)
+
+
+def within_budget(cost, max_flops=None, max_memory=None):
+    if max_flops is not None and cost.flops > max_flops:
+        return False
+    if max_memory is not None and cost.memory_bytes > max_memory:
+        return False
+    return True
+
+
+def parse_input_shapes(specs):
+    """Parses `blob=1,3,224,224` specifications."""
+    shapes = {}
+    for spec in specs or []:
+        name, dims = spec.split("=")
+        shapes[name] = [int(d) for d in dims.split(",")]
+    return shapes
@@ -0,0 +1,68 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+
+class Evaluation(object):
+    def __init__(self, name, net, weights):
+        self.name = name
+        self.net = net
+        self.weights = weights
+        self.accuracy = None
+        self.timings = None
+
+
+class AsyncEvaluator(object):
+    def __init__(self, caffe, jobs=1, isolate_timing=True,
+                 time_iterations=10):
+        self.caffe = caffe
+        self.jobs = jobs
+        self.isolate_timing = isolate_timing
+        self.time_iterations = time_iterations
+
+    async def _test(self, evaluation, semaphore):
+        async with semaphore:
+            evaluation.accuracy = await self.caffe.test_async(
+                evaluation.net, evaluation.weights)
+
+    async def _time(self, group, semaphore):
+        # the timings do not depend on the weights, the snapshots of one
+        # network are timed once
+        async with semaphore:
+            timings = await self.caffe.time_async(
+                group[0].net, iterations=self.time_iterations)
+        for evaluation in group:
+            evaluation.timings = timings
+
+    async def _evaluate(self, evaluations):
+        semaphore = asyncio.Semaphore(self.jobs)
+        tests = [self._test(e, semaphore) for e in evaluations]
+        groups = {}
+        for e in evaluations:
+            groups.setdefault(e.net.directory, []).append(e)
+        if self.isolate_timing:
+            await asyncio.gather(*tests)
+            # every timing job runs alone, so it is not skewed by other
+            # caffe processes competing for the cpus.
+            exclusive = asyncio.Semaphore(1)
+            for group in groups.values():
+                await self._time(group, exclusive)
+        else:
+            times = [self._time(g, semaphore) for g in groups.values()]
+            await asyncio.gather(*(tests + times))
+        return evaluations
+
+    def evaluate(self, evaluations):
+        return asyncio.run(self._evaluate(evaluations))
@@ -12,14 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import collections
+import contextlib
+import fcntl
+import gzip
+import hashlib
+import json
 import os
+import signal
 import subprocess
-from subprocess import PIPE
+from subprocess import PIPE, STDOUT
 import re
 import sys
 import shutil
 from caffemachine import CACHE_DIR, CAFFE_CACHE_DIR
 from .network import CaffeNet
+from .logparser import TrainLogParser, MetricsWriter, parse_timings
 
 
 def _die_if_fails(command, **kwargs):
@@ -31,15 +40,178 @@ def _die_if_fails(command, **kwargs):
     arguments: {}""".format(command, kwargs))
 
 
+def _sha1(s):
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+def build_key(git_repo, commit, compile_opts):
+    key = json.dumps([git_repo, commit, compile_opts], sort_keys=True)
+    return _sha1(key)[:32]
+
+
+def _git_output(args, cwd):
+    p = subprocess.Popen(["git"] + args, cwd=cwd, stdout=PIPE, stderr=PIPE)
+    stdout, _ = p.communicate()
+    if p.returncode != 0:
+        return None
+    return stdout.decode('utf-8').strip()
+
+
+def _resolve_commit(source_dir, git_tag):
+    # tags and commits are resolved locally, only unknown refs need a fetch
+    for ref in (git_tag, "origin/" + git_tag):
+        commit = _git_output(["rev-parse", "--verify", "-q",
+                              ref + "^{commit}"], source_dir)
+        if commit:
+            return commit
+    subprocess.check_call(["git", "fetch", "--tags", "origin"],
+                          cwd=source_dir)
+    for ref in (git_tag, "origin/" + git_tag):
+        commit = _git_output(["rev-parse", "--verify", "-q",
+                              ref + "^{commit}"], source_dir)
+        if commit:
+            return commit
+    raise ValueError("Cannot resolve caffe git tag `{}`".format(git_tag))
+
+
+@contextlib.contextmanager
+def _file_lock(filename):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
 class Caffe(object):
-    def __init__(self, executable="caffe", caffe_ld_path=None, gpus=None):
+    def __init__(self, executable="caffe", caffe_ld_path=None, gpus=None,
+                 cpus=None, cache=None, registry=None, monitor=None,
+                 worker=None):
         self.caffe_ld_path = caffe_ld_path
         self.executable = executable
         self.gpus = gpus
+        self.cpus = cpus
+        self.cache = cache
+        self.registry = registry
+        self.monitor = monitor
+        self.worker = worker
 
     def set_gpus(self, gpus):
         self.gpus = gpus
 
+    def set_cpus(self, cpus):
+        self.cpus = cpus
+
+    def set_cache(self, cache):
+        self.cache = cache
+
+    def set_registry(self, registry):
+        self.registry = registry
+
+    def set_monitor(self, monitor):
+        self.monitor = monitor
+
+    def set_worker(self, worker):
+        # a `ResidentWorker` or `ResidentPool`, used for test and time if
+        # pycaffe is available
+        self.worker = worker
+
+    def _time_backend(self):
+        # the timings of pycaffe and of `caffe time` are not comparable
+        if self.worker is not None and self.worker.can_time():
+            return "resident"
+        return "cli"
+
+    def _worker_time(self, net, iterations, use_train_model):
+        if self.worker is None:
+            return None
+        if use_train_model:
+            model_file = net.train_file()
+        else:
+            model_file = net.test_file()
+        report = self.worker.time(model_file, iterations, cwd=net.directory)
+        if report is not None:
+            report['log'] = None
+        return report
+
+    def _worker_test(self, net, weights, iterations):
+        if self.worker is None:
+            return None
+        return self.worker.test(net.train_file(), weights, iterations,
+                                cwd=net.directory)
+
+    def _record(self, method, *args, **kwargs):
+        if self.registry is None:
+            return
+        try:
+            getattr(self.registry, method)(*args, **kwargs)
+        except KeyError:
+            # the network was not rendered by a template with a registry
+            pass
+
+    def _record_time(self, net, report, use_train_model):
+        if not use_train_model:
+            self._record('record_results', net.directory,
+                         avg_forward=report['avg_forward'],
+                         avg_backward=report['avg_backward'])
+        return report
+
+    def _record_test(self, net, weights, accuracy):
+        self._record('record_results', net.directory, weights=weights,
+                     accuracy=accuracy)
+        return accuracy
+
+    def _record_train(self, net, returncode):
+        self._record('sync_snapshots', net)
+        if returncode != 0:
+            status = 'failed'
+        elif net.is_trained():
+            status = 'trained'
+        else:
+            status = 'stopped'
+        self._record('set_status', net.directory, status)
+
+    def _cache_key(self, kind, **parts):
+        if self.cache is None:
+            return None
+        return self.cache.key(
+            kind=kind, gpus=self._get_gpus_as_str(),
+            executable=self.cache.executable_identity(self.executable,
+                                                      self.caffe_ld_path),
+            **parts)
+
+    def _time_cache_key(self, net, iterations, use_train_model):
+        if self.cache is None:
+            return None
+        if use_train_model:
+            model_file = net.train_file()
+        else:
+            model_file = net.test_file()
+        cpus = sorted(self.cpus) if self.cpus is not None else None
+        return self._cache_key(
+            "time", model=self.cache.file_digest(model_file),
+            iterations=iterations, use_train_model=use_train_model,
+            cpus=cpus, backend=self._time_backend())
+
+    def _test_cache_key(self, net, weights, iterations):
+        if self.cache is None:
+            return None
+        return self._cache_key(
+            "test", model=self.cache.file_digest(net.train_file()),
+            weights=self.cache.file_digest(weights), iterations=iterations)
+
+    def _cache_get(self, key):
+        if key is None:
+            return None
+        return self.cache.get(key)
+
+    def _cache_put(self, key, value):
+        if key is not None:
+            self.cache.put(key, value)
+        return value
+
     def _get_gpus_as_str(self):
         if type(self.gpus) == tuple:
             return ",".join([str(g) for g in self.gpus])
@@ -48,42 +220,12 @@ class Caffe(object):
         else:
             return str(self.gpus)
 
-    _re_forward_layer = re.compile("]\s+(\w+)\tforward: ([\d\.]+)")
-    _re_backward_layer = re.compile("]\s+(\w+)\tbackward: ([\d\.]+)")
-    _re_avg_forward_layer = re.compile("] Average Forward pass: ([\d\.]+)")
-    _re_avg_backward_layer = re.compile("] Average Backward pass: ([\d\.]+)")
-    _re_train_loss = re.compile("Iteration (\d+), loss = ([\d\.]+)")
-    _re_learning_rate = re.compile("Iteration (\d+), lr = ([\d\.]+)")
-    _re_train_accuracy = re.compile(
-        "Iteration (\d+)(.+)\n.*accuracy = ([\d\.]+)", re.MULTILINE)
-    _re_test_accuracy = re.compile(
-        "Iteration (\d+), Testing net(.+)\n.*accuracy = ([\d\.]+)",
-        re.MULTILINE)
-    _re_test_loss = re.compile(
-        "Iteration (\d+), Testing net (.+)\n.*\n.*loss = ([\d\.]+)",
-        re.MULTILINE)
+    failure_log_lines = 50
 
     def _get_timings(self, log):
-        layers = {}
-        for match in re.finditer(self._re_forward_layer, log):
-            layer_name = match.group(1)
-            forward_time = match.group(2)
-            layers[layer_name] = {'forward': float(forward_time)}
-        for match in re.finditer(self._re_backward_layer, log):
-            layer_name = match.group(1)
-            backward_time = match.group(2)
-            layers[layer_name]['backward'] = float(backward_time)
-        match = re.search(self._re_avg_forward_layer, log)
-        avg_forward = float(match.group(1))
-        match = re.search(self._re_avg_backward_layer, log)
-        avg_backward = float(match.group(1))
-        return {
-            'layers': layers,
-            'avg_forward': avg_forward,
-            'avg_backward': avg_backward
-        }
+        return parse_timings(log)
 
-    def time(self, net: CaffeNet, iterations=10, use_train_model=False):
+    def _time_args(self, net, iterations, use_train_model):
         if use_train_model:
             model_file = net.train_file()
         else:
@@ -92,10 +234,10 @@ class Caffe(object):
                 "-model", model_file]
         if self.gpus is not None:
             args.extend(["-gpu", self._get_gpus_as_str()])
-        p = self._run_caffe(args)
-        stdout, stderr = p.communicate()
-        log = stderr.decode("utf-8")
-        if p.wait() != 0:
+        return args
+
+    def _time_report(self, args, returncode, log):
+        if returncode != 0:
             print(log)
             print("Command failed: {}".format(" ".join(args)))
             sys.exit(1)
@@ -103,38 +245,122 @@ class Caffe(object):
         report['log'] = log
         return report
 
-    def train(self, net: CaffeNet, snapshot=None):
+    def time(self, net: CaffeNet, iterations=10, use_train_model=False):
+        key = self._time_cache_key(net, iterations, use_train_model)
+        report = self._cache_get(key)
+        if report is None:
+            report = self._worker_time(net, iterations, use_train_model)
+        if report is None:
+            args = self._time_args(net, iterations, use_train_model)
+            p = self._run_caffe(args)
+            stdout, stderr = p.communicate()
+            log = stderr.decode("utf-8")
+            report = self._cache_put(key, self._time_report(args, p.wait(),
+                                                            log))
+        return self._record_time(net, report, use_train_model)
+
+    def train(self, net: CaffeNet, snapshot=None, output=None, callback=None):
+        # `callback` is called with every parsed TrainRecord / TestRecord.
+        # If it returns True, caffe is interrupted. With its default
+        # `-sigint_effect stop` caffe then snapshots and exits.
+        if output is None:
+            output = sys.stdout
         args = [self.executable,  "train", "-solver", net.solver_file()]
         if snapshot is not None:
+            # caffe also loads the weights of the solverstate's iteration
+            net.restore_snapshot(snapshot)
+            net.restore_snapshot(re.sub(r"\.solverstate$", ".caffemodel",
+                                        snapshot))
             args.extend(["-snapshot", snapshot])
         if self.gpus is not None:
             args.extend(["-gpu", self._get_gpus_as_str()])
-        p = self._run_caffe(args, cwd=net.directory)
-        stderr_lines = []
-        for byte_line in iter(p.stderr.readline, b''):
-            line = byte_line.decode('utf-8')
-            stderr_lines.append(line)
-            print(line.rstrip())
-        stderr = "".join(stderr_lines)
-        if p.wait() != 0:
-            print(stderr, file=sys.stderr)
+        self._record('set_status', net.directory, 'training')
+        p = self._run_caffe(args, cwd=net.directory, stderr=STDOUT)
+        if self.monitor is not None:
+            self.monitor.start(net, p.pid)
+        parser = TrainLogParser()
+        last_lines = collections.deque(maxlen=self.failure_log_lines)
+        interrupted = False
+        with gzip.open(net.train_log_file(), "at") as log, \
+                MetricsWriter(net.metrics_file()) as metrics:
+            for byte_line in iter(p.stdout.readline, b''):
+                line = byte_line.decode('utf-8')
+                log.write(line)
+                last_lines.append(line)
+                print(line.rstrip(), file=output, flush=True)
+                for record in parser.feed(line):
+                    metrics.write(record)
+                    if self.monitor is not None:
+                        self.monitor.update(net, record)
+                    if callback is not None and not interrupted and \
+                            callback(record):
+                        interrupted = True
+                        p.send_signal(signal.SIGINT)
+            for record in parser.finish():
+                metrics.write(record)
+                if self.monitor is not None:
+                    self.monitor.update(net, record)
+                if callback is not None:
+                    callback(record)
+        returncode = p.wait()
+        if self.monitor is not None:
+            self.monitor.finish(net, returncode)
+        if returncode != 0:
+            print("".join(last_lines), file=sys.stderr)
+            print("Command failed: {}. Full log: {}".format(
+                " ".join(args), net.train_log_file()), file=sys.stderr)
+        self._record_train(net, returncode)
+        return returncode
 
-    def test(self, net, weights, gpu=False, iterations=None):
+    def resume(self, net: CaffeNet, output=None, callback=None):
+        """Trains `net` from its latest solverstate. Networks that already
+        reached the solver's `max_iter` are skipped."""
+        if output is None:
+            output = sys.stdout
+        if net.is_trained():
+            print("Network {} is already trained.".format(net.directory),
+                  file=output)
+            return 0
+        snapshot = net.latest_solverstate()
+        if snapshot is not None:
+            print("Resuming from {}".format(snapshot), file=output)
+        returncode = self.train(net, snapshot=snapshot, output=output,
+                                callback=callback)
+        if returncode == 0 and net.is_trained():
+            net.mark_trained()
+        return returncode
+
+    def _test_args(self, net, weights, iterations):
         args = [self.executable, "test", "-model", net.train_file(),
                 "-weights", weights]
         if iterations is not None:
-            args.extend(["-iterations", iterations])
+            args.extend(["-iterations", str(iterations)])
         if self.gpus is not None:
             args.extend(["-gpu", self._get_gpus_as_str()])
+        return args
 
-        p = self._run_caffe(args, cwd=net.directory)
-        stdout, stderr = p.communicate()
-        assert p.wait() == 0
-        log = stderr.decode("utf-8")
-        accuracy_re = re.compile("] accuracy = (.*)")
-        matches = accuracy_re.search(log)
-        accuracy = float(matches.group(1))
-        return accuracy
+    _re_accuracy = re.compile("] accuracy = (.*)")
+
+    def _test_accuracy(self, returncode, log):
+        assert returncode == 0
+        matches = self._re_accuracy.search(log)
+        return float(matches.group(1))
+
+    def test(self, net, weights, gpu=False, iterations=None):
+        # archived weights are restored transparently
+        net.restore_snapshot(weights)
+        key = self._test_cache_key(net, weights, iterations)
+        accuracy = self._cache_get(key)
+        if accuracy is None:
+            accuracy = self._worker_test(net, weights, iterations)
+        if accuracy is None:
+            args = self._test_args(net, weights, iterations)
+            p = self._run_caffe(args, cwd=net.directory)
+            stdout, stderr = p.communicate()
+            log = stderr.decode("utf-8")
+            accuracy = self._cache_put(key, self._test_accuracy(p.wait(),
+                                                                log))
+        return self._record_test(net, weights, accuracy)
 
     @classmethod
     def get_caffe(cls, git_tag=None, git_repo=None, **compile_opts):
@@ -146,44 +372,154 @@ class Caffe(object):
             git_tag = "master"
         if git_repo is None:
             git_repo = "https://github.com/BVLC/caffe.git"
-        cache_repo = os.path.join(CAFFE_CACHE_DIR, git_tag)
-        if not os.path.exists(cache_repo):
-            _die_if_fails("git clone {} {}".format(git_repo, cache_repo),
-                          shell=True)
-        return cls.compile_caffe_if_not_avialable(cache_repo, **compile_opts)
+        source_dir = os.path.join(CAFFE_CACHE_DIR, "src",
+                                  _sha1(git_repo)[:32])
+        # concurrent runs must not clone or fetch into the same directory
+        with _file_lock(source_dir + ".lock"):
+            if not os.path.exists(source_dir):
+                subprocess.check_call(["git", "clone", "--no-checkout",
+                                       git_repo, source_dir])
+            commit = _resolve_commit(source_dir, git_tag)
+        opts = dict(cls.default_compile_opts)
+        opts.update(compile_opts)
+        key = build_key(git_repo, commit, opts)
+        install_dir = os.path.join(CAFFE_CACHE_DIR, "builds", key)
+        caffe = cls._installed_caffe(install_dir)
+        if caffe is not None:
+            return caffe
+        with _file_lock(install_dir + ".lock"):
+            # builds with other options share the checkout of the commit
+            worktree = os.path.join(CAFFE_CACHE_DIR, "worktrees", commit)
+            with _file_lock(worktree + ".lock"), \
+                    _file_lock(source_dir + ".lock"):
+                if not os.path.exists(worktree):
+                    subprocess.check_call(["git", "worktree", "add",
+                                           "--detach", worktree, commit],
+                                          cwd=source_dir)
+            return cls.compile_caffe_if_not_avialable(
+                worktree, build_dir=os.path.join(CAFFE_CACHE_DIR, "build", key),
+                install_dir=install_dir, **opts)
+
+    default_compile_opts = {'blas': "open", 'cpu_only': True}
 
     @classmethod
-    def compile_caffe_if_not_avialable(cls, repo_path, blas="open", cpu_only=True):
-        caffe_executable = os.path.join(repo_path, "build/install/bin/caffe")
-        caffe_ld_path = os.path.join(repo_path, "build/install/lib/")
+    def _installed_caffe(cls, install_dir):
+        caffe_executable = os.path.join(install_dir, "bin/caffe")
+        caffe_ld_path = os.path.join(install_dir, "lib/")
         if os.path.exists(caffe_executable):
-            return Caffe(caffe_executable, caffe_ld_path=caffe_ld_path)
-        build_dir = repo_path + "/build"
+            return cls(caffe_executable, caffe_ld_path=caffe_ld_path)
+
+    @classmethod
+    def compile_caffe_if_not_avialable(cls, repo_path, blas="open",
+                                       cpu_only=True, build_dir=None,
+                                       install_dir=None, jobs=None):
+        if build_dir is None:
+            build_dir = os.path.join(repo_path, "build")
+        if install_dir is None:
+            install_dir = os.path.join(build_dir, "install")
+        caffe = cls._installed_caffe(install_dir)
+        if caffe is not None:
+            return caffe
+        if jobs is None:
+            jobs = os.cpu_count() or 1
         os.makedirs(build_dir, exist_ok=True)
-        cpu_only_str = ""
+        cmake_cmd = ["cmake", "-DBLAS={}".format(blas),
+                     "-DCMAKE_BUILD_TYPE=Release",
+                     "-DCMAKE_INSTALL_PREFIX={}".format(install_dir)]
         if cpu_only:
-            cpu_only_str = "-DCPU_ONLY=ON"
+            cmake_cmd.append("-DCPU_ONLY=ON")
+        if shutil.which("ccache"):
+            cmake_cmd.extend(["-DCMAKE_C_COMPILER_LAUNCHER=ccache",
+                              "-DCMAKE_CXX_COMPILER_LAUNCHER=ccache"])
+        cmake_cmd.append(os.path.abspath(repo_path))
+        _die_if_fails(cmake_cmd, cwd=build_dir)
+        _die_if_fails(["make", "-j{}".format(jobs), "install"], cwd=build_dir)
+        caffe = cls._installed_caffe(install_dir)
+        assert caffe is not None
+        return caffe
 
-        cmake_cmd = "cmake -DBLAS={} {cpu} -DCAMKE_BUILD_TYPE=Release .." \
-            .format(blas, cpu=cpu_only_str)
-        _die_if_fails(cmake_cmd, cwd=build_dir, shell=True)
-        _die_if_fails("make && make install", cwd=build_dir, shell=True)
-        assert os.path.exists(caffe_executable)
-        return cls(caffe_executable, caffe_ld_path=caffe_ld_path)
+    # thread pools of the BLAS libraries and OpenMP
+    blas_thread_variables = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                             "MKL_NUM_THREADS")
 
-    def _run_caffe(self, args, **subprocess_popen_opts):
+    def _env(self):
         env = dict(os.environ)
         if self.caffe_ld_path:
             env['LD_LIBRARY_PATH'] = self.caffe_ld_path
-        return subprocess.Popen(args, stdout=PIPE, stderr=PIPE, env=env,
-                                **subprocess_popen_opts)
+        if self.cpus is not None:
+            # otherwise every BLAS pool starts one thread per core of the
+            # machine and the concurrent caffe processes oversubscribe
+            for variable in self.blas_thread_variables:
+                env[variable] = str(len(self.cpus))
+        return env
+
+    def _set_affinity(self, pid):
+        if self.cpus is not None:
+            # set after the fork, preexec_fn is not safe with the scheduler's
+            # threads. caffe spawns its worker threads later, so they inherit.
+            os.sched_setaffinity(pid, self.cpus)
 
-    def get_most_accurate(self, nets):
-        accuracies = [self.test(net, net.highest_iteration_weights()) for net in nets]
+    def _run_caffe(self, args, **subprocess_popen_opts):
+        subprocess_popen_opts.setdefault('stdout', PIPE)
+        subprocess_popen_opts.setdefault('stderr', PIPE)
+        p = subprocess.Popen(args, env=self._env(), **subprocess_popen_opts)
+        self._set_affinity(p.pid)
+        return p
+
+    async def _run_caffe_async(self, args, **subprocess_opts):
+        subprocess_opts.setdefault('stdout', PIPE)
+        subprocess_opts.setdefault('stderr', PIPE)
+        p = await asyncio.create_subprocess_exec(*args, env=self._env(),
+                                                 **subprocess_opts)
+        self._set_affinity(p.pid)
+        stdout, stderr = await p.communicate()
+        return p.returncode, stdout, stderr
+
+    async def time_async(self, net: CaffeNet, iterations=10,
+                         use_train_model=False):
+        key = self._time_cache_key(net, iterations, use_train_model)
+        report = self._cache_get(key)
+        if report is None and self.worker is not None:
+            report = await asyncio.get_running_loop().run_in_executor(
+                None, self._worker_time, net, iterations, use_train_model)
+        if report is None:
+            args = self._time_args(net, iterations, use_train_model)
+            returncode, stdout, stderr = await self._run_caffe_async(args)
+            report = self._cache_put(key, self._time_report(
+                args, returncode, stderr.decode("utf-8")))
+        return self._record_time(net, report, use_train_model)
+
+    async def test_async(self, net, weights, iterations=None):
+        # archived weights are restored transparently
+        net.restore_snapshot(weights)
+        key = self._test_cache_key(net, weights, iterations)
+        accuracy = self._cache_get(key)
+        if accuracy is None and self.worker is not None:
+            accuracy = await asyncio.get_running_loop().run_in_executor(
+                None, self._worker_test, net, weights, iterations)
+        if accuracy is None:
+            args = self._test_args(net, weights, iterations)
+            returncode, stdout, stderr = await self._run_caffe_async(
+                args, cwd=net.directory)
+            accuracy = self._cache_put(key, self._test_accuracy(
+                returncode, stderr.decode("utf-8")))
+        return self._record_test(net, weights, accuracy)
+
+    async def _test_latest(self, nets, jobs):
+        semaphore = asyncio.Semaphore(jobs)
+
+        async def test(net):
+            async with semaphore:
+                return await self.test_async(
+                    net, net.highest_iteration_weights())
+        return await asyncio.gather(*(test(net) for net in nets))
+
+    def get_most_accurate(self, nets, jobs=1):
+        accuracies = asyncio.run(self._test_latest(nets, jobs))
         max_index = accuracies.index(max(accuracies))
         return nets[max_index]
 
     def get_fastest(self, nets):
-        timings = [self.time(net, net.highest_iteration_weights()) for net in nets]
-        max_index = timings.index(max(timings, key='avg_forward'))
-        return nets[max_index]
+        # timed one after another, parallel runs would skew the timings
+        forward = [self.time(net)['avg_forward'] for net in nets]
+        return nets[forward.index(min(forward))]
@@ -0,0 +1,211 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import csv
+import os
+import re
+from collections import namedtuple
+
+TrainRecord = namedtuple('TrainRecord', ['iteration', 'loss', 'lr'])
+TestRecord = namedtuple('TestRecord', ['iteration', 'accuracy', 'loss'])
+# not a test class, pytest must not collect it
+TestRecord.__test__ = False
+
+_float = r"([-+]?(?:[\d\.]+(?:e[-+]?\d+)?|nan|inf))"
+# newer caffe versions print the speed: `Iteration 100 (5.1 iter/s, ...)`
+_re_train_loss = re.compile(
+    r"Iteration (\d+)(?: \([^)]*\))?, loss = " + _float)
+_re_learning_rate = re.compile(r"Iteration (\d+), lr = " + _float)
+_re_testing = re.compile(r"Iteration (\d+), Testing net \(#(\d+)\)")
+_re_test_output = re.compile(r"Test net output #\d+: (\S+) = " + _float)
+
+
+class TrainLogParser(object):
+    def __init__(self):
+        self._train_iteration = None
+        self._train_loss = None
+        self._test_iteration = None
+        self._test_outputs = None
+
+    def _flush_train(self):
+        if self._train_iteration is None:
+            return []
+        record = TrainRecord(self._train_iteration, self._train_loss, None)
+        self._train_iteration = None
+        self._train_loss = None
+        return [record]
+
+    def _flush_test(self):
+        if self._test_iteration is None:
+            return []
+        accuracy = None
+        loss = None
+        for name, value in self._test_outputs:
+            if accuracy is None and "accuracy" in name:
+                accuracy = value
+            elif loss is None and "loss" in name:
+                loss = value
+        record = TestRecord(self._test_iteration, accuracy, loss)
+        self._test_iteration = None
+        self._test_outputs = None
+        return [record]
+
+    def feed(self, line):
+        if self._test_iteration is not None:
+            match = _re_test_output.search(line)
+            if match:
+                self._test_outputs.append(
+                    (match.group(1), float(match.group(2))))
+                return []
+        records = self._flush_test()
+        if "Iteration" not in line:
+            return records
+        match = _re_train_loss.search(line)
+        if match:
+            records.extend(self._flush_train())
+            self._train_iteration = int(match.group(1))
+            self._train_loss = float(match.group(2))
+            return records
+        match = _re_learning_rate.search(line)
+        if match:
+            iteration = int(match.group(1))
+            lr = float(match.group(2))
+            if self._train_iteration == iteration:
+                records.append(TrainRecord(iteration, self._train_loss, lr))
+                self._train_iteration = None
+                self._train_loss = None
+            else:
+                records.extend(self._flush_train())
+                records.append(TrainRecord(iteration, None, lr))
+            return records
+        match = _re_testing.search(line)
+        if match and match.group(2) == "0":
+            self._test_iteration = int(match.group(1))
+            self._test_outputs = []
+        return records
+
+    def finish(self):
+        return self._flush_train() + self._flush_test()
+
+    def parse(self, lines):
+        for line in lines:
+            yield from self.feed(line)
+        yield from self.finish()
+
+
+_metrics_header = ['phase', 'iteration', 'loss', 'lr', 'accuracy']
+
+
+def _fmt(value):
+    if value is None:
+        return ""
+    return repr(value)
+
+
+class MetricsWriter(object):
+    def __init__(self, filename):
+        new_file = not os.path.exists(filename) or \
+            os.path.getsize(filename) == 0
+        self._file = open(filename, "a", newline="")
+        self._writer = csv.writer(self._file)
+        if new_file:
+            self._writer.writerow(_metrics_header)
+
+    def write(self, record):
+        if type(record) == TrainRecord:
+            row = ["train", record.iteration, _fmt(record.loss),
+                   _fmt(record.lr), ""]
+        else:
+            row = ["test", record.iteration, _fmt(record.loss), "",
+                   _fmt(record.accuracy)]
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_metrics(filename):
+    def opt_float(s):
+        return float(s) if s else None
+    with open(filename, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            iteration = int(row['iteration'])
+            if row['phase'] == "train":
+                yield TrainRecord(iteration, opt_float(row['loss']),
+                                  opt_float(row['lr']))
+            else:
+                yield TestRecord(iteration, opt_float(row['accuracy']),
+                                 opt_float(row['loss']))
+
+
+_re_timing = re.compile(
+    r"\]\s+(\S+)\t(forward|backward): ([\d\.]+)"
+    r"|\] Average (Forward|Backward) pass: ([\d\.]+)")
+_chunk_size = 1 << 20
+
+
+def _chunks(log):
+    # yields blocks of whole lines, so that no match is split between blocks
+    if isinstance(log, str):
+        yield log
+        return
+    if hasattr(log, "read"):
+        blocks = iter(lambda: log.read(_chunk_size), "")
+    else:
+        blocks = log
+    rest = ""
+    for block in blocks:
+        block = rest + block
+        end = block.rfind("\n") + 1
+        if end == 0:
+            rest = block
+            continue
+        rest = block[end:]
+        yield block[:end]
+    if rest:
+        yield rest
+
+
+def parse_timings(log):
+    """Parses the output of `caffe time` in a single pass.
+
+    `log` can be a string, an open file or any iterable of lines. Files are
+    read in blocks, so the log never has to fit into memory.
+    """
+    layers = {}
+    avg = {}
+    for chunk in _chunks(log):
+        for match in _re_timing.finditer(chunk):
+            layer_name, direction, layer_time, avg_name, avg_time = \
+                match.groups()
+            if layer_name is not None:
+                layers.setdefault(layer_name, {})[direction] = \
+                    float(layer_time)
+            else:
+                avg[avg_name] = float(avg_time)
+    if 'Forward' not in avg or 'Backward' not in avg:
+        raise ValueError("No average forward / backward timings found in "
+                         "the caffe time log.")
+    return {
+        'layers': layers,
+        'avg_forward': avg['Forward'],
+        'avg_backward': avg['Backward']
+    }
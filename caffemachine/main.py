@@ -14,43 +14,327 @@
 # limitations under the License.
 
 import argparse
+import functools
+import glob
+import json
+import os
 import sys
 import yaml
-from . import Caffe, CaffeTemplate
+from . import Caffe, CaffeTemplate, NETWORKS_DIR
+from .blobstore import BlobStore
+from .benchmark import Benchmark, BaselineStore, find_regressions
+from .cache import ResultCache
+from .costmodel import analyze_net, parse_input_shapes, within_budget
+from .evaluator import AsyncEvaluator, Evaluation
+from .monitor import MetricsServer, TrainingMonitor
+from .registry import Registry
+from . import selection
+from .tuner import ThroughputTuner, parse_variable
+from .retention import RetentionPolicy, archive_snapshots
+from .pipeline import Pipeline, print_pipeline_summary
+from .profiling import chrome_trace, print_hottest_layers, \
+    print_layer_comparison, variable_influence
+from .remote import RemoteExecutor, TaskRunner, WorkerServer, \
+    parse_address
+from .resident import ResidentPool
+from .scheduler import Job, Scheduler, make_slots, parse_cpu_list, \
+    print_summary
+from .sweep import SweepRun, SuccessiveHalving, MedianStopping, \
+    print_sweep_summary
 
 
-def load_config_file(config_file):
+def load_config(config_file):
     with open(config_file, 'r') as f:
-        config = yaml.load(f)
-    tmpl = CaffeTemplate(
+        return yaml.safe_load(f)
+
+
+def _load_template(config):
+    return CaffeTemplate(
         config['git_url'], config.get('git_tag'),
         allow_download_script=config.get("allow_download_script"))
+
+
+def load_config_file(config_file):
+    config = load_config(config_file)
+    tmpl = _load_template(config)
     caffe = Caffe.get_caffe(config.get('caffe_git_tag'),
                             git_repo=config.get('caffe_git_url'))
+    registry = Registry()
+    tmpl.set_registry(registry)
+    caffe.set_registry(registry)
     return caffe, tmpl, config['networks']
 
 
+def _train_net(net, restart, caffe, output):
+    if restart:
+        return caffe.train(net, output=output)
+    return caffe.resume(net, output=output)
+
+
+def _make_slots(caffe, args):
+    cpu_groups = None
+    if args.cpu_group:
+        cpu_groups = [parse_cpu_list(g) for g in args.cpu_group]
+    gpus = None
+    if args.gpus:
+        gpus = [int(g) for g in args.gpus.split(",")]
+    if args.metrics:
+        monitor = TrainingMonitor()
+        caffe.set_monitor(monitor)
+        server = MetricsServer(parse_address(args.metrics), monitor).start()
+        print("Serving training metrics on http://{}/metrics".format(
+            server.address))
+    return make_slots(args.jobs, cpu_groups, gpus)
+
+
+def _make_scheduler(caffe, args):
+    return Scheduler(caffe, _make_slots(caffe, args))
+
+
+def _remote_tasks(config, op, **task_opts):
+    template = {
+        'git_url': config['git_url'],
+        'git_tag': config.get('git_tag'),
+        'allow_download_script': config.get('allow_download_script'),
+    }
+    caffe = {
+        'git_tag': config.get('caffe_git_tag'),
+        'git_url': config.get('caffe_git_url'),
+    }
+    tasks = []
+    for name, net_config in config['networks'].items():
+        task = {'op': op, 'template': template, 'caffe': caffe,
+                'name': name, 'args': net_config}
+        task.update(task_opts)
+        tasks.append(task)
+    return tasks
+
+
+def _print_remote_errors(results):
+    for result in results:
+        if result.error is not None:
+            print("[{}@{}] {} failed:\n{}".format(
+                result.name, result.worker, result.task['op'], result.error),
+                file=sys.stderr)
+
+
+def _train_remote(args):
+    config = load_config(args.config)
+    tmpl = _load_template(config)
+    executor = RemoteExecutor(args.workers.split(","))
+    results = executor.run(_remote_tasks(config, 'train',
+                                         restart=args.restart))
+    _print_remote_errors(results)
+    trained = [r.name for r in results if r.ok]
+    # the fetched weights are only usable next to the rendered prototxts
+    dest_dirs = {}
+    for name in trained:
+        net = tmpl.find_or_render(name, config['networks'][name])
+        dest_dirs[name] = net.directory
+    fetches = [t for t in _remote_tasks(config, 'fetch')
+               if t['name'] in dest_dirs]
+    fetched = executor.run(fetches, dest_dirs=dest_dirs)
+    _print_remote_errors(fetched)
+    for result in results:
+        status = "ok" if result.ok else "FAILED"
+        print("{:^20}|{:^10}| {}".format(result.name, status, result.worker))
+    if not all(r.ok for r in results + fetched):
+        sys.exit(1)
+
+
 def train(args):
+    if args.workers:
+        return _train_remote(args)
     caffe, tmpl, networks_cfg = load_config_file(args.config)
+    jobs = []
     for name, net_config, in networks_cfg.items():
         net = tmpl.find_or_render(name, net_config)
-        caffe.train(net)
+        log_file = None
+        if args.jobs > 1:
+            log_file = net.directory + "/train_output.log"
+        jobs.append(Job(name, functools.partial(_train_net, net,
+                                                args.restart), log_file))
+    results = _make_scheduler(caffe, args).run(jobs)
+    print_summary(results)
+    if not all(r.ok for r in results):
+        sys.exit(1)
+
+
+def _analyze_net(name, net, input_shapes, use_train_model=False):
+    try:
+        return analyze_net(net, input_shapes, use_train_model)
+    except ValueError as e:
+        print("Cannot estimate the cost of `{}`: {}".format(name, e))
+        print("Pass the shape of its input blobs with `--input-shape`, "
+              "e.g. `--input-shape data=1,3,224,224`.")
+        sys.exit(1)
+
+
+def _over_budget(name, net, args):
+    if args.max_gflops is None and args.max_memory_mb is None:
+        return False
+    cost = _analyze_net(name, net, parse_input_shapes(args.input_shape))
+    max_flops = None
+    if args.max_gflops is not None:
+        max_flops = args.max_gflops * 1e9
+    max_memory = None
+    if args.max_memory_mb is not None:
+        max_memory = args.max_memory_mb * (1 << 20)
+    if within_budget(cost, max_flops, max_memory):
+        return False
+    print("Skipping `{}`: {:.3f} GFLOPs, {:.1f} MB memory is over budget."
+          .format(name, cost.flops / 1e9, cost.memory_bytes / (1 << 20)))
+    return True
+
+
+def sweep(args):
+    caffe, tmpl, networks_cfg = load_config_file(args.config)
+    runs = []
+    for name, net_config in networks_cfg.items():
+        net = tmpl.find_or_render(name, net_config)
+        if not _over_budget(name, net, args):
+            runs.append(SweepRun(name, net))
+    scheduler = _make_scheduler(caffe, args)
+    if args.rule == "halving":
+        strategy = SuccessiveHalving(scheduler, args.min_iter, eta=args.eta)
+    else:
+        strategy = MedianStopping(scheduler, grace_iter=args.min_iter)
+    print_sweep_summary(strategy.run(runs))
+
+
+def _evaluate_remote(args):
+    config = load_config(args.config)
+    executor = RemoteExecutor(args.workers.split(","))
+    tests = executor.run(_remote_tasks(config, 'test'))
+    times = executor.run(_remote_tasks(config, 'time'))
+    _print_remote_errors(tests + times)
+    if not all(r.ok for r in tests + times):
+        sys.exit(1)
+    return [(test.name, 100*test.value, time.value['avg_forward'],
+             time.value['avg_backward']) for test, time in zip(tests, times)]
+
+
+def run(args):
+    caffe, tmpl, networks_cfg = load_config_file(args.config)
+    cache = ResultCache()
+    if not args.no_cache:
+        caffe.set_cache(cache)
+    pipeline = Pipeline(caffe, tmpl, networks_cfg,
+                        slots=_make_slots(caffe, args),
+                        isolate_timing=not args.parallel_timing,
+                        file_digest=cache.file_digest)
+    stages = pipeline.run()
+    print_pipeline_summary(stages)
+    results = {}
+    for stage in stages:
+        if stage.done and stage.kind in ('test', 'time'):
+            results.setdefault(stage.name, {})[stage.kind] = stage.result
+    evaluates = [(name, 100*r['test'], r['time']['avg_forward'],
+                  r['time']['avg_backward'])
+                 for name, r in results.items() if len(r) == 2]
+    if evaluates:
+        print()
+        _print_evaluates(evaluates)
+    if not all(stage.done for stage in stages):
+        sys.exit(1)
+
+
+def _start_resident_worker(caffe, args):
+    if not args.resident:
+        return None
+    # one pycaffe process per job
+    worker = ResidentPool(caffe, args.jobs)
+    if not worker.available():
+        worker.close()
+        print("pycaffe is not available, using the caffe command line tool.")
+        return None
+    caffe.set_worker(worker)
+    return worker
 
 
 def evaluate(args):
+    if args.workers:
+        _print_evaluates(_evaluate_remote(args))
+        return
     caffe, tmpl, networks_cfg = load_config_file(args.config)
-    evaluates = []
+    if not args.no_cache:
+        caffe.set_cache(ResultCache())
+    evaluations = []
     for name, net_config in networks_cfg.items():
         net = tmpl.find_or_render(name, net_config)
+        if _over_budget(name, net, args):
+            continue
         if not net.weights():
             print("No weights found for the network `{}`.".format(name))
             print("You need to first train the networks before "
                   "evaluating them.")
             sys.exit(1)
-        accuracy = 100*caffe.test(net, weights=net.highest_iteration_weights())
-        time = caffe.time(net)
-        evaluates.append((name, accuracy, time['avg_forward'],
-                       time['avg_backward']))
+        evaluations.append(
+            Evaluation(name, net, net.highest_iteration_weights()))
+    worker = _start_resident_worker(caffe, args)
+    evaluator = AsyncEvaluator(caffe, jobs=args.jobs,
+                               isolate_timing=not args.parallel_timing)
+    evaluates = []
+    for e in evaluator.evaluate(evaluations):
+        evaluates.append((e.name, 100*e.accuracy, e.timings['avg_forward'],
+                          e.timings['avg_backward']))
+    if worker is not None:
+        worker.close()
+    _print_evaluates(evaluates)
+
+
+def select(args):
+    caffe, tmpl, networks_cfg = load_config_file(args.config)
+    if not args.no_cache:
+        caffe.set_cache(ResultCache())
+    evaluations = []
+    for name, net_config in networks_cfg.items():
+        net = tmpl.find_or_render(name, net_config)
+        if not net.weights():
+            print("Skipping `{}`, it has no weights.".format(name))
+            continue
+        evaluations.extend(selection.candidates(name, net,
+                                                args.all_snapshots))
+    worker = _start_resident_worker(caffe, args)
+    selection.evaluate(caffe, evaluations, jobs=args.jobs,
+                       isolate_timing=not args.parallel_timing)
+    if worker is not None:
+        worker.close()
+    front = selection.pareto_front(evaluations)
+    print("Pareto front of accuracy vs. forward / backward time:")
+    _print_selection(front)
+    if args.min_accuracy is not None:
+        best = selection.fastest(evaluations, args.min_accuracy)
+        query = "Fastest with accuracy >= {:.3f}%".format(
+            100 * args.min_accuracy)
+    else:
+        best = selection.most_accurate(evaluations, args.max_forward,
+                                       args.max_backward)
+        query = "Most accurate"
+        if args.max_forward is not None:
+            query += " under {} ms forward".format(args.max_forward)
+        if args.max_backward is not None:
+            query += " under {} ms backward".format(args.max_backward)
+    print("\n{}:".format(query))
+    if best is None:
+        print("No network satisfies the constraints.")
+        sys.exit(1)
+    _print_selection([best])
+
+
+def _print_selection(evaluations):
+    print("{:^20}|{:^16}|{:^18}|{:^18}| {}".format(
+        "name", "accuracy [%]", "avg_forward [ms]", "avg_backward [ms]",
+        "weights"))
+    print("-" * 20 + "+" + "-" * 16 + "+" + "-" * 18 + "+" + "-" * 18 + "+" +
+          "-" * 20)
+    for e in evaluations:
+        print("{:^20}|{:^16.3f}|{:^18.3f}|{:^18.3f}| {}".format(
+            e.name, 100 * e.accuracy, e.timings['avg_forward'],
+            e.timings['avg_backward'], os.path.basename(e.weights)))
+
+
+def _print_evaluates(evaluates):
     evaluates.sort(key=lambda s: s[0])
     print("{:^20}|{:^20}|{:^20}|{:^20}".format(
         "name", "accuracy [%]", "avg_forward [ms]", "avg_backward [ms]"))
@@ -60,6 +344,238 @@ def evaluate(args):
               .format(name, acc, avg_forward, avg_backward))
 
 
+def benchmark(args):
+    caffe, tmpl, networks_cfg = load_config_file(args.config)
+    bench = Benchmark(caffe, trials=args.trials, warmup=args.warmup,
+                      iterations=args.iterations)
+    store = BaselineStore()
+    results = {}
+    regressed = False
+    print("{:^20}|{:^28}|{:^28}|{:^12}".format(
+        "name", "forward [ms] median (CI)", "backward [ms] median (CI)",
+        "status"))
+    print("-" * 20 + "+" + "-" * 28 + "+" + "-" * 28 + "+" + "-" * 12)
+    for name, net_config in networks_cfg.items():
+        net = tmpl.find_or_render(name, net_config)
+        key = os.path.basename(net.directory)
+        result = bench.run(net)
+        results[key] = result
+        baseline = store.get(key)
+        if baseline is None:
+            status = "new"
+        elif find_regressions(baseline, result, args.threshold):
+            status = "REGRESSED"
+            regressed = True
+        else:
+            status = "ok"
+        print("{:^20}|{:^28}|{:^28}|{:^12}".format(
+            name, _format_stats(result['forward']),
+            _format_stats(result['backward']), status))
+        if baseline is not None:
+            for metric, old, new, change in find_regressions(
+                    baseline, result, args.threshold):
+                print("    {} {}: {:.3f} ms -> {:.3f} ms (+{:.1f}%)".format(
+                    name, metric, old, new, 100 * change))
+    if args.save_baseline:
+        store.save(results)
+    if regressed:
+        sys.exit(1)
+
+
+def _format_stats(stats):
+    return "{:.3f} ({:.3f}-{:.3f})".format(
+        stats['median'], stats['ci_low'], stats['ci_high'])
+
+
+def profile(args):
+    caffe, tmpl, networks_cfg = load_config_file(args.config)
+    if not args.no_cache:
+        caffe.set_cache(ResultCache())
+    reports = {}
+    variants = []
+    for name, net_config in networks_cfg.items():
+        net = tmpl.find_or_render(name, net_config)
+        report = caffe.time(net, iterations=args.iterations,
+                            use_train_model=args.train_model)
+        reports[name] = report
+        variants.append((net_config, report))
+        print_hottest_layers(name, report, top=args.top)
+        print()
+    if len(reports) > 1:
+        print_layer_comparison(reports)
+        print()
+        influence = variable_influence(variants)
+        if influence:
+            print("Correlation of template variables with the "
+                  "forward + backward time:")
+            for var, correlation in influence:
+                print("    {:<30}{:>+8.3f}".format(var, correlation))
+    if args.trace:
+        with open(args.trace, "w") as f:
+            json.dump(chrome_trace(reports), f)
+        print("Wrote trace to {}".format(args.trace))
+
+
+def cost(args):
+    # the cost model only needs the rendered prototxt files, not caffe
+    config = load_config(args.config)
+    tmpl = _load_template(config)
+    networks_cfg = config['networks']
+    input_shapes = parse_input_shapes(args.input_shape)
+    print("{:^20}|{:^14}|{:^12}|{:^18}|{:^16}".format(
+        "name", "params [M]", "GFLOPs", "activations [MB]", "params [MB]"))
+    print("-" * 20 + "+" + "-" * 14 + "+" + "-" * 12 + "+" + "-" * 18 + "+" +
+          "-" * 16)
+    costs = []
+    for name, net_config in networks_cfg.items():
+        net = tmpl.find_or_render(name, net_config)
+        net_cost = _analyze_net(name, net, input_shapes, args.train_model)
+        costs.append((name, net_cost))
+        print("{:^20}|{:^14.3f}|{:^12.3f}|{:^18.1f}|{:^16.1f}".format(
+            name, net_cost.params / 1e6, net_cost.flops / 1e9,
+            net_cost.activation_bytes / (1 << 20),
+            net_cost.param_bytes / (1 << 20)))
+    if not args.layers:
+        return
+    for name, net_cost in costs:
+        print("\n{}:".format(name))
+        print("    {:<24}{:<16}{:<22}{:>12}{:>12}".format(
+            "layer", "type", "output", "params", "MFLOPs"))
+        for layer in net_cost.layers:
+            shape = "x".join(str(d) for d in layer.output_shapes[0]) \
+                if layer.output_shapes else "-"
+            print("    {:<24}{:<16}{:<22}{:>12}{:>12.2f}{}".format(
+                layer.name, layer.type, shape, layer.params,
+                layer.flops / 1e6, " (estimated)" if layer.estimated else ""))
+
+
+def _format_optional(value, fmt):
+    if value is None:
+        return "-"
+    return fmt.format(value)
+
+
+def query(args):
+    registry = Registry()
+    if args.scan:
+        print("Registered {} networks.".format(registry.scan(NETWORKS_DIR)))
+    template = None
+    if args.config:
+        template = _load_template(load_config(args.config)).key()
+    records = registry.query(
+        args.sort, descending=(args.sort == 'accuracy') != args.reverse,
+        limit=args.limit,
+        template=template, status=args.status,
+        min_accuracy=args.min_accuracy, max_forward=args.max_forward)
+    print("{:^20}|{:^10}|{:^11}|{:^14}|{:^18}|{:^18}| {}".format(
+        "name", "status", "iteration", "accuracy [%]", "avg_forward [ms]",
+        "avg_backward [ms]", "directory"))
+    print("-" * 20 + "+" + "-" * 10 + "+" + "-" * 11 + "+" + "-" * 14 + "+" +
+          "-" * 18 + "+" + "-" * 18 + "+" + "-" * 20)
+    for r in records:
+        accuracy = None if r.accuracy is None else 100 * r.accuracy
+        print("{:^20}|{:^10}|{:^11}|{:^14}|{:^18}|{:^18}| {}".format(
+            r.name, r.status, r.iteration,
+            _format_optional(accuracy, "{:.3f}"),
+            _format_optional(r.avg_forward, "{:.3f}"),
+            _format_optional(r.avg_backward, "{:.3f}"), r.directory))
+
+
+def tune(args):
+    caffe, tmpl, networks_cfg = load_config_file(args.config)
+    if not args.no_cache:
+        caffe.set_cache(ResultCache())
+    name = args.network or next(iter(networks_cfg))
+    max_memory = None
+    if args.max_memory_mb is not None:
+        max_memory = args.max_memory_mb * (1 << 20)
+    tuner = ThroughputTuner(
+        caffe, tmpl, name, networks_cfg[name],
+        dict(parse_variable(v) for v in args.var),
+        max_latency=args.max_latency, max_memory=max_memory,
+        input_shapes=parse_input_shapes(args.input_shape),
+        iterations=args.iterations)
+    best = tuner.run()
+    variables = list(tuner.variables)
+    print("{:^30}|{:^12}|{:^18}|{:^14}|{:^10}".format(
+        ", ".join(variables), "batch", "avg_forward [ms]", "images / sec",
+        "feasible"))
+    print("-" * 30 + "+" + "-" * 12 + "+" + "-" * 18 + "+" + "-" * 14 + "+" +
+          "-" * 10)
+    for trial in tuner.trials:
+        print("{:^30}|{:^12}|{:^18}|{:^14}|{:^10}".format(
+            ", ".join(str(trial.args[v]) for v in variables),
+            trial.batch_size, _format_optional(trial.forward_ms, "{:.3f}"),
+            _format_optional(trial.images_per_sec, "{:.1f}"),
+            "yes" if trial.feasible else "no"))
+    if not best.feasible:
+        print("No configuration is within the limits.")
+        sys.exit(1)
+    print("Best: {} with {:.1f} images / sec".format(
+        {v: best.args[v] for v in variables}, best.images_per_sec))
+    # the config file of the user is never overwritten
+    if args.output is None:
+        print(yaml.safe_dump({'networks': {name: best.args}},
+                             default_flow_style=False, indent=2), end="")
+        return
+    config = load_config(args.config)
+    config['networks'][name] = best.args
+    with open(args.output, "w") as f:
+        yaml.safe_dump(config, f, default_flow_style=False, indent=2)
+    print("Wrote the configuration to {}".format(args.output))
+
+
+def archive(args):
+    config = load_config(args.config)
+    tmpl = _load_template(config)
+    registry = Registry()
+    policy = RetentionPolicy(keep_last=args.keep_last,
+                             keep_best=not args.no_keep_best,
+                             keep_every=args.keep_every)
+    for name, net_config in config['networks'].items():
+        net = tmpl.find_or_render(name, net_config)
+        archived = archive_snapshots(net, policy)
+        print("{:^20}| archived {} snapshot files, kept {}".format(
+            name, len(archived), len(net.weights())))
+        try:
+            registry.sync_snapshots(net)
+        except KeyError:
+            pass
+
+
+def verify(args):
+    directories = sorted(glob.glob(os.path.join(NETWORKS_DIR, "*", "*")))
+    store = BlobStore()
+    problems = store.verify(directories, repair=args.repair)
+    for directory, name, problem in problems:
+        print("{}: {}".format(os.path.join(directory, name), problem))
+    print("Checked {} networks, {} problems found.".format(
+        len(directories), len(problems)))
+    if args.prune:
+        print("Removed {} unused blobs.".format(store.prune(directories)))
+    if any(not problem.endswith("repaired") for _, _, problem in problems):
+        sys.exit(1)
+
+
+def worker(args):
+    host, port = parse_address(args.address)
+    if host not in ("127.0.0.1", "localhost", "::1"):
+        print("WARNING: the worker has no authentication. Everybody who can "
+              "reach {} can train and render networks of the allowed "
+              "templates on this machine. Only bind to other addresses "
+              "than localhost in a trusted network.".format(args.address),
+              file=sys.stderr)
+    runner = TaskRunner(templates=args.template or [],
+                        caffe_repos=args.caffe_repo or [],
+                        allow_download_script=args.allow_download_script)
+    server = WorkerServer((host, port), runner)
+    print("caffemachine worker listening on {}".format(server.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
 def extract(args):
     tmpl = CaffeTemplate(args.git_url)
     last_part = args.git_url.split("/")[-1]
@@ -84,6 +600,56 @@ def extract(args):
     print(yaml.dump(config, default_flow_style=False, indent=2))
 
 
+def _add_slot_arguments(parser):
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='number of networks to train in parallel.')
+    parser.add_argument(
+        '--cpu-group', action='append',
+        help='cpu ids of one resource slot, e.g. `0-7,16-23`. '
+             'Can be given multiple times.')
+    parser.add_argument(
+        '--gpus', help='comma separated gpu ids, one per resource slot.')
+    parser.add_argument(
+        '--metrics',
+        help='host:port to serve the training progress on, in the '
+             'Prometheus text format at /metrics and as json at '
+             '/metrics.json.')
+
+
+def _add_input_shape_argument(parser):
+    parser.add_argument(
+        '--input-shape', action='append',
+        help='shape of an input blob, e.g. `data=1,3,224,224`. Required '
+             'for data layers without a fixed shape. Can be repeated.')
+
+
+def _add_budget_arguments(parser):
+    parser.add_argument(
+        '--max-gflops', type=float,
+        help='skip networks whose estimated forward pass needs more GFLOPs.')
+    parser.add_argument(
+        '--max-memory-mb', type=float,
+        help='skip networks whose estimated activation and parameter '
+             'memory is larger.')
+    _add_input_shape_argument(parser)
+
+
+def _add_resident_argument(parser):
+    parser.add_argument(
+        '--resident', action='store_true',
+        help='test and time in one long-lived pycaffe process that keeps '
+             'the networks loaded. Uses the caffe command line tool if '
+             'pycaffe is not available.')
+
+
+def _add_workers_argument(parser):
+    parser.add_argument(
+        '--workers',
+        help='comma separated `host:port` list of caffemachine workers. '
+             'The networks are distributed across the workers.')
+
+
 def arg_parser():
     parser = argparse.ArgumentParser(prog="caffemachine")
     subparsers = parser.add_subparsers()
@@ -95,13 +661,262 @@ def arg_parser():
 
     train_parser = subparsers.add_parser('train', help='trains a network.')
     train_parser.add_argument('config', help='config file')
+    train_parser.add_argument(
+        '--restart', action='store_true',
+        help='train from iteration 0 instead of resuming from the latest '
+             'snapshot.')
+    _add_slot_arguments(train_parser)
+    _add_workers_argument(train_parser)
     train_parser.set_defaults(func=train)
 
+    sweep_parser = subparsers.add_parser(
+        'sweep', help='trains all networks and stops the underperforming '
+                      'ones early.')
+    sweep_parser.add_argument('config', help='config file')
+    sweep_parser.add_argument(
+        '--rule', choices=['halving', 'median'], default='halving',
+        help='successive halving or median stopping. (default: halving)')
+    sweep_parser.add_argument(
+        '--min-iter', type=int, default=500,
+        help='iterations of the first halving rung, or the grace period '
+             'of the median rule. (default: 500)')
+    sweep_parser.add_argument(
+        '--eta', type=int, default=3,
+        help='only the best 1/eta runs are promoted to the next rung. '
+             '(default: 3)')
+    _add_slot_arguments(sweep_parser)
+    _add_budget_arguments(sweep_parser)
+    sweep_parser.set_defaults(func=sweep)
+
     evaluate_parser = subparsers.add_parser(
         'evaluate', help='evaluates the accuracy and the forward / backward '
                          'timings of the networks')
     evaluate_parser.add_argument('config', help='config file')
+    evaluate_parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='number of caffe processes to run in parallel.')
+    evaluate_parser.add_argument(
+        '--parallel-timing', action='store_true',
+        help='run the timing jobs in parallel with the other jobs. '
+             'Faster, but the timings are skewed by the parallel load.')
+    evaluate_parser.add_argument(
+        '--no-cache', action='store_true',
+        help='do not use cached test / time results.')
+    _add_resident_argument(evaluate_parser)
+    _add_budget_arguments(evaluate_parser)
+    _add_workers_argument(evaluate_parser)
     evaluate_parser.set_defaults(func=evaluate)
+
+    run_parser = subparsers.add_parser(
+        'run', help='renders, trains, tests and times the networks, but only '
+                    'the stages whose inputs changed since the last run.')
+    run_parser.add_argument('config', help='config file')
+    run_parser.add_argument(
+        '--parallel-timing', action='store_true',
+        help='run the timing jobs in parallel with the other jobs. '
+             'Faster, but the timings are skewed by the parallel load.')
+    run_parser.add_argument(
+        '--no-cache', action='store_true',
+        help='do not use cached test / time results.')
+    _add_slot_arguments(run_parser)
+    run_parser.set_defaults(func=run)
+
+    select_parser = subparsers.add_parser(
+        'select', help='evaluates the networks and shows the pareto front '
+                       'of accuracy vs. latency.')
+    select_parser.add_argument('config', help='config file')
+    select_parser.add_argument(
+        '--max-forward', type=float,
+        help='pick the most accurate network under this forward time in ms.')
+    select_parser.add_argument(
+        '--max-backward', type=float,
+        help='pick the most accurate network under this backward time in '
+             'ms.')
+    select_parser.add_argument(
+        '--min-accuracy', type=float,
+        help='pick the fastest network with at least this accuracy '
+             'between 0 and 1.')
+    select_parser.add_argument(
+        '--all-snapshots', action='store_true',
+        help='consider every snapshot, not only the latest one.')
+    select_parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='number of caffe processes to run in parallel.')
+    select_parser.add_argument(
+        '--parallel-timing', action='store_true',
+        help='run the timing jobs in parallel with the other jobs.')
+    select_parser.add_argument(
+        '--no-cache', action='store_true',
+        help='do not use cached test / time results.')
+    _add_resident_argument(select_parser)
+    select_parser.set_defaults(func=select)
+
+    cost_parser = subparsers.add_parser(
+        'cost', help='estimates the parameters, flops and memory of the '
+                     'networks from their prototxt files, without caffe.')
+    cost_parser.add_argument('config', help='config file')
+    cost_parser.add_argument(
+        '--layers', action='store_true',
+        help='also print the cost of every layer.')
+    cost_parser.add_argument(
+        '--train-model', action='store_true',
+        help='analyze train.prototxt instead of deploy.prototxt.')
+    _add_input_shape_argument(cost_parser)
+    cost_parser.set_defaults(func=cost)
+
+    benchmark_parser = subparsers.add_parser(
+        'benchmark', help='measures the forward / backward timings with '
+                          'repeated trials and compares them to the '
+                          'stored baselines.')
+    benchmark_parser.add_argument('config', help='config file')
+    benchmark_parser.add_argument(
+        '--trials', type=int, default=10,
+        help='number of `caffe time` runs per network. (default: 10)')
+    benchmark_parser.add_argument(
+        '--warmup', type=int, default=1,
+        help='number of discarded warmup runs. (default: 1)')
+    benchmark_parser.add_argument(
+        '--iterations', type=int, default=10,
+        help='iterations of every `caffe time` run. (default: 10)')
+    benchmark_parser.add_argument(
+        '--threshold', type=float, default=0.05,
+        help='relative slowdown of the median that counts as a regression. '
+             '(default: 0.05)')
+    benchmark_parser.add_argument(
+        '--save-baseline', action='store_true',
+        help='store the results as the new baselines.')
+    benchmark_parser.set_defaults(func=benchmark)
+
+    profile_parser = subparsers.add_parser(
+        'profile', help='shows the most expensive layers of every network '
+                        'and compares them across the networks.')
+    profile_parser.add_argument('config', help='config file')
+    profile_parser.add_argument(
+        '--top', type=int, default=10,
+        help='number of layers to show per network. (default: 10)')
+    profile_parser.add_argument(
+        '--iterations', type=int, default=10,
+        help='iterations of `caffe time`. (default: 10)')
+    profile_parser.add_argument(
+        '--train-model', action='store_true',
+        help='profile train.prototxt instead of deploy.prototxt.')
+    profile_parser.add_argument(
+        '--trace', help='write a Chrome trace event json file, e.g. for '
+                        'chrome://tracing or speedscope.')
+    profile_parser.add_argument(
+        '--no-cache', action='store_true',
+        help='do not use cached timings.')
+    profile_parser.set_defaults(func=profile)
+
+    query_parser = subparsers.add_parser(
+        'query', help='lists the registered networks and their results.')
+    query_parser.add_argument(
+        'config', nargs='?',
+        help='only list the networks of the template of this config file.')
+    query_parser.add_argument(
+        '--sort', default='accuracy',
+        choices=['accuracy', 'forward', 'backward', 'iteration', 'name',
+                 'updated'],
+        help='most accurate first, smallest first otherwise. '
+             '(default: accuracy)')
+    query_parser.add_argument(
+        '--reverse', action='store_true',
+        help='reverse the order.')
+    query_parser.add_argument('--limit', type=int,
+                              help='show at most this many networks.')
+    query_parser.add_argument(
+        '--status', choices=['rendered', 'training', 'stopped', 'trained',
+                             'failed'])
+    query_parser.add_argument(
+        '--min-accuracy', type=float,
+        help='minimal test accuracy between 0 and 1.')
+    query_parser.add_argument(
+        '--max-forward', type=float,
+        help='maximal average forward time in ms.')
+    query_parser.add_argument(
+        '--scan', action='store_true',
+        help='first register the networks rendered before the registry '
+             'existed.')
+    query_parser.set_defaults(func=query)
+
+    tune_parser = subparsers.add_parser(
+        'tune', help='searches template variables like the batch size for '
+                     'the highest forward throughput.')
+    tune_parser.add_argument('config', help='config file')
+    tune_parser.add_argument(
+        '--var', action='append', required=True,
+        help='template variable and its candidate values in order, e.g. '
+             '`batch_size=1,2,4,8,16,32,64`. Can be repeated.')
+    tune_parser.add_argument(
+        '--network', help='network of the config file to tune. '
+                          '(default: the first one)')
+    tune_parser.add_argument(
+        '--max-latency', type=float,
+        help='maximal average forward time of one batch in ms.')
+    tune_parser.add_argument(
+        '--max-memory-mb', type=float,
+        help='maximal estimated activation and parameter memory.')
+    tune_parser.add_argument(
+        '--iterations', type=int, default=10,
+        help='iterations of `caffe time`. (default: 10)')
+    tune_parser.add_argument(
+        '--output', help='write the config file with the tuned network '
+                         'here. Otherwise only the network is printed.')
+    tune_parser.add_argument(
+        '--no-cache', action='store_true',
+        help='do not use cached timings.')
+    _add_input_shape_argument(tune_parser)
+    tune_parser.set_defaults(func=tune)
+
+    archive_parser = subparsers.add_parser(
+        'archive', help='moves old snapshots into a compressed archive. '
+                        'They are restored when they are needed again.')
+    archive_parser.add_argument('config', help='config file')
+    archive_parser.add_argument(
+        '--keep-last', type=int, default=3,
+        help='number of latest snapshots to keep. (default: 3)')
+    archive_parser.add_argument(
+        '--keep-every', type=int,
+        help='also keep the snapshots of every multiple of this iteration.')
+    archive_parser.add_argument(
+        '--no-keep-best', action='store_true',
+        help='do not keep the snapshot with the best test accuracy.')
+    archive_parser.set_defaults(func=archive)
+
+    verify_parser = subparsers.add_parser(
+        'verify', help='checks that the files of the rendered networks match '
+                       'the shared blob store.')
+    verify_parser.add_argument(
+        '--repair', action='store_true',
+        help='restore broken blobs from the templates and link broken '
+             'files again.')
+    verify_parser.add_argument(
+        '--prune', action='store_true',
+        help='remove blobs that no network uses anymore.')
+    verify_parser.set_defaults(func=verify)
+
+    worker_parser = subparsers.add_parser(
+        'worker', help='runs a worker daemon that executes render / train / '
+                       'test / time jobs of a remote caffemachine.')
+    worker_parser.add_argument(
+        'address', nargs='?', default='127.0.0.1:7341',
+        help='host:port to listen on. The worker has no authentication, '
+             'keep the default unless the network is trusted. '
+             '(default: 127.0.0.1:7341)')
+    worker_parser.add_argument(
+        '--template', action='append',
+        help='git url of a template the worker accepts tasks for. Can be '
+             'given multiple times. Tasks of other templates are rejected.')
+    worker_parser.add_argument(
+        '--caffe-repo', action='append',
+        help='caffe git repository the worker may build. Can be given '
+             'multiple times. Tasks without a caffe repository use the '
+             'system caffe or the upstream repository.')
+    worker_parser.add_argument(
+        '--allow-download-script', action='store_true',
+        help='run the `get_data.sh` of the allowed templates. Otherwise '
+             'tasks of templates that need it fail.')
+    worker_parser.set_defaults(func=worker)
     return parser
 
 
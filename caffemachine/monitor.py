@@ -0,0 +1,248 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import http.server
+import json
+import os
+import threading
+import time
+
+from .logparser import TrainRecord
+
+_clock_ticks = os.sysconf("SC_CLK_TCK")
+_page_size = os.sysconf("SC_PAGE_SIZE")
+# seconds between two samples of the process stats during the training
+stats_interval = 1.0
+
+
+def process_stats(pid):
+    """Returns the cpu seconds and the resident memory in bytes of `pid`
+    from /proc, or None if the process is gone."""
+    try:
+        with open("/proc/{}/stat".format(pid), "r") as f:
+            stat = f.read()
+        with open("/proc/{}/statm".format(pid), "r") as f:
+            statm = f.read().split()
+    except OSError:
+        return None
+    # the command name in parentheses may contain spaces
+    fields = stat[stat.rindex(")") + 2:].split()
+    utime, stime = int(fields[11]), int(fields[12])
+    return {'cpu_seconds': (utime + stime) / _clock_ticks,
+            'rss_bytes': int(statm[1]) * _page_size}
+
+
+class _RunStatus(object):
+    def __init__(self, name, pid, max_iter):
+        self.name = name
+        self.pid = pid
+        self.max_iter = max_iter
+        self.running = True
+        self.returncode = None
+        self.iteration = None
+        self.loss = None
+        self.lr = None
+        self.test_accuracy = None
+        self.test_loss = None
+        self._first = None
+        self._last_time = None
+        # the last known process stats, kept after the process exited
+        self._stats = None
+        self._stats_time = None
+
+    def update(self, record, now):
+        # sampled while caffe runs, the process is gone once it is scraped
+        # after the training
+        if self._stats_time is None or \
+                now - self._stats_time > stats_interval:
+            self.stats()
+            self._stats_time = now
+        if type(record) == TrainRecord:
+            self.iteration = record.iteration
+            if record.loss is not None:
+                self.loss = record.loss
+            if record.lr is not None:
+                self.lr = record.lr
+            if self._first is None:
+                self._first = (record.iteration, now)
+            self._last_time = now
+        else:
+            self.test_accuracy = record.accuracy
+            self.test_loss = record.loss
+
+    def iterations_per_sec(self):
+        if self._first is None or self._last_time == self._first[1]:
+            return None
+        first_iteration, first_time = self._first
+        return (self.iteration - first_iteration) / \
+            (self._last_time - first_time)
+
+    def eta_seconds(self):
+        rate = self.iterations_per_sec()
+        if not self.running or not rate or self.max_iter is None:
+            return None
+        return max(self.max_iter - self.iteration, 0) / rate
+
+    def stats(self):
+        if self.running:
+            stats = process_stats(self.pid)
+            if stats is not None:
+                self._stats = stats
+        return self._stats or {}
+
+    def as_dict(self):
+        stats = self.stats()
+        return {
+            'network': self.name,
+            'running': self.running,
+            'returncode': self.returncode,
+            'iteration': self.iteration,
+            'max_iter': self.max_iter,
+            'loss': self.loss,
+            'lr': self.lr,
+            'test_accuracy': self.test_accuracy,
+            'test_loss': self.test_loss,
+            'iterations_per_sec': self.iterations_per_sec(),
+            'eta_seconds': self.eta_seconds(),
+            'cpu_seconds': stats.get('cpu_seconds'),
+            'rss_bytes': stats.get('rss_bytes'),
+        }
+
+
+# (metric name, key in `_RunStatus.as_dict`, type, help)
+_metrics = [
+    ('caffemachine_iteration', 'iteration', 'gauge',
+     'Latest training iteration.'),
+    ('caffemachine_max_iter', 'max_iter', 'gauge',
+     'max_iter of the solver.'),
+    ('caffemachine_loss', 'loss', 'gauge', 'Latest training loss.'),
+    ('caffemachine_learning_rate', 'lr', 'gauge', 'Latest learning rate.'),
+    ('caffemachine_test_accuracy', 'test_accuracy', 'gauge',
+     'Accuracy of the latest test run.'),
+    ('caffemachine_test_loss', 'test_loss', 'gauge',
+     'Loss of the latest test run.'),
+    ('caffemachine_iterations_per_second', 'iterations_per_sec', 'gauge',
+     'Training iterations per second since the start of the process.'),
+    ('caffemachine_eta_seconds', 'eta_seconds', 'gauge',
+     'Estimated seconds until max_iter is reached.'),
+    ('caffemachine_running', 'running', 'gauge',
+     '1 while the caffe process is running.'),
+    ('caffemachine_process_cpu_seconds_total', 'cpu_seconds', 'counter',
+     'User and system cpu time of the caffe process.'),
+    ('caffemachine_process_resident_memory_bytes', 'rss_bytes', 'gauge',
+     'Resident memory of the caffe process.'),
+]
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"") \
+        .replace("\n", "\\n")
+
+
+class TrainingMonitor(object):
+    """Collects the progress of the running `caffe train` processes.
+    `Caffe.train` reports to it if it is set with `Caffe.set_monitor`."""
+
+    def __init__(self):
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _name(net):
+        return os.path.basename(os.path.normpath(net.directory))
+
+    def start(self, net, pid):
+        with self._lock:
+            self._runs[self._name(net)] = _RunStatus(
+                self._name(net), pid, net.max_iter())
+
+    def update(self, net, record):
+        now = time.time()
+        with self._lock:
+            self._runs[self._name(net)].update(record, now)
+
+    def finish(self, net, returncode):
+        with self._lock:
+            run = self._runs[self._name(net)]
+            run.running = False
+            run.returncode = returncode
+
+    def snapshot(self):
+        with self._lock:
+            runs = list(self._runs.values())
+        return [run.as_dict() for run in runs]
+
+    def prometheus(self):
+        runs = self.snapshot()
+        lines = []
+        for metric, key, metric_type, help_text in _metrics:
+            lines.append("# HELP {} {}".format(metric, help_text))
+            lines.append("# TYPE {} {}".format(metric, metric_type))
+            for run in runs:
+                value = run[key]
+                if value is None:
+                    continue
+                lines.append('{}{{network="{}"}} {}'.format(
+                    metric, _escape_label(run['network']), float(value)))
+        return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        monitor = self.server.monitor
+        if self.path == "/metrics":
+            body = monitor.prometheus().encode('utf-8')
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body = json.dumps(monitor.snapshot()).encode('utf-8')
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes would clutter the training output
+        pass
+
+
+class MetricsServer(http.server.ThreadingHTTPServer):
+    """Serves `/metrics` in the Prometheus text format and `/metrics.json`
+    from a background thread."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, monitor):
+        super().__init__(address, _MetricsHandler)
+        self.monitor = monitor
+        self._thread = None
+
+    @property
+    def address(self):
+        return "{}:{}".format(*self.server_address[:2])
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        kwargs={'poll_interval': 0.1},
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -12,11 +12,96 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import glob
+import bisect
 import json
+import os
 import re
+import tempfile
+import threading
+import time
+import zipfile
 
 _iter_re = re.compile("(\d+)\.caffemodel")
+_snapshot_re = re.compile(r"(\d+)\.(caffemodel|solverstate)$")
+
+
+class SnapshotIndex(object):
+    _indices = {}
+    _indices_lock = threading.Lock()
+
+    # directories modified less than this many seconds before a scan are
+    # rescanned next time, the mtime resolution of some filesystems is coarse.
+    mtime_resolution = 2
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._mtime = None
+        self._names = set()
+        self._files = {}
+        self._iterations = {'caffemodel': [], 'solverstate': []}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def of(cls, directory):
+        key = os.path.realpath(directory)
+        with cls._indices_lock:
+            if key not in cls._indices:
+                cls._indices[key] = cls(directory)
+            return cls._indices[key]
+
+    def refresh(self):
+        with self._lock:
+            mtime = os.stat(self.directory).st_mtime_ns
+            if mtime == self._mtime:
+                return
+            names = set(os.listdir(self.directory))
+            changed = set()
+            for name in self._names - names:
+                match = _snapshot_re.search(name)
+                if match:
+                    key = (int(match.group(1)), match.group(2))
+                    if self._files.get(key) == name:
+                        del self._files[key]
+                        changed.add(key[1])
+            for name in names - self._names:
+                match = _snapshot_re.search(name)
+                if match:
+                    key = (int(match.group(1)), match.group(2))
+                    self._files[key] = name
+                    changed.add(key[1])
+            self._names = names
+            for kind in changed:
+                # only the new snapshots are parsed, the sort of the already
+                # nearly sorted iterations is linear.
+                self._iterations[kind] = sorted(
+                    i for i, k in self._files if k == kind)
+            if time.time() - mtime / 1e9 < self.mtime_resolution:
+                self._mtime = None
+            else:
+                self._mtime = mtime
+
+    def _path(self, iteration, kind):
+        return os.path.join(self.directory, self._files[(iteration, kind)])
+
+    def iterations(self, kind='caffemodel'):
+        self.refresh()
+        return list(self._iterations[kind])
+
+    def files(self, kind='caffemodel', start=None, stop=None):
+        """Snapshot files with `start <= iteration < stop`, sorted."""
+        self.refresh()
+        iterations = self._iterations[kind]
+        lo = 0 if start is None else bisect.bisect_left(iterations, start)
+        hi = len(iterations) if stop is None else \
+            bisect.bisect_left(iterations, stop)
+        return [self._path(i, kind) for i in iterations[lo:hi]]
+
+    def latest(self, kind='caffemodel'):
+        self.refresh()
+        iterations = self._iterations[kind]
+        if not iterations:
+            return None
+        return self._path(iterations[-1], kind)
 
 
 class CaffeNet(object):
@@ -40,16 +125,114 @@ class CaffeNet(object):
     def template_args_file(self):
         return self.directory + "/template_args.json"
 
+    def train_log_file(self):
+        return self.directory + "/train.log.gz"
+
+    def metrics_file(self):
+        return self.directory + "/metrics.csv"
+
+    def train_state_file(self):
+        return self.directory + "/train_state.json"
+
+    def snapshot_archive_file(self):
+        return self.directory + "/snapshots.zip"
+
+    def latest_iteration(self):
+        weights = self.snapshot_index().latest('caffemodel')
+        if weights is None:
+            return 0
+        return self.iteration_of_weights(weights)
+
+    def is_trained(self):
+        max_iter = self.max_iter()
+        try:
+            with open(self.train_state_file(), "r") as f:
+                state = json.load(f)
+            if state.get('completed') and state.get('max_iter') == max_iter:
+                return True
+        except (OSError, ValueError):
+            pass
+        return max_iter is not None and self.latest_iteration() >= max_iter
+
+    def mark_trained(self):
+        state = {
+            'completed': True,
+            'iteration': self.latest_iteration(),
+            'max_iter': self.max_iter(),
+        }
+        with open(self.train_state_file(), "w") as f:
+            json.dump(state, f, indent=4)
+
+    def solver_param(self, name):
+        param_re = re.compile(r"^\s*{}\s*:\s*(\S+)".format(re.escape(name)),
+                              re.MULTILINE)
+        with open(self.solver_file(), "r") as f:
+            match = param_re.search(f.read())
+        if match is None:
+            return None
+        return match.group(1).strip('"')
+
+    def max_iter(self):
+        max_iter = self.solver_param("max_iter")
+        if max_iter is None:
+            return None
+        return int(max_iter)
+
     @staticmethod
     def iteration_of_weights(caffemodel):
         match = re.search(_iter_re, caffemodel)
         return int(match.group(1))
 
-    def weights(self):
-        weights = glob.glob(self.directory + "/*.caffemodel")
-        weights.sort(key=lambda caffemodel: self.iteration_of_weights(caffemodel))
-        return weights
+    def snapshot_index(self):
+        return SnapshotIndex.of(self.directory)
+
+    def weights(self, start=None, stop=None):
+        return self.snapshot_index().files('caffemodel', start, stop)
 
     def highest_iteration_weights(self):
-        return self.weights()[-1]
+        weights = self.snapshot_index().latest('caffemodel')
+        if weights is None:
+            raise IndexError("No weights found in {}".format(self.directory))
+        return weights
+
+    def solverstates(self, start=None, stop=None):
+        return self.snapshot_index().files('solverstate', start, stop)
+
+    def latest_solverstate(self):
+        return self.snapshot_index().latest('solverstate')
+
+    def archived_snapshots(self, kind='caffemodel'):
+        """Paths of the archived snapshots, sorted by iteration. They are
+        restored with `restore_snapshot`."""
+        try:
+            with zipfile.ZipFile(self.snapshot_archive_file()) as archive:
+                names = archive.namelist()
+        except FileNotFoundError:
+            return []
+        snapshots = []
+        for name in names:
+            match = _snapshot_re.search(name)
+            if match and match.group(2) == kind:
+                snapshots.append((int(match.group(1)),
+                                  os.path.join(self.directory, name)))
+        return [path for _, path in sorted(snapshots)]
 
+    def restore_snapshot(self, snapshot):
+        """Extracts `snapshot` from the archive if it is not in the network
+        directory. Returns False if it is in neither."""
+        if os.path.exists(snapshot):
+            return True
+        name = os.path.basename(snapshot)
+        try:
+            with zipfile.ZipFile(self.snapshot_archive_file()) as archive:
+                if name not in archive.namelist():
+                    return False
+                fd, tmp = tempfile.mkstemp(dir=self.directory,
+                                           suffix=".tmp")
+                with os.fdopen(fd, "wb") as f, archive.open(name) as member:
+                    for block in iter(lambda: member.read(1 << 20), b''):
+                        f.write(block)
+        except FileNotFoundError:
+            return False
+        os.replace(tmp, os.path.join(self.directory, name))
+        return True
@@ -0,0 +1,323 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Brings networks up to date like make does.
+
+Every network has four stages: render -> train -> test and render -> time.
+The inputs of a stage are hashed: the template files and args for render,
+the rendered prototxt files for train, the weights, the model and the caffe
+executable for test and time. A stage only runs if the hash differs from the
+one recorded in the `pipeline.json` of the network directory. Stages of
+different networks and the time stage of a network still in training run in
+parallel.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import traceback
+
+from .cache import ResultCache, _atomic_write_json
+from .network import CaffeNet
+from .scheduler import Slot, caffe_for_slot
+
+STAGES = ('render', 'train', 'test', 'time')
+
+
+def file_sha1(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _digest(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True)
+                        .encode('utf-8')).hexdigest()
+
+
+class Stage(object):
+    def __init__(self, name, kind, net, deps, inputs, run, outputs=None,
+                 is_valid=None, exclusive=False):
+        # `inputs(caffe)` returns the json inputs of the stage,
+        # `run(caffe, changed)` does the work and returns the json result.
+        # Stages that write files have `outputs()`, it hashes the files and
+        # is the result of the stage, also if the stage is up to date.
+        self.name = name
+        self.kind = kind
+        self.net = net
+        self.deps = deps
+        self.inputs = inputs
+        self.run = run
+        self.outputs = outputs
+        self.is_valid = is_valid
+        # exclusive stages run while no other stage runs
+        self.exclusive = exclusive
+        self.status = None
+        self.result = None
+        self.error = None
+
+    @property
+    def done(self):
+        return self.status in ('ran', 'up to date')
+
+    @property
+    def finished(self):
+        return self.status is not None
+
+
+def state_file(net):
+    return os.path.join(net.directory, "pipeline.json")
+
+
+class Pipeline(object):
+    def __init__(self, caffe, tmpl, networks, slots=None, isolate_timing=True,
+                 test_iterations=None, time_iterations=10, file_digest=None,
+                 output=None):
+        if slots is None:
+            slots = [Slot()]
+        self.caffe = caffe
+        self.tmpl = tmpl
+        self.networks = networks
+        self.slots = slots
+        self.isolate_timing = isolate_timing
+        self.test_iterations = test_iterations
+        self.time_iterations = time_iterations
+        self.file_digest = file_digest or file_sha1
+        self.output = output or sys.stdout
+        self._state_lock = threading.Lock()
+        self._template_digest = None
+
+    def _caffe_identity(self, caffe):
+        return ResultCache.executable_identity(caffe.executable,
+                                               caffe.caffe_ld_path)
+
+    def template_digest(self):
+        # the checkout does not change while the pipeline runs
+        if self._template_digest is None:
+            files = {}
+            template_dir = self.tmpl.template_dir
+            for root, dirs, names in os.walk(template_dir):
+                # the downloaded data is linked, not rendered
+                dirs[:] = [d for d in dirs if d not in (".git", "data")
+                           or root != template_dir]
+                for name in names:
+                    path = os.path.join(root, name)
+                    if name == ".git" or not os.path.isfile(path):
+                        continue
+                    files[os.path.relpath(path, template_dir)] = \
+                        self.file_digest(path)
+            self._template_digest = _digest(files)
+        return self._template_digest
+
+    def _model_digest(self, net):
+        return _digest({os.path.basename(f): self.file_digest(f)
+                        for f in (net.solver_file(), net.train_file(),
+                                  net.test_file()) if os.path.exists(f)})
+
+    def _load_state(self, net):
+        try:
+            with open(state_file(net), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, net, kind, inputs, result):
+        with self._state_lock:
+            state = self._load_state(net)
+            state[kind] = {'inputs': inputs, 'result': result}
+            _atomic_write_json(state_file(net), state)
+
+    def _train_log(self, net):
+        if len(self.slots) > 1:
+            return open(os.path.join(net.directory, "train_output.log"), "w")
+        return None
+
+    @staticmethod
+    def _move_outdated(net, render_digest):
+        # snapshots of an older version of the model are kept, but tests
+        # must not pick them up
+        outdated = os.path.join(net.directory, "outdated", render_digest[:12])
+        for path in net.weights() + net.solverstates() + \
+                [net.train_state_file()]:
+            if os.path.exists(path):
+                os.makedirs(outdated, exist_ok=True)
+                os.replace(path, os.path.join(outdated,
+                                              os.path.basename(path)))
+
+    def network_stages(self, name, template_args):
+        net = CaffeNet(self.tmpl._network_dir(name, template_args),
+                       template_args=template_args)
+
+        def render(caffe, changed):
+            self.tmpl.render(name, template_args)
+
+        def train(caffe, changed):
+            if changed:
+                recorded = self._load_state(net)['train']['inputs']
+                self._move_outdated(net, recorded['model'])
+            log = self._train_log(net)
+            try:
+                returncode = caffe.resume(net, output=log)
+            finally:
+                if log is not None:
+                    log.close()
+            if returncode != 0:
+                raise RuntimeError("caffe train exited with {}"
+                                   .format(returncode))
+
+        def weights():
+            weights = net.highest_iteration_weights()
+            return {'weights': weights, 'digest': self.file_digest(weights)}
+
+        def test(caffe, changed):
+            return caffe.test(net, train_stage.result['weights'],
+                              iterations=self.test_iterations)
+
+        def time(caffe, changed):
+            report = dict(caffe.time(net, iterations=self.time_iterations))
+            report.pop('log', None)
+            return report
+
+        def time_inputs(caffe):
+            cpus = sorted(caffe.cpus) if caffe.cpus is not None else None
+            return {'model': render_stage.result,
+                    'caffe': self._caffe_identity(caffe),
+                    'gpus': caffe._get_gpus_as_str(), 'cpus': cpus,
+                    'iterations': self.time_iterations}
+
+        render_stage = Stage(
+            name, 'render', net, [],
+            lambda caffe: {'template': self.template_digest(),
+                           'args': template_args},
+            render, outputs=lambda: self._model_digest(net),
+            is_valid=lambda: os.path.exists(net.solver_file()))
+        train_stage = Stage(
+            name, 'train', net, [render_stage],
+            lambda caffe: {'model': render_stage.result},
+            train, outputs=weights, is_valid=net.is_trained)
+        test_stage = Stage(
+            name, 'test', net, [train_stage],
+            lambda caffe: {'model': render_stage.result,
+                           'weights': train_stage.result['digest'],
+                           'caffe': self._caffe_identity(caffe),
+                           'iterations': self.test_iterations},
+            test)
+        # the timing only needs the rendered model, not the weights
+        time_stage = Stage(name, 'time', net, [render_stage], time_inputs,
+                           time, exclusive=self.isolate_timing)
+        return [render_stage, train_stage, test_stage, time_stage]
+
+    def stages(self):
+        stages = []
+        for name, template_args in self.networks.items():
+            stages.extend(self.network_stages(name, template_args))
+        return stages
+
+    def _execute(self, stage, caffe):
+        try:
+            inputs = stage.inputs(caffe)
+            recorded = self._load_state(stage.net).get(stage.kind)
+            if recorded is not None and recorded['inputs'] == inputs and \
+                    (stage.is_valid is None or stage.is_valid()):
+                stage.result = recorded['result']
+                if stage.outputs is not None:
+                    stage.result = stage.outputs()
+                stage.status = 'up to date'
+                return
+            changed = recorded is not None and recorded['inputs'] != inputs
+            print("[{}] {}".format(stage.name, stage.kind), file=self.output,
+                  flush=True)
+            stage.result = stage.run(caffe, changed)
+            if stage.outputs is not None:
+                stage.result = stage.outputs()
+            self._save_state(stage.net, stage.kind, inputs, stage.result)
+            stage.status = 'ran'
+        except (Exception, SystemExit):
+            # `Caffe.time` exits if caffe fails
+            stage.error = traceback.format_exc()
+            stage.status = 'failed'
+
+    def _next_stage(self, pending, running):
+        # called with the lock held. Returns None if nothing can start now.
+        for stage in list(pending):
+            if any(dep.finished and not dep.done for dep in stage.deps):
+                stage.status = 'blocked'
+                pending.remove(stage)
+                continue
+            if not all(dep.done for dep in stage.deps):
+                continue
+            if running['exclusive'] or \
+                    (stage.exclusive and running['count']):
+                continue
+            pending.remove(stage)
+            return stage
+        return None
+
+    def _worker(self, slot, pending, running, condition):
+        caffe = caffe_for_slot(self.caffe, slot)
+        while True:
+            with condition:
+                stage = self._next_stage(pending, running)
+                while stage is None:
+                    if not pending:
+                        condition.notify_all()
+                        return
+                    condition.wait()
+                    stage = self._next_stage(pending, running)
+                running['count'] += 1
+                running['exclusive'] = stage.exclusive
+            self._execute(stage, caffe)
+            with condition:
+                running['count'] -= 1
+                running['exclusive'] = False
+                condition.notify_all()
+
+    def run(self, stages=None):
+        """Runs the stages that are out of date and returns all stages."""
+        if stages is None:
+            stages = self.stages()
+        pending = list(stages)
+        running = {'count': 0, 'exclusive': False}
+        condition = threading.Condition()
+        threads = [threading.Thread(target=self._worker,
+                                    args=(slot, pending, running, condition))
+                   for slot in self.slots]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return stages
+
+
+def print_pipeline_summary(stages, file=None):
+    if file is None:
+        file = sys.stdout
+    by_network = {}
+    for stage in stages:
+        by_network.setdefault(stage.name, {})[stage.kind] = stage
+    print("{:^20}|".format("name") +
+          "|".join("{:^12}".format(kind) for kind in STAGES), file=file)
+    print("-" * 20 + ("+" + "-" * 12) * len(STAGES), file=file)
+    for name, network_stages in by_network.items():
+        print("{:^20}|".format(name) +
+              "|".join("{:^12}".format(network_stages[kind].status or "-")
+                       for kind in STAGES), file=file)
+    for stage in stages:
+        if stage.error is not None:
+            print("\n[{}] {} failed:\n{}".format(stage.name, stage.kind,
+                                                 stage.error), file=file)
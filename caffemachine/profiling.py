@@ -0,0 +1,128 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import statistics
+import sys
+
+
+def layer_costs(report):
+    """Returns `(layer, forward, backward, share)` tuples, the most expensive
+    layers first. `share` is the fraction of the summed layer times."""
+    layers = report['layers']
+    totals = {name: t.get('forward', 0.) + t.get('backward', 0.)
+              for name, t in layers.items()}
+    total = sum(totals.values())
+    costs = [(name, t.get('forward', 0.), t.get('backward', 0.),
+              totals[name] / total if total else 0.)
+             for name, t in layers.items()]
+    costs.sort(key=lambda c: c[1] + c[2], reverse=True)
+    return costs
+
+
+def flatten_args(template_args, prefix=""):
+    flat = {}
+    for key, value in template_args.items():
+        if isinstance(value, dict):
+            flat.update(flatten_args(value, prefix + key + "."))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def _correlation(xs, ys):
+    mean_x = statistics.mean(xs)
+    mean_y = statistics.mean(ys)
+    cov = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    var_y = sum((y - mean_y) ** 2 for y in ys)
+    if var_x == 0 or var_y == 0:
+        return 0.
+    return cov / (var_x * var_y) ** 0.5
+
+
+def variable_influence(variants):
+    """`variants` is a list of `(template_args, report)` pairs of networks
+    from the same template. Returns `(variable, correlation)` pairs of the
+    numeric template variables that differ between the variants, ordered by
+    the strength of their correlation with the forward + backward time."""
+    flat = [flatten_args(args) for args, _ in variants]
+    times = [r['avg_forward'] + r['avg_backward'] for _, r in variants]
+    variables = set()
+    for args in flat:
+        variables.update(args)
+    influence = []
+    for var in variables:
+        values = [args.get(var) for args in flat]
+        if not all(isinstance(v, (int, float)) and not isinstance(v, bool)
+                   for v in values) or len(set(values)) < 2:
+            continue
+        influence.append((var, _correlation(values, times)))
+    influence.sort(key=lambda v: abs(v[1]), reverse=True)
+    return influence
+
+
+def chrome_trace(reports):
+    """Converts the `caffe time` reports of several networks, a dict of
+    `name: report`, into the Chrome trace event format. Every network is a
+    process with the forward pass followed by the backward pass."""
+    events = []
+    for pid, (name, report) in enumerate(sorted(reports.items())):
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                       'tid': 0, 'args': {'name': name}})
+        layers = list(report['layers'].items())
+        ts = 0.
+        passes = [('forward', layers), ('backward', list(reversed(layers)))]
+        for direction, ordered in passes:
+            for layer, times in ordered:
+                duration = times.get(direction, 0.) * 1000
+                events.append({'name': layer, 'cat': direction, 'ph': 'X',
+                               'pid': pid, 'tid': 0, 'ts': ts,
+                               'dur': duration})
+                ts += duration
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def print_hottest_layers(name, report, top=10, file=None):
+    if file is None:
+        file = sys.stdout
+    print("{} (forward {:.3f} ms, backward {:.3f} ms)".format(
+        name, report['avg_forward'], report['avg_backward']), file=file)
+    print("    {:<24}{:>14}{:>14}{:>10}".format(
+        "layer", "forward [ms]", "backward [ms]", "share"), file=file)
+    for layer, forward, backward, share in layer_costs(report)[:top]:
+        print("    {:<24}{:>14.3f}{:>14.3f}{:>9.1f}%".format(
+            layer, forward, backward, 100 * share), file=file)
+
+
+def print_layer_comparison(reports, file=None):
+    if file is None:
+        file = sys.stdout
+    names = sorted(reports)
+    layers = []
+    for name in names:
+        for layer in reports[name]['layers']:
+            if layer not in layers:
+                layers.append(layer)
+    print("{:<24}".format("layer [ms]") +
+          "".join("{:>16}".format(n[:15]) for n in names), file=file)
+    for layer in layers:
+        row = "{:<24}".format(layer)
+        for name in names:
+            times = reports[name]['layers'].get(layer)
+            if times is None:
+                row += "{:>16}".format("-")
+            else:
+                row += "{:>16.3f}".format(times.get('forward', 0.) +
+                                          times.get('backward', 0.))
+        print(row, file=file)
@@ -0,0 +1,121 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+_token_re = re.compile(r"""
+    \s+ | \#[^\n]* |                       # whitespace and comments
+    (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*') |
+    (?P<symbol>[{}:<>\[\],;]) |
+    (?P<word>[^\s{}:<>\[\],;"'\#]+)
+""", re.VERBOSE)
+
+_escapes = {'n': '\n', 't': '\t', 'r': '\r', '"': '"', "'": "'", '\\': '\\'}
+
+
+class ParseError(ValueError):
+    pass
+
+
+def _tokenize(text):
+    pos = 0
+    for match in _token_re.finditer(text):
+        if match.start() != pos:
+            raise ParseError("Unexpected character at {}: {!r}".format(
+                pos, text[pos:pos + 10]))
+        pos = match.end()
+        kind = match.lastgroup
+        if kind is not None:
+            yield kind, match.group(kind)
+    if pos != len(text):
+        raise ParseError("Unexpected character at {}".format(pos))
+
+
+def _unquote(s):
+    return re.sub(r"\\(.)", lambda m: _escapes.get(m.group(1), m.group(1)),
+                  s[1:-1])
+
+
+def _value(kind, token):
+    if kind == 'string':
+        return _unquote(token)
+    for convert in (int, float):
+        try:
+            return convert(token)
+        except ValueError:
+            pass
+    if token == "true":
+        return True
+    if token == "false":
+        return False
+    # enum values like TEST or MAX are kept as strings
+    return token
+
+
+def parse(text):
+    """Parses the protobuf text format, e.g. a caffe prototxt file.
+
+    Every message is a dict that maps a field name to the list of its
+    values, as any field could be repeated.
+    """
+    tokens = list(_tokenize(text))
+    message, pos = _parse_message(tokens, 0, None)
+    return message
+
+
+def _parse_message(tokens, pos, end):
+    message = {}
+    while pos < len(tokens):
+        kind, token = tokens[pos]
+        if kind == 'symbol' and token == end:
+            return message, pos + 1
+        if kind != 'word':
+            raise ParseError("Expected a field name, got {!r}".format(token))
+        name = token
+        pos += 1
+        if pos < len(tokens) and tokens[pos] == ('symbol', ':'):
+            pos += 1
+        kind, token = tokens[pos]
+        if kind == 'symbol' and token in "{<":
+            value, pos = _parse_message(tokens, pos + 1,
+                                        "}" if token == "{" else ">")
+            message.setdefault(name, []).append(value)
+        elif kind == 'symbol' and token == "[":
+            pos += 1
+            while tokens[pos] != ('symbol', ']'):
+                if tokens[pos] != ('symbol', ','):
+                    message.setdefault(name, []).append(_value(*tokens[pos]))
+                pos += 1
+            pos += 1
+        else:
+            message.setdefault(name, []).append(_value(kind, token))
+            pos += 1
+        if pos < len(tokens) and tokens[pos][1] in (",", ";"):
+            pos += 1
+    if end is not None:
+        raise ParseError("Missing closing {!r}".format(end))
+    return message, pos
+
+
+def get(message, name, default=None):
+    """Returns the first value of the field `name`."""
+    values = message.get(name)
+    if not values:
+        return default
+    return values[0]
+
+
+def parse_file(filename):
+    with open(filename, "r") as f:
+        return parse(f.read())
@@ -0,0 +1,265 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import namedtuple
+
+from caffemachine import REGISTRY_FILE
+from caffemachine.network import CaffeNet
+
+NetworkRecord = namedtuple('NetworkRecord', [
+    'directory', 'name', 'template', 'args', 'status', 'iteration',
+    'weights', 'accuracy', 'avg_forward', 'avg_backward'])
+
+_schema = """
+CREATE TABLE IF NOT EXISTS networks (
+    id INTEGER PRIMARY KEY,
+    directory TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    template TEXT NOT NULL,
+    args TEXT NOT NULL,
+    args_sha1 TEXT NOT NULL,
+    status TEXT NOT NULL,
+    iteration INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS networks_lookup
+    ON networks (template, name, args_sha1);
+CREATE INDEX IF NOT EXISTS networks_status ON networks (status);
+
+CREATE TABLE IF NOT EXISTS snapshots (
+    network_id INTEGER NOT NULL REFERENCES networks (id) ON DELETE CASCADE,
+    iteration INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    PRIMARY KEY (network_id, iteration, kind)
+);
+
+CREATE TABLE IF NOT EXISTS results (
+    network_id INTEGER PRIMARY KEY
+        REFERENCES networks (id) ON DELETE CASCADE,
+    weights TEXT,
+    accuracy REAL,
+    avg_forward REAL,
+    avg_backward REAL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_accuracy ON results (accuracy);
+CREATE INDEX IF NOT EXISTS results_forward ON results (avg_forward);
+"""
+
+STATUSES = ('rendered', 'training', 'stopped', 'trained', 'failed')
+
+_order_columns = {
+    'accuracy': "r.accuracy",
+    'forward': "r.avg_forward",
+    'backward': "r.avg_backward",
+    'iteration': "n.iteration",
+    'name': "n.name",
+    'updated': "n.updated",
+}
+
+
+def args_sha1(template_args):
+    return hashlib.sha1(json.dumps(template_args, sort_keys=True)
+                        .encode('utf-8')).hexdigest()
+
+
+class Registry(object):
+    """Index of the rendered networks, their snapshots and their test and
+    timing results in a sqlite database. Every call opens its own
+    connection, so a registry can be shared by threads and processes."""
+
+    def __init__(self, filename=REGISTRY_FILE, timeout=30):
+        self.filename = filename
+        self.timeout = timeout
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            # readers do not block the writer and vice versa
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_schema)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.filename, timeout=self.timeout)
+        db.execute("PRAGMA foreign_keys=ON")
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def _network_id(db, directory):
+        row = db.execute("SELECT id FROM networks WHERE directory = ?",
+                         (directory,)).fetchone()
+        if row is None:
+            raise KeyError("{} is not registered.".format(directory))
+        return row[0]
+
+    def register(self, net, name, template, status='rendered'):
+        """Adds the network or updates its args. The status of an already
+        registered network is kept."""
+        args = json.dumps(net.template_args, sort_keys=True)
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO networks (directory, name, template, args, "
+                "args_sha1, status, updated) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (directory) DO UPDATE SET args = excluded.args",
+                (net.directory, name, template, args,
+                 args_sha1(net.template_args), status, time.time()))
+
+    def find(self, template, name, template_args):
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT directory, args FROM networks WHERE template = ? "
+                "AND name = ? AND args_sha1 = ?",
+                (template, name, args_sha1(template_args))).fetchone()
+        if row is None:
+            return None
+        return CaffeNet(row[0], template_args=json.loads(row[1]))
+
+    def directories(self, template=None):
+        query = "SELECT directory FROM networks"
+        params = ()
+        if template is not None:
+            query += " WHERE template = ?"
+            params = (template,)
+        with self._connect() as db:
+            return [row[0] for row in db.execute(query + " ORDER BY id",
+                                                 params)]
+
+    def set_status(self, directory, status):
+        assert status in STATUSES, "unknown status {}".format(status)
+        with self._connect() as db:
+            cursor = db.execute(
+                "UPDATE networks SET status = ?, updated = ? "
+                "WHERE directory = ?", (status, time.time(), directory))
+            if cursor.rowcount == 0:
+                raise KeyError("{} is not registered.".format(directory))
+
+    def sync_snapshots(self, net):
+        """Replaces the recorded snapshots with the ones in the network
+        directory and updates the iteration of the network."""
+        index = net.snapshot_index()
+        rows = []
+        for kind in ('caffemodel', 'solverstate'):
+            for iteration, filename in zip(index.iterations(kind),
+                                           index.files(kind)):
+                rows.append((iteration, kind, os.path.basename(filename)))
+        with self._connect() as db:
+            network_id = self._network_id(db, net.directory)
+            db.execute("DELETE FROM snapshots WHERE network_id = ?",
+                       (network_id,))
+            db.executemany(
+                "INSERT INTO snapshots (network_id, iteration, kind, "
+                "filename) VALUES (?, ?, ?, ?)",
+                [(network_id,) + row for row in rows])
+            db.execute("UPDATE networks SET iteration = ?, updated = ? "
+                       "WHERE id = ?",
+                       (net.latest_iteration(), time.time(), network_id))
+
+    def snapshots(self, directory, kind='caffemodel'):
+        with self._connect() as db:
+            network_id = self._network_id(db, directory)
+            return [(iteration, os.path.join(directory, filename))
+                    for iteration, filename in db.execute(
+                        "SELECT iteration, filename FROM snapshots "
+                        "WHERE network_id = ? AND kind = ? "
+                        "ORDER BY iteration", (network_id, kind))]
+
+    def record_results(self, directory, weights=None, accuracy=None,
+                       avg_forward=None, avg_backward=None):
+        """Stores test and / or timing results. Values that are `None`
+        keep their previous value."""
+        with self._connect() as db:
+            network_id = self._network_id(db, directory)
+            db.execute(
+                "INSERT INTO results (network_id, weights, accuracy, "
+                "avg_forward, avg_backward, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (network_id) DO UPDATE "
+                "SET weights = coalesce(excluded.weights, weights), "
+                "accuracy = coalesce(excluded.accuracy, accuracy), "
+                "avg_forward = coalesce(excluded.avg_forward, avg_forward), "
+                "avg_backward = coalesce(excluded.avg_backward, "
+                "avg_backward), updated = excluded.updated",
+                (network_id, weights, accuracy, avg_forward, avg_backward,
+                 time.time()))
+
+    def query(self, order_by='accuracy', descending=None, limit=None,
+              template=None, status=None, min_accuracy=None,
+              max_forward=None, max_backward=None):
+        """Returns `NetworkRecord`s, e.g. the 10 most accurate networks
+        with a forward pass under 20ms:
+        `query('accuracy', limit=10, max_forward=20)`."""
+        conditions = []
+        params = []
+        for condition, value in (("n.template = ?", template),
+                                 ("n.status = ?", status),
+                                 ("r.accuracy >= ?", min_accuracy),
+                                 ("r.avg_forward <= ?", max_forward),
+                                 ("r.avg_backward <= ?", max_backward)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        if descending is None:
+            # the most accurate, but the fastest networks first
+            descending = order_by == 'accuracy'
+        query = ("SELECT n.directory, n.name, n.template, n.args, n.status, "
+                 "n.iteration, r.weights, r.accuracy, r.avg_forward, "
+                 "r.avg_backward FROM networks n "
+                 "LEFT JOIN results r ON r.network_id = n.id")
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        column = _order_columns[order_by]
+        # networks without results are listed last
+        query += " ORDER BY {} IS NULL, {} {}".format(
+            column, column, "DESC" if descending else "ASC")
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._connect() as db:
+            rows = db.execute(query, params).fetchall()
+        return [NetworkRecord(row[0], row[1], row[2], json.loads(row[3]),
+                              *row[4:]) for row in rows]
+
+    def scan(self, networks_dir):
+        """Registers the networks rendered before the registry existed.
+        Returns the number of added networks."""
+        known = set(self.directories())
+        added = 0
+        for template in sorted(os.listdir(networks_dir)):
+            template_dir = os.path.join(networks_dir, template)
+            if not os.path.isdir(template_dir):
+                continue
+            for entry in sorted(os.listdir(template_dir)):
+                directory = os.path.join(template_dir, entry)
+                if directory in known or not os.path.exists(
+                        os.path.join(directory, "template_args.json")):
+                    continue
+                net = CaffeNet(directory)
+                # network directories are named `<name>_<args sha1>`
+                self.register(net, entry.rsplit("_", 1)[0], template)
+                status = 'trained' if net.is_trained() else 'rendered'
+                self.set_status(directory, status)
+                self.sync_snapshots(net)
+                added += 1
+        return added
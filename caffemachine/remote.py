@@ -0,0 +1,351 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+
+from .executable import Caffe
+from .template import CaffeTemplate
+
+_chunk_size = 1 << 20
+
+
+class _LineOutput(object):
+    # file-like object that passes every printed line to `emit`
+    def __init__(self, emit):
+        self._emit = emit
+        self._buffer = ""
+
+    def write(self, s):
+        self._buffer += s
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            self._emit({'type': 'log', 'line': line})
+
+    def flush(self):
+        pass
+
+
+class TaskRunner(object):
+    """Executes tasks, i.e. dicts like `{'op': 'train', 'template': {...},
+    'name': ..., 'args': {...}}`, on this machine. Used by the worker daemon
+    and the LocalExecutor.
+
+    Tasks may come from anybody who can reach the worker. Rendering a
+    template may run its download script and a caffe repository is built
+    with its own cmake files, so both run code of the repository. Only the
+    template urls in `templates` and the caffe repositories in `caffe_repos`
+    are used, `None` allows all of them. Whether download scripts may run is
+    only decided by `allow_download_script`, never by the task."""
+
+    def __init__(self, caffe=None, templates=None, caffe_repos=None,
+                 allow_download_script=False):
+        self.caffe = caffe
+        self.templates = templates
+        self.caffe_repos = caffe_repos
+        self.allow_download_script = allow_download_script
+        self._templates = {}
+        self._caffes = {}
+        self._lock = threading.Lock()
+
+    def _template(self, task):
+        t = task['template']
+        if self.templates is not None and t['git_url'] not in self.templates:
+            raise PermissionError("The template {} is not allowed on this "
+                                  "worker.".format(t['git_url']))
+        key = (t['git_url'], t.get('git_tag'))
+        with self._lock:
+            if key not in self._templates:
+                self._templates[key] = CaffeTemplate(
+                    t['git_url'], t.get('git_tag'),
+                    allow_download_script=self.allow_download_script,
+                    interactive=False)
+            return self._templates[key]
+
+    def _caffe(self, task):
+        if self.caffe is not None:
+            return self.caffe
+        c = task.get('caffe', {})
+        # `None` is the system caffe or the upstream repository
+        if c.get('git_url') is not None and self.caffe_repos is not None \
+                and c['git_url'] not in self.caffe_repos:
+            raise PermissionError("The caffe repository {} is not allowed on "
+                                  "this worker.".format(c['git_url']))
+        key = (c.get('git_tag'), c.get('git_url'))
+        with self._lock:
+            if key not in self._caffes:
+                self._caffes[key] = Caffe.get_caffe(c.get('git_tag'),
+                                                    git_repo=c.get('git_url'))
+            return self._caffes[key]
+
+    @staticmethod
+    def _check_name(name):
+        # the name becomes part of the network directory
+        if not name or "/" in name or os.sep in name or ".." in name or \
+                (os.altsep and os.altsep in name):
+            raise ValueError("Invalid network name: {!r}".format(name))
+
+    def _net(self, task):
+        self._check_name(task['name'])
+        return self._template(task).find_or_render(task['name'],
+                                                   task['args'])
+
+    def run(self, task, emit):
+        op = task['op']
+        if op == 'render':
+            return self._net(task).directory
+        net = self._net(task)
+        if op == 'train':
+            output = _LineOutput(emit)
+            if task.get('restart'):
+                return self._caffe(task).train(net, output=output)
+            return self._caffe(task).resume(net, output=output)
+        if op == 'test':
+            weights = task.get('weights') or net.highest_iteration_weights()
+            return self._caffe(task).test(net, weights,
+                                          iterations=task.get('iterations'))
+        if op == 'time':
+            return self._caffe(task).time(
+                net, iterations=task.get('iterations', 10),
+                use_train_model=task.get('use_train_model', False))
+        if op == 'fetch':
+            return self._fetch(net, task.get('files'), emit)
+        raise ValueError("Unknown operation: {}".format(op))
+
+    @staticmethod
+    def artifacts(net):
+        files = [os.path.basename(f) for f in
+                 (net.metrics_file(), net.train_state_file(),
+                  net.train_log_file()) if os.path.exists(f)]
+        if net.weights():
+            files.append(os.path.basename(net.highest_iteration_weights()))
+        return files
+
+    def _fetch(self, net, files, emit):
+        if files is None:
+            files = self.artifacts(net)
+        for name in files:
+            path = os.path.join(net.directory, os.path.basename(name))
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(_chunk_size), b''):
+                    emit({'type': 'chunk', 'file': os.path.basename(name),
+                          'data': base64.b64encode(block).decode('ascii')})
+        return files
+
+
+class _WorkerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        lock = threading.Lock()
+
+        def emit(message):
+            data = (json.dumps(message) + "\n").encode('utf-8')
+            with lock:
+                self.wfile.write(data)
+                self.wfile.flush()
+
+        for line in self.rfile:
+            task = json.loads(line.decode('utf-8'))
+            try:
+                value = self.server.runner.run(task, emit)
+                emit({'type': 'result', 'value': value})
+            except Exception:
+                emit({'type': 'error', 'message': traceback.format_exc()})
+
+
+class WorkerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, runner=None):
+        super().__init__(address, _WorkerHandler)
+        if runner is None:
+            # nothing is trusted unless the worker is configured
+            runner = TaskRunner(templates=(), caffe_repos=())
+        self.runner = runner
+
+    @property
+    def address(self):
+        return "{}:{}".format(*self.server_address[:2])
+
+
+def parse_address(address):
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+class TaskResult(object):
+    def __init__(self, task, value=None, error=None, worker=None):
+        self.task = task
+        self.value = value
+        self.error = error
+        self.worker = worker
+
+    @property
+    def name(self):
+        return self.task['name']
+
+    @property
+    def ok(self):
+        if self.error is not None:
+            return False
+        if self.task['op'] == 'train':
+            return self.value == 0
+        return True
+
+
+class LocalExecutor(object):
+    def __init__(self, runner=None, jobs=1):
+        if runner is None:
+            runner = TaskRunner()
+        self.runner = runner
+        self.jobs = jobs
+
+    def _run_task(self, task, output):
+        def emit(message):
+            if message['type'] == 'log':
+                print("[{}] {}".format(task['name'], message['line']),
+                      file=output, flush=True)
+        try:
+            return TaskResult(task, self.runner.run(task, emit),
+                              worker="local")
+        except Exception:
+            return TaskResult(task, error=traceback.format_exc(),
+                              worker="local")
+
+    def run(self, tasks, output=None, dest_dirs=None):
+        # the artifacts of local tasks are already in place, `dest_dirs` is
+        # only accepted to be interchangeable with the RemoteExecutor.
+        return _run_queue(tasks, ["local"] * self.jobs,
+                          lambda worker, task: self._run_task(task, output))
+
+
+class RemoteExecutor(object):
+    def __init__(self, addresses, timeout=None):
+        self.addresses = [parse_address(a) if isinstance(a, str) else a
+                          for a in addresses]
+        self.timeout = timeout
+
+    def _run_task(self, address, task, output, dest_dir):
+        worker = _worker_name(address)
+        files = {}
+        with socket.create_connection(address, timeout=self.timeout) as sock:
+            sock.sendall((json.dumps(task) + "\n").encode('utf-8'))
+            for line in sock.makefile("rb"):
+                message = json.loads(line.decode('utf-8'))
+                kind = message['type']
+                if kind == 'log':
+                    print("[{}@{}] {}".format(task['name'], worker,
+                                              message['line']),
+                          file=output, flush=True)
+                elif kind == 'chunk':
+                    name = message['file']
+                    if name not in files:
+                        os.makedirs(dest_dir, exist_ok=True)
+                        files[name] = open(
+                            os.path.join(dest_dir, name + ".part"), "wb")
+                    files[name].write(base64.b64decode(message['data']))
+                elif kind == 'result':
+                    if task['op'] == 'fetch':
+                        # empty files have no chunks
+                        for name in message['value']:
+                            name = os.path.basename(name)
+                            if name not in files:
+                                os.makedirs(dest_dir, exist_ok=True)
+                                files[name] = open(os.path.join(
+                                    dest_dir, name + ".part"), "wb")
+                    for name, f in files.items():
+                        f.close()
+                        os.replace(f.name, os.path.join(dest_dir, name))
+                    return TaskResult(task, message['value'], worker=worker)
+                else:
+                    for f in files.values():
+                        f.close()
+                        os.remove(f.name)
+                    return TaskResult(task, error=message['message'],
+                                      worker=worker)
+        raise ConnectionError("worker {} closed the connection".format(worker))
+
+    def run(self, tasks, output=None, dest_dirs=None):
+        """Runs `tasks` on the workers. `dest_dirs` maps a task's name to the
+        local directory the artifacts of `fetch` tasks are written to."""
+        if output is None:
+            output = sys.stdout
+        if dest_dirs is None:
+            dest_dirs = {}
+
+        def run_task(address, task):
+            return self._run_task(address, task, output,
+                                  dest_dirs.get(task['name']))
+        return _run_queue(tasks, self.addresses, run_task)
+
+
+def _worker_name(worker):
+    if isinstance(worker, tuple):
+        return "{}:{}".format(*worker)
+    return worker
+
+
+def _run_queue(tasks, workers, run_task):
+    # every worker pulls the next task as soon as it is idle, which balances
+    # the queue across workers of different speed. The task of a worker that
+    # cannot be reached is put back for the others.
+    task_queue = queue.Queue()
+    for i, task in enumerate(tasks):
+        task_queue.put((i, task))
+    results = [None] * len(tasks)
+    pending = [len(tasks)]
+    condition = threading.Condition()
+
+    def work(worker):
+        while True:
+            with condition:
+                while task_queue.empty() and pending[0] > 0:
+                    condition.wait()
+                if pending[0] == 0:
+                    return
+                i, task = task_queue.get_nowait()
+            try:
+                result = run_task(worker, task)
+            except OSError as e:
+                print("Worker {} failed: {}".format(worker, e),
+                      file=sys.stderr)
+                with condition:
+                    task_queue.put((i, task))
+                    condition.notify_all()
+                return
+            except Exception:
+                # e.g. a garbled response, the task is not retried
+                result = TaskResult(task, error=traceback.format_exc(),
+                                    worker=_worker_name(worker))
+            with condition:
+                results[i] = result
+                pending[0] -= 1
+                condition.notify_all()
+
+    threads = [threading.Thread(target=work, args=(w,)) for w in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for i, task in enumerate(tasks):
+        if results[i] is None:
+            results[i] = TaskResult(task, error="No worker available.")
+    return results
@@ -0,0 +1,285 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A long-lived pycaffe process that keeps the networks loaded.
+
+`caffe test` and `caffe time` load the shared libraries, parse the prototxt
+and set up the net on every call. The resident worker does that once per
+prototxt and only copies the weights of the next snapshot into the net.
+It runs as `python -m caffemachine.resident` and reads one json request per
+line from stdin, see `_handle`.
+"""
+
+import collections
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from subprocess import PIPE
+
+# nets kept loaded in the worker
+max_loaded_nets = 4
+default_test_iterations = 50
+
+
+class _Nets(object):
+    def __init__(self, caffe):
+        self._caffe = caffe
+        self._nets = collections.OrderedDict()
+
+    def get(self, model, phase):
+        key = (model, phase)
+        if key in self._nets:
+            self._nets.move_to_end(key)
+        else:
+            self._nets[key] = self._caffe.Net(model, phase)
+            while len(self._nets) > max_loaded_nets:
+                self._nets.popitem(last=False)
+        return self._nets[key]
+
+
+def _set_device(caffe, gpu):
+    if gpu is None:
+        caffe.set_mode_cpu()
+    else:
+        caffe.set_mode_gpu()
+        caffe.set_device(int(gpu))
+
+
+def _test(caffe, nets, request):
+    net = nets.get(request['model'], caffe.TEST)
+    net.copy_from(request['weights'])
+    iterations = request.get('iterations') or default_test_iterations
+    total = 0.
+    for _ in range(iterations):
+        total += float(net.forward()['accuracy'])
+    return {'accuracy': total / iterations}
+
+
+def _time(caffe, nets, request):
+    # like `caffe time`: forward and backward of the train phase, layer by
+    # layer
+    net = nets.get(request['model'], caffe.TRAIN)
+    names = list(net._layer_names)
+    layers = {name: {'forward': 0., 'backward': 0.} for name in names}
+    forward = backward = 0.
+    iterations = request['iterations']
+    for _ in range(iterations):
+        for i, name in enumerate(names):
+            start = time.perf_counter()
+            net._forward(i, i)
+            duration = time.perf_counter() - start
+            layers[name]['forward'] += duration
+            forward += duration
+        for i in reversed(range(len(names))):
+            start = time.perf_counter()
+            net._backward(i, i)
+            duration = time.perf_counter() - start
+            layers[names[i]]['backward'] += duration
+            backward += duration
+    ms = 1000. / iterations
+    return {
+        'layers': {name: {k: v * ms for k, v in times.items()}
+                   for name, times in layers.items()},
+        'avg_forward': forward * ms,
+        'avg_backward': backward * ms,
+    }
+
+
+def _handle(caffe, nets, request):
+    # relative paths in the prototxt, like the `source` of data layers, are
+    # relative to the network directory, as for the command line tool
+    if request.get('cwd'):
+        os.chdir(request['cwd'])
+    _set_device(caffe, request.get('gpu'))
+    if request['op'] == 'test':
+        return _test(caffe, nets, request)
+    if request['op'] == 'time':
+        return _time(caffe, nets, request)
+    raise ValueError("unknown op {}".format(request['op']))
+
+
+def serve(stdin, stdout):
+    import caffe
+    nets = _Nets(caffe)
+    print(json.dumps({'ready': True}), file=stdout, flush=True)
+    for line in stdin:
+        try:
+            response = _handle(caffe, nets, json.loads(line))
+        except Exception:
+            response = {'error': traceback.format_exc()}
+        print(json.dumps(response), file=stdout, flush=True)
+
+
+class ResidentWorker(object):
+    """Client of a resident pycaffe process. `Caffe.test` and `Caffe.time`
+    use it if it is set with `Caffe.set_worker`. Requests are sent one at a
+    time; if the worker fails, the calls return None and Caffe falls back to
+    the command line tool."""
+
+    def __init__(self, caffe, python=None):
+        self.caffe = caffe
+        self.python = python or sys.executable
+        self._process = None
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def _env(self):
+        env = self.caffe._env()
+        if self.caffe.caffe_ld_path:
+            # the python bindings are installed next to the libraries
+            python_dir = os.path.join(
+                os.path.dirname(os.path.normpath(self.caffe.caffe_ld_path)),
+                "python")
+            env['PYTHONPATH'] = os.pathsep.join(
+                p for p in (python_dir, env.get('PYTHONPATH')) if p)
+        # the worker runs `-m caffemachine.resident`
+        package_dir = os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join(
+            p for p in (env.get('PYTHONPATH'), package_dir) if p)
+        # glog output of pycaffe must not end up in the protocol
+        env['GLOG_minloglevel'] = "2"
+        return env
+
+    def _start(self):
+        try:
+            p = subprocess.Popen([self.python, "-m", "caffemachine.resident"],
+                                 stdin=PIPE, stdout=PIPE,
+                                 stderr=subprocess.DEVNULL, env=self._env(),
+                                 universal_newlines=True)
+        except OSError:
+            return None
+        self.caffe._set_affinity(p.pid)
+        line = p.stdout.readline()
+        if not line or not json.loads(line).get('ready'):
+            # no pycaffe
+            p.wait()
+            return None
+        return p
+
+    def available(self):
+        with self._lock:
+            return self._ensure_started()
+
+    def _ensure_started(self):
+        if self._failed:
+            return False
+        if self._process is None or self._process.poll() is not None:
+            self._process = self._start()
+            if self._process is None:
+                self._failed = True
+                return False
+        return True
+
+    def _request(self, request):
+        with self._lock:
+            if not self._ensure_started():
+                return None
+            try:
+                self._process.stdin.write(json.dumps(request) + "\n")
+                self._process.stdin.flush()
+                line = self._process.stdout.readline()
+            except OSError:
+                line = ""
+            if not line:
+                # crashed, it is started again with the next request
+                self._process = None
+                return None
+        response = json.loads(line)
+        if 'error' in response:
+            print(response['error'], file=sys.stderr)
+            return None
+        return response
+
+    def _gpu(self):
+        gpus = self.caffe._get_gpus_as_str()
+        if gpus is None:
+            return None
+        # pycaffe uses a single device
+        return int(gpus.split(",")[0])
+
+    def can_time(self):
+        # the layers are timed from python without synchronizing the gpu,
+        # that would only measure the kernel launches. `caffe time`
+        # synchronizes, so gpu timings stay with the command line tool.
+        return self._gpu() is None and self.available()
+
+    def test(self, model, weights, iterations=None, cwd=None):
+        response = self._request({'op': 'test', 'model': model,
+                                  'weights': weights,
+                                  'iterations': iterations,
+                                  'gpu': self._gpu(), 'cwd': cwd})
+        return None if response is None else response['accuracy']
+
+    def time(self, model, iterations, cwd=None):
+        if self._gpu() is not None:
+            return None
+        return self._request({'op': 'time', 'model': model,
+                              'iterations': iterations, 'cwd': cwd})
+
+    def close(self):
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                self._process.stdin.close()
+                self._process.wait()
+            self._process = None
+
+
+class ResidentPool(object):
+    """One `ResidentWorker` per job, so `jobs` requests run at the same
+    time. Every request goes to a worker that is not busy."""
+
+    def __init__(self, caffe, jobs=1, python=None):
+        self.workers = [ResidentWorker(caffe, python)
+                        for _ in range(max(jobs, 1))]
+        self._idle = queue.Queue()
+        for worker in self.workers:
+            self._idle.put(worker)
+
+    def available(self):
+        return all(worker.available() for worker in self.workers)
+
+    def can_time(self):
+        return self.workers[0].can_time()
+
+    def _call(self, method, *args, **kwargs):
+        worker = self._idle.get()
+        try:
+            return getattr(worker, method)(*args, **kwargs)
+        finally:
+            self._idle.put(worker)
+
+    def test(self, model, weights, iterations=None, cwd=None):
+        return self._call('test', model, weights, iterations, cwd=cwd)
+
+    def time(self, model, iterations, cwd=None):
+        return self._call('time', model, iterations, cwd=cwd)
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+
+if __name__ == '__main__':
+    try:
+        import caffe  # noqa: F401
+    except ImportError:
+        print(json.dumps({'ready': False}), flush=True)
+        sys.exit(1)
+    serve(sys.stdin, sys.stdout)
@@ -0,0 +1,96 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import zipfile
+
+from caffemachine.logparser import TestRecord, read_metrics
+
+
+def training_accuracies(net):
+    """Maps the iterations of the test runs during training to their
+    accuracy, read from the metrics file of `net`."""
+    try:
+        records = list(read_metrics(net.metrics_file()))
+    except FileNotFoundError:
+        return {}
+    return {r.iteration: r.accuracy for r in records
+            if type(r) == TestRecord and r.accuracy is not None}
+
+
+class RetentionPolicy(object):
+    def __init__(self, keep_last=3, keep_best=True, keep_every=None):
+        # the latest snapshot is always needed to resume the training
+        self.keep_last = max(keep_last, 1)
+        self.keep_best = keep_best
+        self.keep_every = keep_every
+
+    @staticmethod
+    def _best(iterations, accuracies):
+        # the snapshot closest to the most accurate test run
+        best_test = max(accuracies, key=lambda i: accuracies[i])
+        return min(iterations, key=lambda i: abs(i - best_test))
+
+    def keep(self, iterations, accuracies=None):
+        """Returns the subset of the snapshot `iterations` to keep."""
+        iterations = sorted(iterations)
+        kept = set(iterations[-self.keep_last:])
+        if self.keep_best and accuracies and iterations:
+            kept.add(self._best(iterations, accuracies))
+        if self.keep_every:
+            kept.update(i for i in iterations if i % self.keep_every == 0)
+        return kept
+
+
+def archive_snapshots(net, policy):
+    """Moves the snapshots of `net` that `policy` does not keep into its
+    compressed snapshot archive. Returns the archived file names."""
+    index = net.snapshot_index()
+    iterations = set(index.iterations('caffemodel')) | \
+        set(index.iterations('solverstate'))
+    kept = policy.keep(iterations, training_accuracies(net))
+    to_archive = []
+    for kind in ('caffemodel', 'solverstate'):
+        for iteration, path in zip(index.iterations(kind), index.files(kind)):
+            if iteration not in kept:
+                to_archive.append(path)
+    if not to_archive:
+        return []
+    # the members are appended to a copy of the archive that replaces it,
+    # an interrupted run cannot corrupt the snapshots already archived.
+    # Copying the bytes does not recompress the old members.
+    archive_file = net.snapshot_archive_file()
+    fd, tmp = tempfile.mkstemp(dir=net.directory, suffix=".zip.tmp")
+    os.close(fd)
+    try:
+        if os.path.exists(archive_file):
+            shutil.copyfile(archive_file, tmp)
+        with zipfile.ZipFile(tmp, "a",
+                             compression=zipfile.ZIP_LZMA) as archive:
+            archived = set(archive.namelist())
+            for path in to_archive:
+                name = os.path.basename(path)
+                # restored snapshots are still in the archive
+                if name not in archived:
+                    archive.write(path, arcname=name)
+        os.replace(tmp, archive_file)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    # only delete the files once the archive is complete
+    for path in to_archive:
+        os.remove(path)
+    return [os.path.basename(path) for path in to_archive]
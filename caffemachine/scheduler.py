@@ -0,0 +1,244 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import glob
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import traceback
+
+
+def parse_cpu_list(cpu_list):
+    """Parses a cpu list like `0-3,8,10-11` into a list of cpu ids."""
+    cpus = []
+    for part in cpu_list.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def numa_nodes():
+    """Returns the cpu ids of every NUMA node, or a single node with all
+    cpus if the kernel does not expose the topology."""
+    nodes = []
+    for cpulist in sorted(glob.glob("/sys/devices/system/node/node*/cpulist"),
+                          key=lambda f: int(re.search(r"node(\d+)/",
+                                                      f).group(1))):
+        with open(cpulist, "r") as f:
+            cpus = parse_cpu_list(f.read())
+        if cpus:
+            nodes.append(cpus)
+    if not nodes:
+        nodes = [sorted(os.sched_getaffinity(0))]
+    return nodes
+
+
+def _split(items, n_groups):
+    if n_groups > len(items):
+        n_groups = len(items)
+    size, rest = divmod(len(items), n_groups)
+    groups = []
+    start = 0
+    for i in range(n_groups):
+        end = start + size + (1 if i < rest else 0)
+        groups.append(items[start:end])
+        start = end
+    return groups
+
+
+def _groups_per_node(n_groups, sizes):
+    # proportional to the node sizes, at least one group per node
+    counts = [max(1, min(size, n_groups * size // sum(sizes)))
+              for size in sizes]
+    while sum(counts) > n_groups:
+        i = max(range(len(counts)), key=lambda i: counts[i])
+        counts[i] -= 1
+    while sum(counts) < n_groups:
+        candidates = [i for i in range(len(counts)) if counts[i] < sizes[i]]
+        if not candidates:
+            break
+        i = max(candidates, key=lambda i: sizes[i] / counts[i])
+        counts[i] += 1
+    return counts
+
+
+def partition_cpus(n_groups, cpus=None, nodes=None):
+    """Splits `cpus` into `n_groups` groups of consecutive cpus. No group
+    spans two NUMA nodes if there are at least as many groups as nodes,
+    otherwise every group gets whole nodes."""
+    if cpus is None:
+        cpus = sorted(os.sched_getaffinity(0))
+    if nodes is None:
+        nodes = numa_nodes()
+    allowed = set(cpus)
+    nodes = [[c for c in node if c in allowed] for node in nodes]
+    nodes = [node for node in nodes if node]
+    if len(nodes) <= 1:
+        return _split(cpus, n_groups)
+    if n_groups < len(nodes):
+        return [sum(group, []) for group in _split(nodes, n_groups)]
+    groups = []
+    counts = _groups_per_node(n_groups, [len(node) for node in nodes])
+    for node, count in zip(nodes, counts):
+        groups.extend(_split(node, count))
+    return groups
+
+
+class Slot(object):
+    def __init__(self, cpus=None, gpus=None):
+        self.cpus = cpus
+        self.gpus = gpus
+
+    def __repr__(self):
+        return "Slot(cpus={}, gpus={})".format(self.cpus, self.gpus)
+
+
+def make_slots(jobs, cpu_groups=None, gpus=None):
+    if cpu_groups is None and jobs > 1:
+        cpu_groups = partition_cpus(jobs)
+    slots = []
+    for i in range(jobs):
+        slot = Slot()
+        if cpu_groups:
+            slot.cpus = cpu_groups[i % len(cpu_groups)]
+        if gpus:
+            slot.gpus = gpus[i % len(gpus)]
+        slots.append(slot)
+    return slots
+
+
+class Job(object):
+    def __init__(self, name, run, log_file=None):
+        # `run` is called as `run(caffe, output)` and returns the exit code.
+        self.name = name
+        self.run = run
+        self.log_file = log_file
+
+
+class JobResult(object):
+    def __init__(self, job, returncode, duration, slot, error=None):
+        self.job = job
+        self.returncode = returncode
+        self.duration = duration
+        self.slot = slot
+        self.error = error
+
+    @property
+    def name(self):
+        return self.job.name
+
+    @property
+    def ok(self):
+        return self.error is None and self.returncode == 0
+
+
+def caffe_for_slot(caffe, slot):
+    """A copy of `caffe` pinned to the gpus and cores of `slot`."""
+    caffe = copy.copy(caffe)
+    if slot.gpus is not None:
+        caffe.set_gpus(slot.gpus)
+    if slot.cpus is not None:
+        caffe.set_cpus(slot.cpus)
+    return caffe
+
+
+class Scheduler(object):
+    def __init__(self, caffe, slots=None):
+        if slots is None:
+            slots = [Slot()]
+        self.caffe = caffe
+        self.slots = slots
+
+    def _run_job(self, job, slot):
+        caffe = caffe_for_slot(self.caffe, slot)
+        start = time.time()
+        returncode = None
+        error = None
+        try:
+            if job.log_file is None:
+                returncode = job.run(caffe, sys.stdout)
+            else:
+                with open(job.log_file, "w") as output:
+                    returncode = job.run(caffe, output)
+        except Exception:
+            error = traceback.format_exc()
+        return JobResult(job, returncode, time.time() - start, slot, error)
+
+    def _worker(self, slot, jobs, results, lock):
+        while True:
+            try:
+                job = jobs.get_nowait()
+            except queue.Empty:
+                return
+            if job.log_file is not None:
+                with lock:
+                    print("[{}] started on {}, log: {}".format(
+                        job.name, slot, job.log_file))
+            result = self._run_job(job, slot)
+            with lock:
+                results.append(result)
+                if job.log_file is not None:
+                    print("[{}] {} after {:.1f}s".format(
+                        job.name, "done" if result.ok else "FAILED",
+                        result.duration))
+
+    def run(self, jobs):
+        job_queue = queue.Queue()
+        for job in jobs:
+            job_queue.put(job)
+        results = []
+        lock = threading.Lock()
+        threads = [threading.Thread(target=self._worker,
+                                    args=(slot, job_queue, results, lock))
+                   for slot in self.slots]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        order = {job.name: i for i, job in enumerate(jobs)}
+        results.sort(key=lambda r: order[r.name])
+        return results
+
+
+def print_summary(results, file=None):
+    if file is None:
+        file = sys.stdout
+    print("{:^20}|{:^10}|{:^12}| {}".format(
+        "name", "status", "time [s]", "log"), file=file)
+    print("-" * 20 + "+" + "-" * 10 + "+" + "-" * 12 + "+" + "-" * 20,
+          file=file)
+    for result in results:
+        if result.error is not None:
+            status = "error"
+        elif result.returncode == 0:
+            status = "ok"
+        else:
+            status = "exit {}".format(result.returncode)
+        print("{:^20}|{:^10}|{:^12.1f}| {}".format(
+            result.name, status, result.duration, result.job.log_file or "-"),
+            file=file)
+    for result in results:
+        if result.error is not None:
+            print("\n[{}] raised:\n{}".format(result.name, result.error),
+                  file=file)
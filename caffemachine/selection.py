@@ -0,0 +1,94 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .evaluator import AsyncEvaluator, Evaluation
+
+
+def candidates(name, net, all_snapshots=False):
+    """Evaluations of the latest weights of `net`, or of all its
+    snapshots."""
+    if all_snapshots:
+        weights = net.weights()
+    else:
+        weights = [net.highest_iteration_weights()]
+    return [Evaluation(name, net, w) for w in weights]
+
+
+def evaluate(caffe, evaluations, jobs=1, isolate_timing=True):
+    """Tests and times the evaluations in parallel. Results of already
+    evaluated snapshots come from the cache of `caffe`."""
+    return AsyncEvaluator(caffe, jobs=jobs,
+                          isolate_timing=isolate_timing).evaluate(evaluations)
+
+
+def _dominates(a, b, latencies):
+    no_worse = a.accuracy >= b.accuracy and \
+        all(a.timings[m] <= b.timings[m] for m in latencies)
+    better = a.accuracy > b.accuracy or \
+        any(a.timings[m] < b.timings[m] for m in latencies)
+    return no_worse and better
+
+
+def pareto_front(evaluations, latencies=('avg_forward', 'avg_backward')):
+    """The evaluations that no other evaluation beats in accuracy and in all
+    `latencies` at once, sorted from the fastest to the most accurate."""
+    evaluations = sorted(evaluations, key=lambda e: (
+        [e.timings[m] for m in latencies], -e.accuracy))
+    front = []
+    if len(latencies) == 1:
+        # sorted by latency, a candidate is on the front iff it is more
+        # accurate than every faster one
+        for e in evaluations:
+            if not front or e.accuracy > front[-1].accuracy:
+                front.append(e)
+        return front
+    for e in evaluations:
+        if not any(_dominates(other, e, latencies) for other in evaluations):
+            front.append(e)
+    return front
+
+
+def within(evaluations, max_forward=None, max_backward=None,
+           min_accuracy=None):
+    result = []
+    for e in evaluations:
+        if max_forward is not None and e.timings['avg_forward'] > max_forward:
+            continue
+        if max_backward is not None and \
+                e.timings['avg_backward'] > max_backward:
+            continue
+        if min_accuracy is not None and e.accuracy < min_accuracy:
+            continue
+        result.append(e)
+    return result
+
+
+def most_accurate(evaluations, max_forward=None, max_backward=None):
+    """The most accurate evaluation within the latency budget, the faster
+    one on ties, or None."""
+    feasible = within(evaluations, max_forward, max_backward)
+    if not feasible:
+        return None
+    return max(feasible, key=lambda e: (e.accuracy,
+                                        -e.timings['avg_forward']))
+
+
+def fastest(evaluations, min_accuracy=None):
+    """The evaluation with the fastest forward pass that reaches
+    `min_accuracy`, or None."""
+    feasible = within(evaluations, min_accuracy=min_accuracy)
+    if not feasible:
+        return None
+    return min(feasible, key=lambda e: (e.timings['avg_forward'],
+                                        -e.accuracy))
@@ -0,0 +1,177 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import statistics
+import sys
+import threading
+
+from .logparser import TrainRecord, TestRecord
+from .scheduler import Job
+
+
+class SweepRun(object):
+    def __init__(self, name, net):
+        self.name = name
+        self.net = net
+        self.iteration = 0
+        self.accuracy = None
+        self.loss = None
+        # (iteration, best test accuracy so far)
+        self.history = []
+        self.stopped_at = None
+        self.returncode = None
+
+    def update(self, record):
+        self.iteration = max(self.iteration, record.iteration)
+        if type(record) == TestRecord and record.accuracy is not None:
+            self.accuracy = record.accuracy
+            best = max(record.accuracy, self.best_accuracy(record.iteration))
+            self.history.append((record.iteration, best))
+        elif type(record) == TrainRecord and record.loss is not None:
+            self.loss = record.loss
+
+    def best_accuracy(self, iteration):
+        best = float("-inf")
+        for i, accuracy in self.history:
+            if i > iteration:
+                break
+            best = accuracy
+        return best
+
+    def score(self):
+        if self.accuracy is not None:
+            return self.accuracy
+        if self.loss is not None:
+            return -self.loss
+        return float("-inf")
+
+    @property
+    def failed(self):
+        return self.returncode not in (None, 0)
+
+
+class _Sweep(object):
+    def __init__(self, scheduler, log=True):
+        self.scheduler = scheduler
+        self.log = log
+        self._lock = threading.Lock()
+
+    def _log_file(self, run, suffix):
+        if not self.log or len(self.scheduler.slots) == 1:
+            return None
+        return "{}/train_output_{}.log".format(run.net.directory, suffix)
+
+    def _train_job(self, run, should_stop, suffix):
+        def train(caffe, output):
+            def callback(record):
+                with self._lock:
+                    run.update(record)
+                    return should_stop(run, record)
+            run.returncode = caffe.train(
+                run.net, snapshot=run.net.latest_solverstate(),
+                output=output, callback=callback)
+            return run.returncode
+        return Job(run.name, train, self._log_file(run, suffix))
+
+
+class SuccessiveHalving(_Sweep):
+    """Trains every run for `min_iter` iterations, keeps the best `1/eta`
+    and resumes them from their snapshots for `eta` times more iterations,
+    until `max_iter` is reached."""
+
+    def __init__(self, scheduler, min_iter, eta=3, max_iter=None, log=True):
+        super().__init__(scheduler, log)
+        self.min_iter = min_iter
+        self.eta = eta
+        self.max_iter = max_iter
+
+    def run(self, runs):
+        max_iter = self.max_iter
+        if max_iter is None:
+            max_iter = max(run.net.max_iter() for run in runs)
+        alive = list(runs)
+        budget = min(self.min_iter, max_iter)
+        rung = 0
+        while True:
+            def should_stop(run, record, budget=budget):
+                return type(record) == TrainRecord and \
+                    record.iteration >= budget
+            jobs = [self._train_job(run, should_stop, "rung{}".format(rung))
+                    for run in alive if run.iteration < budget]
+            self.scheduler.run(jobs)
+            alive = [run for run in alive if not run.failed]
+            if budget >= max_iter or not alive:
+                break
+            alive.sort(key=lambda r: r.score(), reverse=True)
+            n_keep = max(1, len(alive) // self.eta)
+            for run in alive[n_keep:]:
+                run.stopped_at = run.iteration
+            alive = alive[:n_keep]
+            if len(alive) == 1:
+                budget = max_iter
+            else:
+                budget = min(budget * self.eta, max_iter)
+            rung += 1
+        return runs
+
+
+class MedianStopping(_Sweep):
+    """Stops a run if its best test accuracy is below the median of the
+    other runs' best accuracies at the same iteration."""
+
+    def __init__(self, scheduler, grace_iter=0, min_runs=3, log=True):
+        super().__init__(scheduler, log)
+        self.grace_iter = grace_iter
+        self.min_runs = min_runs
+        self._runs = []
+
+    def _should_stop(self, run, record):
+        if type(record) != TestRecord or record.iteration < self.grace_iter:
+            return False
+        others = [other.best_accuracy(record.iteration)
+                  for other in self._runs
+                  if other is not run and other.iteration >= record.iteration
+                  and other.history]
+        if len(others) < self.min_runs:
+            return False
+        if run.best_accuracy(record.iteration) < statistics.median(others):
+            run.stopped_at = record.iteration
+            return True
+        return False
+
+    def run(self, runs):
+        self._runs = list(runs)
+        self.scheduler.run([self._train_job(run, self._should_stop, "sweep")
+                            for run in runs])
+        return runs
+
+
+def print_sweep_summary(runs, file=None):
+    if file is None:
+        file = sys.stdout
+    print("{:^20}|{:^14}|{:^14}|{:^20}".format(
+        "name", "iterations", "accuracy [%]", "status"), file=file)
+    print("-" * 20 + "+" + "-" * 14 + "+" + "-" * 14 + "+" + "-" * 20,
+          file=file)
+    for run in sorted(runs, key=lambda r: r.score(), reverse=True):
+        if run.failed:
+            status = "failed ({})".format(run.returncode)
+        elif run.stopped_at is not None:
+            status = "stopped at {}".format(run.stopped_at)
+        else:
+            status = "finished"
+        accuracy = "-" if run.accuracy is None else \
+            "{:.3f}".format(100 * run.accuracy)
+        print("{:^20}|{:^14}|{:^14}|{:^20}".format(
+            run.name, run.iteration, accuracy, status), file=file)
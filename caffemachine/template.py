@@ -16,30 +16,63 @@ import glob
 import hashlib
 import json
 import copy
+import multiprocessing
 import os
+import re
 import sys
 import subprocess
 from subprocess import PIPE
-import shutil
 
-from jinja2 import Environment, FileSystemLoader, TemplateSyntaxError
+from jinja2 import FileSystemLoader, FileSystemBytecodeCache, \
+    TemplateSyntaxError
 from jinja2.sandbox import SandboxedEnvironment
 import jinja2
 import jinja2.meta
 
-from . import TEMPLATE_CACHE_DIR, NETWORKS_DIR
+from . import TEMPLATE_CACHE_DIR, NETWORKS_DIR, BYTECODE_CACHE_DIR, \
+    BLOB_STORE_DIR
+from .blobstore import BlobStore
 from .network import CaffeNet
 
 
+_worker_template = None
+
+
+def _init_render_worker(tmpl):
+    global _worker_template
+    _worker_template = tmpl
+
+
+def _render_worker(name_and_args):
+    name, template_args = name_and_args
+    try:
+        return _worker_template._render(name, template_args), None
+    except TemplateSyntaxError as e:
+        return None, _format_syntax_error(e)
+
+
+def _format_syntax_error(e):
+    return "[{}:{}] {} ".format(e.filename, e.lineno, e.message)
+
+
 class CaffeTemplate(object):
-    def __init__(self, git_url, git_tag=None, allow_download_script=None):
+    def __init__(self, git_url, git_tag=None, allow_download_script=None,
+                 interactive=True):
         if git_tag is None:
             git_tag = "master"
         if allow_download_script is None:
             self.allow_download_script = False
         else:
             self.allow_download_script = allow_download_script
+        # without a terminal, e.g. in the worker daemon, nobody can confirm
+        # the download script
+        self.interactive = interactive
 
+        self.git_url = git_url
+        self.git_tag = git_tag
+        self._env = None
+        self._blob_store = None
+        self.registry = None
         self.template_dir = self.cache_dir(git_url, git_tag)
         self.networks_dir = self.cache_dir(git_url, git_tag, for_networks=True)
         self._clone(git_url, git_tag)
@@ -54,12 +87,41 @@ class CaffeTemplate(object):
     def data_dir(self):
         return os.path.join(self.template_dir, "data")
 
+    def key(self):
+        """Identifies the template and its tag in the registry."""
+        return os.path.basename(os.path.normpath(self.networks_dir))
+
+    def set_registry(self, registry):
+        self.registry = registry
+
     def available_networks(self):
+        if self.registry is not None:
+            return self.registry.directories(self.key())
         networks = next(os.walk(self.networks_dir))[1]
         return [os.path.join(self.networks_dir, net) for net in networks]
 
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_env'] = None
+        return state
+
+    def environment(self):
+        if self._env is None:
+            os.makedirs(BYTECODE_CACHE_DIR, exist_ok=True)
+            self._env = SandboxedEnvironment(
+                loader=FileSystemLoader(self.template_dir),
+                extensions=[],
+                bytecode_cache=FileSystemBytecodeCache(BYTECODE_CACHE_DIR),
+            )
+        return self._env
+
+    def blob_store(self):
+        if self._blob_store is None:
+            self._blob_store = BlobStore(BLOB_STORE_DIR)
+        return self._blob_store
+
     def extract_variables(self):
-        env = Environment(loader=FileSystemLoader(self.template_dir))
+        env = self.environment()
         variables = set()
         templates_to_visit = list(self.template_files())
         while templates_to_visit:
@@ -75,31 +137,28 @@ class CaffeTemplate(object):
         for tmpl in glob.glob(self.template_dir + "/*.j2"):
             yield os.path.basename(tmpl)
 
-    def _render_files(self, template_args, output_dir):
-        env = SandboxedEnvironment(
-            loader=FileSystemLoader(self.template_dir),
-            extensions=[],
-        )
-        try:
-            for template in self.template_files():
-                output_str = env.get_template(template).render(template_args)
-                output_file = output_dir + "/" + template.rstrip(".j2")
-                with open(output_file, "w+") as f:
-                    f.write(output_str)
-        except TemplateSyntaxError as e:
-            print("[{}:{}] {} ".format(e.filename, e.lineno, e.message))
-            sys.exit(1)
+    def _render_strings(self, template_args):
+        env = self.environment()
+        for template in self.template_files():
+            output_str = env.get_template(template).render(template_args)
+            yield template.rstrip(".j2"), output_str
+
+    def _write_files(self, template_args, output_dir):
+        for filename, output_str in self._render_strings(template_args):
+            with open(output_dir + "/" + filename, "w+") as f:
+                f.write(output_str)
 
     def _copy_files(self, output_dir):
+        # the static files are shared by all networks through the blob store
         data_dir = os.path.join(self.template_dir, "data")
         output_data_dir = os.path.join(output_dir, "data")
+        sources = {}
         for f in os.listdir(self.template_dir):
             f_in_template = os.path.join(self.template_dir, f)
-            f_in_network = os.path.join(output_dir, f)
-            if os.path.isfile(f_in_template) and \
-                    not f_in_template.endswith(".j2") and \
-                    not os.path.exists(f_in_network):
-                shutil.copyfile(f_in_template, f_in_network)
+            if os.path.isfile(f_in_template) and f != ".git" and \
+                    not f_in_template.endswith(".j2"):
+                sources[f] = f_in_template
+        self.blob_store().link_files(sources, output_dir)
         if os.path.isdir(data_dir) and not os.path.exists(output_data_dir):
             os.symlink(data_dir, output_data_dir)
 
@@ -112,19 +171,48 @@ class CaffeTemplate(object):
     def find_or_render(self, name, template_args):
         output_dir = self._network_dir(name, template_args)
         if not os.path.exists(output_dir):
-            self.render(name, template_args)
-        else:
-            return CaffeNet(output_dir, template_args=template_args)
+            return self.render(name, template_args)
+        return CaffeNet(output_dir, template_args=template_args)
 
-    def render(self, name, template_args) -> CaffeNet:
+    def _render(self, name, template_args) -> CaffeNet:
         output_dir = self._network_dir(name, template_args)
         os.makedirs(output_dir, exist_ok=True)
         self._copy_files(output_dir)
-        self._render_files(template_args, output_dir)
+        self._write_files(template_args, output_dir)
         with open(output_dir + "/template_args.json", "w") as c:
             json.dump(template_args, c, indent=4)
         return CaffeNet(output_dir, template_args=template_args)
 
+    def _register(self, name, net):
+        if self.registry is not None:
+            self.registry.register(net, name, self.key())
+        return net
+
+    def render(self, name, template_args) -> CaffeNet:
+        try:
+            return self._register(name, self._render(name, template_args))
+        except TemplateSyntaxError as e:
+            print(_format_syntax_error(e))
+            sys.exit(1)
+
+    def render_many(self, networks, processes=None, chunksize=16):
+        """Renders `networks`, a list of `(name, template_args)` pairs, in
+        parallel worker processes. Every worker compiles the templates only
+        once."""
+        networks = list(networks)
+        if processes == 1 or len(networks) <= 1:
+            return [self.render(name, args) for name, args in networks]
+        with multiprocessing.Pool(processes, initializer=_init_render_worker,
+                                  initargs=(self,)) as pool:
+            results = pool.map(_render_worker, networks, chunksize)
+        nets = []
+        for (name, _), (net, error) in zip(networks, results):
+            if error is not None:
+                print(error)
+                sys.exit(1)
+            nets.append(self._register(name, net))
+        return nets
+
     @staticmethod
     def cache_dir(git_url, git_tag, for_networks=False):
         parts = git_url.split("/")
@@ -136,19 +224,91 @@ class CaffeTemplate(object):
         else:
             return os.path.join(TEMPLATE_CACHE_DIR, prefix + "-" + suffix[:32])
 
+    @staticmethod
+    def _git(args, **kwargs):
+        p = subprocess.Popen(["git"] + args, stdout=PIPE, stderr=PIPE,
+                             **kwargs)
+        stdout, stderr = p.communicate()
+        return p.returncode, stdout.decode('utf-8').strip()
+
+    @classmethod
+    def _resolve_remote(cls, git_url, git_tag):
+        returncode, output = cls._git(["ls-remote", git_url, git_tag])
+        assert returncode == 0, "Failed to query git repo {}".format(git_url)
+        refs = {}
+        for line in output.splitlines():
+            commit, ref = line.split("\t")
+            refs[ref] = commit
+        # annotated tags point to a tag object, `^{}` is the tagged commit
+        for ref in ("refs/tags/{}^{{}}".format(git_tag),
+                    "refs/tags/{}".format(git_tag),
+                    "refs/heads/{}".format(git_tag), git_tag):
+            if ref in refs:
+                return refs[ref]
+        return None
+
+    def _commit_file(self):
+        return self.template_dir + ".commit"
+
+    def _recorded_commit(self):
+        try:
+            with open(self._commit_file(), "r") as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    @staticmethod
+    def object_store(git_url):
+        return os.path.join(TEMPLATE_CACHE_DIR, "repos",
+                            hashlib.sha1(git_url.encode('utf-8')).hexdigest()
+                            [:32] + ".git")
+
     def _clone(self, git_url, git_tag=None):
-        def run(cmd, **kwargs):
-            return subprocess.call(cmd, shell=True,
-                                   stderr=PIPE, stdout=PIPE, **kwargs)
-        if not os.path.exists(self.template_dir + "/.git"):
-            git_clone_cmd ="git clone {} {}".format(git_url, self.template_dir)
-            assert run(git_clone_cmd) == 0, \
-                "Failed to clone git repo"
-
-        if git_tag is not None:
-            git_checkout_cmd ="git checkout {}".format(git_tag)
-            assert run(git_checkout_cmd, cwd=self.template_dir) == 0, \
-                "Failed to clone git repo"
+        def git(args, **kwargs):
+            returncode, _ = self._git(args, **kwargs)
+            assert returncode == 0, \
+                "Failed to run `git {}`".format(" ".join(args))
+
+        if os.path.isdir(self.template_dir + "/.git"):
+            # a full clone made by an older version
+            git(["checkout", git_tag], cwd=self.template_dir)
+            return
+        recorded = self._recorded_commit()
+        is_sha = re.fullmatch("[0-9a-f]{7,40}", git_tag) is not None
+        if is_sha:
+            # a commit never changes, no need to ask the remote
+            if recorded and recorded.startswith(git_tag) and \
+                    os.path.isdir(self.template_dir):
+                return
+            commit = None
+        else:
+            commit = self._resolve_remote(git_url, git_tag)
+        if recorded and recorded == commit and \
+                os.path.isdir(self.template_dir):
+            return
+        store = self.object_store(git_url)
+        if not os.path.exists(store):
+            git(["init", "-q", "--bare", store])
+        # all tags of a repository share one object store, only the
+        # requested commit is fetched.
+        returncode, _ = self._git(["fetch", "-q", "--depth", "1", git_url,
+                                   commit or git_tag], cwd=store)
+        if returncode != 0:
+            git(["fetch", "-q", git_url, "+refs/heads/*:refs/heads/*",
+                 "+refs/tags/*:refs/tags/*"], cwd=store)
+        if commit is None:
+            _, commit = self._git(["rev-parse", "--verify",
+                                   git_tag + "^{commit}"], cwd=store)
+        assert commit, "Failed to fetch {} of {}".format(git_tag, git_url)
+        if os.path.isdir(self.template_dir):
+            git(["checkout", "-q", "--detach", commit],
+                cwd=self.template_dir)
+        else:
+            git(["worktree", "prune"], cwd=store)
+            git(["worktree", "add", "-q", "--detach", self.template_dir,
+                 commit], cwd=store)
+        with open(self._commit_file(), "w") as f:
+            f.write(commit)
 
     def _print_security_warning(self):
         print("*" * 80)
@@ -160,13 +320,19 @@ class CaffeTemplate(object):
         while answer != "Y":
             print("This is potential harmful! "
                   "Do you trust the code above? [Y/n] ", end="", flush=True)
-            answer = sys.stdin.readline().rstrip('\n')
-            if answer == "n":
+            line = sys.stdin.readline()
+            answer = line.rstrip('\n')
+            if answer == "n" or not line:
                 print("You decided to not run the download script. Aborting!")
                 sys.exit(1)
 
     def _run_get_data_script(self):
         if not self.allow_download_script:
+            if not self.interactive:
+                raise PermissionError(
+                    "The template {} needs to run its download script {}, "
+                    "but running it is not allowed.".format(
+                        self.git_url, self.get_data_script()))
             self._print_security_warning()
         subprocess.check_call(self.get_data_script(), cwd=self.template_dir)
 
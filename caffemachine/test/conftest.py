@@ -11,8 +11,13 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import os
+import sys
+
 import pytest
-from caffemachine import CaffeTemplate
+import caffemachine.template
+from caffemachine import Caffe, CaffeNet, CaffeTemplate
+from caffemachine.test.helpers import make_template_repo, write_fake_caffe
 
 
 @pytest.fixture
@@ -20,6 +25,75 @@ def test_tmpl() -> CaffeTemplate:
     git_repo = "file:///home/leon/uni/bachelor/coffe_machine_test"
     return CaffeTemplate(git_repo)
 
+local_template_files = {
+    "train.prototxt.j2": "name: \"{{ name }}\"\n"
+                         "{% include 'layers.inc' %}\n",
+    "deploy.prototxt.j2": "name: \"{{ name }}-deploy\"\n"
+                          "{% include 'layers.inc' %}\n",
+    "solver.prototxt.j2": "net: \"train.prototxt\"\n"
+                          "max_iter: {{ max_iter | default(1000) }}\n"
+                          "snapshot_prefix: \"lenet\"\n",
+    "layers.inc": "layer { name: \"ip1\" type: \"InnerProduct\" "
+                  "inner_product_param { num_output: {{ num_output }} } }",
+    "README.md": "A test template\n",
+}
+
+
+@pytest.fixture
+def cache_dirs(tmpdir, monkeypatch):
+    cache = tmpdir.mkdir("cache")
+    monkeypatch.setattr(caffemachine.template, "TEMPLATE_CACHE_DIR",
+                        str(cache.join("templates")))
+    monkeypatch.setattr(caffemachine.template, "NETWORKS_DIR",
+                        str(cache.join("networks")))
+    monkeypatch.setattr(caffemachine.template, "BYTECODE_CACHE_DIR",
+                        str(cache.join("bytecode")))
+    monkeypatch.setattr(caffemachine.template, "BLOB_STORE_DIR",
+                        str(cache.join("blobs")))
+    return cache
+
+
+@pytest.fixture
+def template_repo(tmpdir):
+    """Factory of local template repositories, returns their git url."""
+    def make(files=local_template_files, name="template_repo"):
+        return make_template_repo(str(tmpdir.join(name)), files)
+    return make
+
+
+@pytest.fixture
+def local_tmpl(cache_dirs, template_repo) -> CaffeTemplate:
+    return CaffeTemplate(template_repo())
+
+
+@pytest.fixture
+def empty_net(tmpdir):
+    return CaffeNet(str(tmpdir), template_args={})
+
+
+@pytest.fixture
+def touch_snapshot():
+    """Creates empty snapshot files of an iteration in a network
+    directory."""
+    def touch(net, iteration, kinds=("caffemodel", "solverstate")):
+        for kind in kinds:
+            name = "lenet_iter_{}.{}".format(iteration, kind)
+            open(os.path.join(net.directory, name), "w").close()
+    return touch
+
+
+@pytest.fixture
+def make_net(tmpdir):
+    """Writes a solver for the fake `train_caffe` and returns the network
+    in `tmpdir`, or in its subdirectory `name`."""
+    def make(max_iter, quality=0.9, name=None):
+        directory = tmpdir.join(name).ensure(dir=True) if name else tmpdir
+        directory.join("solver.prototxt").write(
+            "max_iter: {}\n# quality: {}\n".format(max_iter, quality))
+        return CaffeNet(str(directory), template_args={})
+    return make
+
+
 @pytest.fixture()
 def net(test_tmpl) -> CaffeTemplate:
     config = {
@@ -34,3 +108,97 @@ def net(test_tmpl) -> CaffeTemplate:
     }
     return test_tmpl.render("test", config)
 
+
+fake_caffe_source = '''#!{python}
+import json, sys, time
+events = {events!r}
+start = time.time()
+time.sleep(0.2)
+if sys.argv[1] == "test":
+    sys.stderr.write("I0915 caffe.cpp:313] accuracy = 0.97\\n")
+else:
+    sys.stderr.write("I0915 caffe.cpp:376] Average Forward pass: 4.5 ms.\\n"
+                     "I0915 caffe.cpp:378] Average Backward pass: 5.5 ms.\\n")
+with open(events, "a") as f:
+    f.write(json.dumps([sys.argv[1], start, time.time()]) + "\\n")
+'''
+
+
+@pytest.fixture
+def caffe_script(tmpdir):
+    """Factory of fake caffe executables. The script `source` is formatted
+    with the `python` interpreter and the keyword arguments."""
+    def make(source, **kwargs):
+        return Caffe(write_fake_caffe(
+            str(tmpdir), source.format(python=sys.executable, **kwargs)))
+    return make
+
+
+@pytest.fixture
+def fake_caffe(tmpdir, caffe_script):
+    events = str(tmpdir.join("events"))
+    return caffe_script(fake_caffe_source, events=events), events
+
+
+# accuracy grows with the iteration up to the `quality` of the solver
+fake_train_source = '''#!{python}
+import re, signal, sys, time
+args = dict(zip(sys.argv[2::2], sys.argv[3::2]))
+solver = open(args["-solver"]).read()
+max_iter = int(re.search(r"max_iter: (\\d+)", solver).group(1))
+quality = float(re.search(r"quality: ([\\d.]+)", solver).group(1))
+start = 0
+if "-snapshot" in args:
+    start = int(re.search(r"_iter_(\\d+)", args["-snapshot"]).group(1))
+    # the weights of the solverstate's iteration are loaded too
+    open(args["-snapshot"].replace(".solverstate", ".caffemodel")).close()
+stop = []
+signal.signal(signal.SIGINT, lambda *a: stop.append(True))
+log = sys.stderr
+it = start
+while it < max_iter and not stop:
+    if it % 50 == 0:
+        log.write("I solver.cpp:404] Iteration %d, Testing net (#0)\\n" % it)
+        log.write("I solver.cpp:453]     Test net output #0: accuracy = %f\\n"
+                  % (quality * it / max_iter))
+    if it % 10 == 0:
+        log.write("I solver.cpp:228] Iteration %d, loss = %f\\n"
+                  % (it, 1 - quality * it / max_iter))
+        log.write("I sgd_solver.cpp:106] Iteration %d, lr = 0.01\\n" % it)
+    log.flush()
+    time.sleep(0.0005)
+    it += 1
+for kind in ("caffemodel", "solverstate"):
+    open("net_iter_%d.%s" % (it, kind), "w").close()
+'''
+
+
+@pytest.fixture
+def train_caffe(caffe_script):
+    return caffe_script(fake_train_source)
+
+
+# trains by writing the final snapshot, tests and times instantly
+pipeline_caffe_source = '''#!{python}
+import re, sys
+args = dict(zip(sys.argv[2::2], sys.argv[3::2]))
+with open({calls!r}, "a") as f:
+    f.write(sys.argv[1] + "\\n")
+if sys.argv[1] == "train":
+    solver = open(args["-solver"]).read()
+    max_iter = int(re.search(r"max_iter: (\\d+)", solver).group(1))
+    for kind in ("caffemodel", "solverstate"):
+        with open("lenet_iter_%d.%s" % (max_iter, kind), "w") as f:
+            f.write("trained")
+elif sys.argv[1] == "test":
+    sys.stderr.write("I caffe.cpp:313] accuracy = 0.9\\n")
+else:
+    sys.stderr.write("I caffe.cpp:376] Average Forward pass: 3.0 ms.\\n"
+                     "I caffe.cpp:378] Average Backward pass: 4.0 ms.\\n")
+'''
+
+
+@pytest.fixture
+def pipeline_caffe(tmpdir, caffe_script):
+    calls = str(tmpdir.join("calls"))
+    return caffe_script(pipeline_caffe_source, calls=calls), calls
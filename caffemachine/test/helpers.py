@@ -0,0 +1,47 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers shared by the tests and the benchmarks in `benchmarks/`."""
+
+import os
+import subprocess
+
+
+def write_fake_caffe(directory, source):
+    """Writes the executable `caffe` with the script `source` to
+    `directory`."""
+    os.makedirs(directory, exist_ok=True)
+    executable = os.path.join(directory, "caffe")
+    with open(executable, "w") as f:
+        f.write(source)
+    os.chmod(executable, 0o755)
+    return executable
+
+
+def make_template_repo(directory, files):
+    """Commits `files` to a new git repository on the `master` branch.
+    Returns its git url."""
+    os.makedirs(directory, exist_ok=True)
+    for name, content in files.items():
+        with open(os.path.join(directory, name), "w") as f:
+            f.write(content)
+    env = dict(os.environ, GIT_AUTHOR_NAME="caffemachine",
+               GIT_AUTHOR_EMAIL="caffemachine@localhost",
+               GIT_COMMITTER_NAME="caffemachine",
+               GIT_COMMITTER_EMAIL="caffemachine@localhost")
+    for cmd in (["git", "init", "-q", "-b", "master"],
+                ["git", "add", "-A"],
+                ["git", "commit", "-q", "-m", "template"]):
+        subprocess.check_call(cmd, cwd=directory, env=env)
+    return "file://" + directory
@@ -0,0 +1,64 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from caffemachine import CaffeNet
+from caffemachine.benchmark import Benchmark, BaselineStore, \
+    find_regressions, median_confidence_interval, percentile, \
+    reject_outliers, summarize
+
+
+def test_reject_outliers():
+    samples = [10.1, 10.3, 9.9, 10.0, 10.2, 25.0]
+    assert reject_outliers(samples) == samples[:-1]
+    assert reject_outliers([1., 1., 1.]) == [1., 1., 1.]
+
+
+def test_percentile():
+    samples = list(range(1, 11))
+    assert percentile(samples, 50) == 5.5
+    assert percentile(samples, 0) == 1
+    assert percentile(samples, 100) == 10
+
+
+def test_median_confidence_interval():
+    samples = list(range(100))
+    low, high = median_confidence_interval(samples)
+    assert low < 49.5 < high
+    assert high - low < 25
+
+
+def test_find_regressions():
+    baseline = {'forward': summarize([10., 10.1, 9.9, 10.05, 9.95] * 4),
+                'backward': summarize([5.] * 10)}
+    same = {'forward': summarize([10., 10.2, 9.8, 10.1, 9.9] * 4),
+            'backward': summarize([5.01] * 10)}
+    slower = {'forward': summarize([11., 11.1, 10.9, 11.05, 10.95] * 4),
+              'backward': summarize([5.] * 10)}
+    assert find_regressions(baseline, same) == []
+    regressions = find_regressions(baseline, slower)
+    assert [r[0] for r in regressions] == ['forward']
+
+
+def test_benchmark_bypasses_cache_and_stores_baseline(tmpdir, fake_caffe):
+    caffe, events = fake_caffe
+    net = CaffeNet(str(tmpdir), template_args={})
+    result = Benchmark(caffe, trials=3, warmup=1).run(net)
+    assert result['forward']['median'] == 4.5
+    assert result['forward']['n'] == 3
+    with open(events) as f:
+        assert len(f.readlines()) == 4
+    store = BaselineStore(str(tmpdir.join("baselines.json")))
+    store.save({'net': result})
+    assert find_regressions(store.get('net'), result) == []
@@ -0,0 +1,82 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import os
+
+from caffemachine import CaffeNet
+from caffemachine.cache import ResultCache
+
+
+def test_result_cache_eviction(tmpdir):
+    cache = ResultCache(str(tmpdir.join("cache")), max_size=250)
+    for i in range(10):
+        key = cache.key(i=i)
+        cache.put(key, {'i': i, 'padding': "x" * 50})
+        os.utime(cache._entry_file(key), (i, i))
+    assert cache.size() <= 250
+    assert cache.get(cache.key(i=9)) == {'i': 9, 'padding': "x" * 50}
+    assert cache.get(cache.key(i=0)) is None
+
+
+def test_result_cache_put_scans_only_when_full(tmpdir, monkeypatch):
+    cache = ResultCache(str(tmpdir.join("cache")), max_size=4000)
+    scans = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        scans.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+    for i in range(10):
+        cache.put(cache.key(i=i), {'i': i})
+    assert len(scans) == 1
+    for i in range(100):
+        cache.put(cache.key(i=i), {'i': i, 'padding': "x" * 50})
+    assert cache.size() <= 4000
+    assert 1 < len(scans) < 10
+
+
+def test_file_digest_changes_with_content(tmpdir):
+    cache = ResultCache(str(tmpdir.join("cache")))
+    f = tmpdir.join("w.caffemodel")
+    f.write("a")
+    first = cache.file_digest(str(f))
+    assert cache.file_digest(str(f)) == first
+    f.write("b")
+    os.utime(str(f), ns=(0, 1))
+    assert cache.file_digest(str(f)) != first
+
+
+def test_caffe_uses_cache(tmpdir, fake_caffe):
+    caffe, events = fake_caffe
+    caffe.set_cache(ResultCache(str(tmpdir.join("cache"))))
+    net = CaffeNet(str(tmpdir), template_args={})
+    tmpdir.join("train.prototxt").write("name: 'a'")
+    tmpdir.join("deploy.prototxt").write("name: 'a'")
+    weights = tmpdir.join("net_iter_100.caffemodel")
+    weights.write("weights")
+    for _ in range(2):
+        assert caffe.test(net, str(weights)) == 0.97
+        assert caffe.time(net)['avg_forward'] == 4.5
+    with open(events) as f:
+        assert [json.loads(l)[0] for l in f] == ["test", "time"]
+    weights.write("other weights")
+    caffe.test(net, str(weights))
+    caffe.set_gpus(0)
+    caffe.time(net)
+    with open(events) as f:
+        assert len(f.readlines()) == 4
@@ -0,0 +1,150 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pytest
+
+from caffemachine import prototxt
+from caffemachine.costmodel import analyze, within_budget
+
+lenet_deploy = """
+name: "LeNet"
+layer {
+  name: "data"
+  type: "Input"
+  top: "data"
+  input_param { shape: { dim: 64 dim: 1 dim: 28 dim: 28 } }
+}
+layer {
+  name: "conv1" type: "Convolution" bottom: "data" top: "conv1"
+  convolution_param { num_output: 20 kernel_size: 5 stride: 1 }
+}
+layer {
+  name: "pool1" type: "Pooling" bottom: "conv1" top: "pool1"
+  pooling_param { pool: MAX kernel_size: 2 stride: 2 }
+}
+layer {
+  name: "conv2" type: "Convolution" bottom: "pool1" top: "conv2"
+  convolution_param { num_output: 50 kernel_size: 5 stride: 1 }
+}
+layer {
+  name: "pool2" type: "Pooling" bottom: "conv2" top: "pool2"
+  pooling_param { pool: MAX kernel_size: 2 stride: 2 }
+}
+layer {
+  name: "ip1" type: "InnerProduct" bottom: "pool2" top: "ip1"
+  inner_product_param { num_output: 500 }
+}
+layer { name: "relu1" type: "ReLU" bottom: "ip1" top: "ip1" }
+layer {
+  name: "ip2" type: "InnerProduct" bottom: "ip1" top: "ip2"
+  inner_product_param { num_output: 10 }
+}
+layer { name: "prob" type: "Softmax" bottom: "ip2" top: "prob" }
+"""
+
+lenet_train = """
+name: "LeNet"
+layer {
+  name: "mnist" type: "Data" top: "data" top: "label"
+  include { phase: TRAIN }
+  data_param { source: "train_lmdb" batch_size: 64 backend: LMDB }
+}
+layer {
+  name: "mnist" type: "Data" top: "data" top: "label"
+  include { phase: TEST }
+  data_param { source: "test_lmdb" batch_size: 100 backend: LMDB }
+}
+layer {
+  name: "ip1" type: "InnerProduct" bottom: "data" top: "ip1"
+  inner_product_param { num_output: 10 }
+}
+layer {
+  name: "accuracy" type: "Accuracy" bottom: "ip1" bottom: "label"
+  top: "accuracy" include { phase: TEST }
+}
+layer {
+  name: "loss" type: "SoftmaxWithLoss" bottom: "ip1" bottom: "label"
+  top: "loss"
+}
+"""
+
+
+def test_parse_prototxt():
+    net = prototxt.parse(lenet_deploy)
+    assert prototxt.get(net, 'name') == "LeNet"
+    conv1 = net['layer'][1]
+    assert prototxt.get(conv1['convolution_param'][0], 'kernel_size') == 5
+    pool = prototxt.get(net['layer'][2], 'pooling_param')
+    assert prototxt.get(pool, 'pool') == "MAX"
+    assert prototxt.parse('a: [1, 2] b: "x\\"y" c { d: true }') == \
+        {'a': [1, 2], 'b': ['x"y'], 'c': [{'d': [True]}]}
+    with pytest.raises(prototxt.ParseError):
+        prototxt.parse("layer { name: 'a' ")
+
+
+def test_lenet_cost():
+    cost = analyze(prototxt.parse(lenet_deploy))
+    shapes = {layer.name: layer.output_shapes[0] for layer in cost.layers}
+    assert shapes['conv1'] == [64, 20, 24, 24]
+    assert shapes['pool1'] == [64, 20, 12, 12]
+    assert shapes['pool2'] == [64, 50, 4, 4]
+    assert shapes['ip2'] == [64, 10]
+    # the well known 431080 parameters of lenet
+    assert cost.params == 431080
+    conv1 = cost.layers[1]
+    assert conv1.flops == 2 * 64 * 20 * 24 * 24 * 25
+    assert not any(layer.estimated for layer in cost.layers)
+    # relu1 is in-place and does not allocate memory
+    assert 'ip1' in cost.blobs and len(cost.blobs) == 8
+    assert within_budget(cost, max_flops=cost.flops)
+    assert not within_budget(cost, max_memory=cost.memory_bytes - 1)
+
+
+def test_data_layer_phases():
+    net = prototxt.parse(lenet_train)
+    with pytest.raises(ValueError):
+        analyze(net)
+    cost = analyze(net, {'data': [1, 1, 28, 28]}, phase='TEST')
+    assert cost.layers[0].output_shapes == [[100, 1, 28, 28], [100]]
+    assert [layer.name for layer in cost.layers] == \
+        ['mnist', 'ip1', 'accuracy', 'loss']
+    train = analyze(net, {'data': [1, 1, 28, 28]}, phase='TRAIN')
+    assert train.layers[0].output_shapes[0][0] == 64
+    assert len(train.layers) == 3
+
+
+def test_blobs_without_producing_layer():
+    net = prototxt.parse(
+        'layer { name: "ip" type: "InnerProduct" bottom: "data" top: "ip" '
+        'inner_product_param { num_output: 10 } }')
+    with pytest.raises(ValueError, match="unknown blob `data`"):
+        analyze(net)
+    cost = analyze(net, {'data': [1, 1, 28, 28]})
+    assert cost.layers[0].output_shapes == [[1, 10]]
+    assert cost.blobs['data'] == [1, 1, 28, 28]
+    custom = prototxt.parse(
+        'layer { name: "feed" type: "CustomFeed" top: "data" }')
+    with pytest.raises(ValueError, match="unsupported layer `feed`"):
+        analyze(custom)
+
+
+def test_layer_included_in_several_phases():
+    net = prototxt.parse(
+        'input: "data" input_shape { dim: 1 dim: 10 } '
+        'layer { name: "relu" type: "ReLU" bottom: "data" top: "data" '
+        'include { phase: TRAIN } include { phase: TEST } }')
+    for phase in ('TRAIN', 'TEST'):
+        assert [layer.name for layer in analyze(net, phase=phase).layers] \
+            == ["relu"]
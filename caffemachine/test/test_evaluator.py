@@ -0,0 +1,59 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import time
+
+from caffemachine import CaffeNet
+from caffemachine.evaluator import AsyncEvaluator, Evaluation
+
+
+def evaluations(tmpdir, n):
+    result = []
+    for i in range(n):
+        directory = tmpdir.mkdir("net{}".format(i))
+        net = CaffeNet(str(directory), template_args={})
+        result.append(Evaluation("net{}".format(i), net, "w.caffemodel"))
+    return result
+
+
+def read_events(events):
+    with open(events) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_async_evaluator_isolated_timing(tmpdir, fake_caffe):
+    caffe, events = fake_caffe
+    start = time.time()
+    results = AsyncEvaluator(caffe, jobs=4).evaluate(evaluations(tmpdir, 4))
+    assert all(e.accuracy == 0.97 for e in results)
+    assert all(e.timings['avg_forward'] == 4.5 for e in results)
+    timings = sorted((s, e) for kind, s, e in read_events(events)
+                     if kind == "time")
+    tests = [(s, e) for kind, s, e in read_events(events) if kind == "test"]
+    assert max(e for s, e in tests) <= min(s for s, e in timings)
+    for (_, end), (next_start, _) in zip(timings, timings[1:]):
+        assert end <= next_start
+    # 4 tests in parallel + 4 sequential timings
+    assert time.time() - start < 8 * 0.2 + 1
+
+
+def test_async_evaluator_parallel_timing(tmpdir, fake_caffe):
+    caffe, events = fake_caffe
+    evaluator = AsyncEvaluator(caffe, jobs=8, isolate_timing=False)
+    start = time.time()
+    results = evaluator.evaluate(evaluations(tmpdir, 4))
+    assert all(e.timings['avg_backward'] == 5.5 for e in results)
+    assert time.time() - start < 4 * 0.2 + 1
@@ -13,10 +13,13 @@
 # limitations under the License.
 
 import os
+import shutil
 
 import pytest
 import subprocess
+import caffemachine.executable
 from caffemachine import Caffe
+from caffemachine.executable import build_key, _resolve_commit
 
 @pytest.fixture
 def caffe():
@@ -48,3 +51,54 @@ def test_caffe_test(net):
     caffe.train(net)
     for w in net.weights():
         assert caffe.test(net, w) > 0.96
+
+
+def test_build_key_depends_on_options():
+    repo = "https://github.com/BVLC/caffe.git"
+    commit = "a" * 40
+    cpu = build_key(repo, commit, {'blas': "open", 'cpu_only': True})
+    gpu = build_key(repo, commit, {'blas': "open", 'cpu_only': False})
+    mkl = build_key(repo, commit, {'blas': "mkl", 'cpu_only': True})
+    assert len({cpu, gpu, mkl}) == 3
+    assert cpu == build_key(repo, commit, {'cpu_only': True, 'blas': "open"})
+    assert cpu != build_key(repo, "b" * 40, {'blas': "open",
+                                             'cpu_only': True})
+
+
+def test_resolve_commit_of_tags(template_repo):
+    source = template_repo(name="repo")[len("file://"):]
+    subprocess.check_call(["git", "tag", "rc2"], cwd=source)
+    commit = _resolve_commit(source, "master")
+    assert len(commit) == 40
+    assert _resolve_commit(source, "rc2") == commit
+
+
+@pytest.mark.skipif(shutil.which("cmake") is None, reason="needs cmake")
+def test_get_caffe_build_cache(tmpdir, template_repo, monkeypatch):
+    monkeypatch.setattr(caffemachine.executable, "CAFFE_CACHE_DIR",
+                        str(tmpdir.join("caffe_cache")))
+    repo = template_repo(name="fake_caffe", files={
+        "CMakeLists.txt": "cmake_minimum_required(VERSION 3.5)\n"
+                          "project(fake_caffe NONE)\n"
+                          "install(PROGRAMS caffe DESTINATION bin)\n",
+        "caffe": "#!/bin/sh\necho fake caffe\n",
+    })
+    subprocess.check_call(["git", "tag", "rc2"], cwd=repo[len("file://"):])
+    cpu = Caffe.get_caffe("master", git_repo=repo)
+    assert subprocess.check_output([cpu.executable]) == b"fake caffe\n"
+    # tags of the same commit reuse the build, other options do not
+    assert Caffe.get_caffe("rc2", git_repo=repo).executable == cpu.executable
+    gpu = Caffe.get_caffe("master", git_repo=repo, cpu_only=False)
+    assert gpu.executable != cpu.executable
+    assert os.path.exists(gpu.executable)
+
+
+def test_get_caffe_raises_if_git_fails(tmpdir, template_repo, monkeypatch):
+    monkeypatch.setattr(caffemachine.executable, "CAFFE_CACHE_DIR",
+                        str(tmpdir.join("caffe_cache")))
+    with pytest.raises(subprocess.CalledProcessError):
+        Caffe.get_caffe("master", git_repo="file://" +
+                        str(tmpdir.join("missing")))
+    repo = template_repo(name="fake_caffe")
+    with pytest.raises(ValueError):
+        Caffe.get_caffe("no-such-tag", git_repo=repo)
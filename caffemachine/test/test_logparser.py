@@ -0,0 +1,91 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import io
+
+import pytest
+
+from caffemachine.logparser import TrainLogParser, MetricsWriter, \
+    TrainRecord, TestRecord, read_metrics, parse_timings
+import caffemachine.logparser
+
+train_log = """\
+I0915 10:00:00.000000  1234 solver.cpp:404] Iteration 0, Testing net (#0)
+I0915 10:00:01.000000  1234 solver.cpp:453]     Test net output #0: accuracy = 0.0823
+I0915 10:00:01.000000  1234 solver.cpp:453]     Test net output #1: loss = 2.3421 (* 1 = 2.3421 loss)
+I0915 10:00:01.000000  1234 solver.cpp:228] Iteration 0, loss = 2.3012
+I0915 10:00:01.000000  1234 solver.cpp:244]     Train net output #0: loss = 2.3012 (* 1 = 2.3012 loss)
+I0915 10:00:01.000000  1234 sgd_solver.cpp:106] Iteration 0, lr = 0.01
+I0915 10:00:02.000000  1234 solver.cpp:228] Iteration 100 (52.1 iter/s, 1.92s/100 iters), loss = 0.2107
+I0915 10:00:02.000000  1234 sgd_solver.cpp:106] Iteration 100, lr = 9.9e-05
+I0915 10:00:03.000000  1234 solver.cpp:404] Iteration 200, Testing net (#0)
+I0915 10:00:04.000000  1234 solver.cpp:453]     Test net output #0: accuracy = 0.9711
+I0915 10:00:04.000000  1234 solver.cpp:453]     Test net output #1: loss = 0.0912 (* 1 = 0.0912 loss)
+"""
+
+
+def test_train_log_parser():
+    records = list(TrainLogParser().parse(train_log.splitlines(True)))
+    assert records == [
+        TestRecord(0, 0.0823, 2.3421),
+        TrainRecord(0, 2.3012, 0.01),
+        TrainRecord(100, 0.2107, 9.9e-05),
+        TestRecord(200, 0.9711, 0.0912),
+    ]
+
+
+def test_metrics_file_roundtrip(tmpdir):
+    filename = str(tmpdir.join("metrics.csv"))
+    records = list(TrainLogParser().parse(train_log.splitlines(True)))
+    with MetricsWriter(filename) as writer:
+        for record in records[:2]:
+            writer.write(record)
+    with MetricsWriter(filename) as writer:
+        for record in records[2:]:
+            writer.write(record)
+    assert list(read_metrics(filename)) == records
+
+
+time_log = """\
+I0915 10:00:00.000000  1234 caffe.cpp:365] Average time per layer:
+I0915 10:00:00.000000  1234 caffe.cpp:368]      mnist\tforward: 0.0078 ms.
+I0915 10:00:00.000000  1234 caffe.cpp:371]      mnist\tbackward: 0.0012 ms.
+I0915 10:00:00.000000  1234 caffe.cpp:368]      conv1/relu\tforward: 1.25 ms.
+I0915 10:00:00.000000  1234 caffe.cpp:371]      conv1/relu\tbackward: 2.5 ms.
+I0915 10:00:00.000000  1234 caffe.cpp:376] Average Forward pass: 4.1152 ms.
+I0915 10:00:00.000000  1234 caffe.cpp:378] Average Backward pass: 5.5342 ms.
+"""
+
+expected_timings = {
+    'layers': {
+        'mnist': {'forward': 0.0078, 'backward': 0.0012},
+        'conv1/relu': {'forward': 1.25, 'backward': 2.5},
+    },
+    'avg_forward': 4.1152,
+    'avg_backward': 5.5342,
+}
+
+
+def test_parse_timings(monkeypatch):
+    assert parse_timings(time_log) == expected_timings
+    assert parse_timings(time_log.splitlines(True)) == expected_timings
+    # blocks smaller than a line must not split matches
+    monkeypatch.setattr(caffemachine.logparser, "_chunk_size", 7)
+    assert parse_timings(io.StringIO(time_log)) == expected_timings
+
+
+def test_parse_timings_missing_averages():
+    with pytest.raises(ValueError):
+        parse_timings(time_log.splitlines(True)[:3])
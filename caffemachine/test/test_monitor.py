@@ -0,0 +1,63 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import os
+import urllib.request
+
+from caffemachine.logparser import TrainRecord
+from caffemachine.monitor import MetricsServer, TrainingMonitor, \
+    process_stats
+
+
+def test_process_stats():
+    stats = process_stats(os.getpid())
+    assert stats['rss_bytes'] > 0 and stats['cpu_seconds'] > 0
+    assert process_stats(2 ** 22 + 1) is None
+
+
+def test_monitor_rate_and_eta(make_net, monkeypatch):
+    net = make_net(1000)
+    monitor = TrainingMonitor()
+    monitor.start(net, os.getpid())
+    for now, iteration in ((100.0, 100), (110.0, 300)):
+        monkeypatch.setattr("time.time", lambda: now)
+        monitor.update(net, TrainRecord(iteration, 0.5, 0.01))
+    run, = monitor.snapshot()
+    assert run['iterations_per_sec'] == 20
+    assert run['eta_seconds'] == 35
+    assert run['loss'] == 0.5 and run['running']
+
+
+def test_metrics_endpoint(tmpdir, make_net, train_caffe):
+    net = make_net(200)
+    monitor = TrainingMonitor()
+    train_caffe.set_monitor(monitor)
+    server = MetricsServer(("127.0.0.1", 0), monitor).start()
+    try:
+        assert train_caffe.train(net, output=io.StringIO()) == 0
+        url = "http://{}/metrics".format(server.address)
+        with urllib.request.urlopen(url) as response:
+            text = response.read().decode('utf-8')
+        with urllib.request.urlopen(url + ".json") as response:
+            runs = json.loads(response.read().decode('utf-8'))
+    finally:
+        server.stop()
+    label = '{{network="{}"}}'.format(os.path.basename(str(tmpdir)))
+    assert "caffemachine_iteration" + label + " 190.0" in text
+    assert "caffemachine_running" + label + " 0.0" in text
+    assert "caffemachine_process_resident_memory_bytes" + label in text
+    assert runs[0]['returncode'] == 0
+    assert abs(runs[0]['test_accuracy'] - 0.9 * 150 / 200) < 1e-6
@@ -0,0 +1,76 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+
+import pytest
+
+from caffemachine import CaffeNet
+from caffemachine.network import SnapshotIndex
+
+
+def test_weights_sorted_by_iteration(empty_net, touch_snapshot):
+    for i in [1000, 200, 30000, 5]:
+        touch_snapshot(empty_net, i)
+    weights = empty_net.weights()
+    assert [CaffeNet.iteration_of_weights(w) for w in weights] == \
+        [5, 200, 1000, 30000]
+    assert empty_net.highest_iteration_weights().endswith(
+        "lenet_iter_30000.caffemodel")
+    assert empty_net.latest_solverstate().endswith(
+        "lenet_iter_30000.solverstate")
+    assert len(empty_net.weights(start=200, stop=30000)) == 2
+
+
+def test_index_follows_directory_changes(empty_net, touch_snapshot,
+                                         monkeypatch):
+    monkeypatch.setattr(SnapshotIndex, "mtime_resolution", 0)
+    touch_snapshot(empty_net, 100)
+    assert len(empty_net.weights()) == 1
+    touch_snapshot(empty_net, 200, kinds=("caffemodel",))
+    os.remove(os.path.join(empty_net.directory,
+                           "lenet_iter_100.caffemodel"))
+    # force a different mtime, the test may run faster than the
+    # filesystem's timestamp resolution.
+    os.utime(empty_net.directory, ns=(0, 1))
+    assert [CaffeNet.iteration_of_weights(w)
+            for w in empty_net.weights()] == [200]
+    assert empty_net.latest_solverstate().endswith("_iter_100.solverstate")
+
+
+def test_no_weights(empty_net):
+    assert empty_net.weights() == []
+    assert empty_net.latest_solverstate() is None
+    with pytest.raises(IndexError):
+        empty_net.highest_iteration_weights()
+
+
+def test_resume_from_latest_solverstate(make_net, train_caffe, capsys):
+    net = make_net(200)
+    stop_at_100 = lambda record: record.iteration >= 100
+    with open(os.devnull, "w") as devnull:
+        assert train_caffe.train(net, output=devnull,
+                                 callback=stop_at_100) == 0
+    assert not net.is_trained()
+    assert net.latest_iteration() == 101
+    assert train_caffe.resume(net) == 0
+    assert "Resuming from" in capsys.readouterr().out
+    assert net.is_trained()
+    assert os.path.exists(net.train_state_file())
+    assert train_caffe.resume(net) == 0
+    assert "already trained" in capsys.readouterr().out
+    # a larger max_iter in the solver means there is work left
+    make_net(300)
+    assert not net.is_trained()
@@ -0,0 +1,47 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+
+import pytest
+
+from caffemachine import Caffe
+from caffemachine.benchmark import find_regressions, summarize
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..",
+                                "benchmarks"))
+from bench_overhead import CASES, run_case, timing_log  # noqa: E402
+
+
+def test_timing_log_is_parsed():
+    report = Caffe()._get_timings(timing_log(3))
+    assert sorted(report['layers']) == ["conv0", "conv1", "conv2"]
+    assert report['layers']["conv1"] == {"forward": 0.5, "backward": 0.5}
+    assert report['avg_forward'] == 4.5
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_run_case(case):
+    result = run_case(case, 3, trials=2)
+    assert result['case'] == case and result['size'] == 3
+    assert result['seconds']['n'] == 2
+    assert result['seconds']['median'] > 0
+
+
+def test_find_regressions_of_other_metrics():
+    baseline = {'seconds': summarize([1.0, 1.01, 0.99, 1.0, 1.02])}
+    result = {'seconds': summarize([1.5, 1.51, 1.49, 1.5, 1.52])}
+    assert find_regressions(baseline, result, metrics=('seconds',)) == \
+        [('seconds', 1.0, 1.5, 0.5)]
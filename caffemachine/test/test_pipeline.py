@@ -0,0 +1,96 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import subprocess
+
+from caffemachine import CaffeTemplate
+from caffemachine.pipeline import Pipeline, print_pipeline_summary, \
+    state_file
+from caffemachine.scheduler import Slot
+
+
+def read_calls(calls):
+    if not os.path.exists(calls):
+        return []
+    with open(calls) as f:
+        calls_made = f.read().split()
+    os.remove(calls)
+    return sorted(calls_made)
+
+
+def statuses(stages):
+    return {(s.name, s.kind): s.status for s in stages}
+
+
+networks = {"small": {"num_output": 10, "max_iter": 100},
+            "big": {"num_output": 100, "max_iter": 200}}
+
+
+def test_pipeline_runs_only_outdated_stages(local_tmpl, pipeline_caffe,
+                                            capsys):
+    caffe, calls = pipeline_caffe
+    stages = Pipeline(caffe, local_tmpl, networks,
+                      slots=[Slot(), Slot()]).run()
+    assert set(statuses(stages).values()) == {"ran"}
+    assert read_calls(calls) == ["test", "test", "time", "time", "train",
+                                 "train"]
+    results = {(s.name, s.kind): s.result for s in stages}
+    assert results[("small", "test")] == 0.9
+    assert results[("big", "time")]["avg_forward"] == 3.0
+    assert "log" not in results[("big", "time")]
+
+    stages = Pipeline(caffe, local_tmpl, networks).run()
+    assert set(statuses(stages).values()) == {"up to date"}
+    assert read_calls(calls) == []
+
+    # new weights are tested again, the timing does not depend on them
+    small = stages[0].net
+    with open(small.highest_iteration_weights(), "w") as f:
+        f.write("fine-tuned")
+    stages = Pipeline(caffe, local_tmpl, networks).run()
+    assert read_calls(calls) == ["test"]
+    assert statuses(stages)[("small", "test")] == "ran"
+
+    # a new commit of the template changes the model of both networks
+    repo = local_tmpl.git_url[len("file://"):]
+    with open(os.path.join(repo, "layers.inc"), "a") as f:
+        f.write("\n# edited\n")
+    env = dict(os.environ, GIT_AUTHOR_NAME="test", GIT_AUTHOR_EMAIL="t@t",
+               GIT_COMMITTER_NAME="test", GIT_COMMITTER_EMAIL="t@t")
+    subprocess.check_call(["git", "commit", "-q", "-a", "-m", "edit"],
+                          cwd=repo, env=env)
+    tmpl = CaffeTemplate(local_tmpl.git_url)
+    stages = Pipeline(caffe, tmpl, networks).run()
+    assert read_calls(calls) == ["test", "test", "time", "time", "train",
+                                 "train"]
+    assert os.listdir(os.path.join(small.directory, "outdated"))
+    capsys.readouterr()
+    print_pipeline_summary(stages)
+    assert capsys.readouterr().out.splitlines()[2].split("|")[1:] == \
+        ["    ran     "] * 4
+
+
+def test_pipeline_blocks_stages_after_failure(local_tmpl, pipeline_caffe):
+    caffe, calls = pipeline_caffe
+    # the solver has no snapshot, the train stage fails
+    caffe.executable = "false"
+    stages = Pipeline(caffe, local_tmpl, {"small": networks["small"]}).run()
+    assert statuses(stages) == {
+        ("small", "render"): "ran", ("small", "train"): "failed",
+        ("small", "test"): "blocked", ("small", "time"): "failed"}
+    assert "caffe train exited with 1" in stages[1].error
+    with open(state_file(stages[0].net)) as f:
+        assert list(json.load(f)) == ["render"]
@@ -0,0 +1,57 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from caffemachine.profiling import chrome_trace, layer_costs, \
+    variable_influence
+
+
+def report(scale=1.):
+    return {
+        'layers': {
+            'data': {'forward': 0.5, 'backward': 0.},
+            'conv1': {'forward': 3. * scale, 'backward': 5. * scale},
+            'ip1': {'forward': 1., 'backward': 1.},
+        },
+        'avg_forward': 4.5 + 3 * (scale - 1),
+        'avg_backward': 6. + 5 * (scale - 1),
+    }
+
+
+def test_layer_costs():
+    costs = layer_costs(report())
+    assert [c[0] for c in costs] == ['conv1', 'ip1', 'data']
+    assert abs(costs[0][3] - 8 / 10.5) < 1e-9
+    assert abs(sum(c[3] for c in costs) - 1) < 1e-9
+
+
+def test_variable_influence():
+    variants = [({'conv1': {'num_output': n}, 'ip1': 500, 'name': 'x'},
+                 report(n / 10)) for n in (10, 20, 40)]
+    variants[1][0]['ip1'] = 400
+    influence = variable_influence(variants)
+    assert influence[0][0] == 'conv1.num_output'
+    assert abs(influence[0][1] - 1) < 1e-9
+    assert [v for v, _ in influence] == ['conv1.num_output', 'ip1']
+
+
+def test_chrome_trace():
+    trace = chrome_trace({'a': report(), 'b': report(2.)})
+    events = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+    a = [e for e in events if e['pid'] == 0]
+    assert [e['name'] for e in a] == ['data', 'conv1', 'ip1',
+                                      'ip1', 'conv1', 'data']
+    assert a[1]['ts'] == 500. and a[1]['dur'] == 3000.
+    assert a[3]['cat'] == 'backward'
+    assert a[3]['ts'] == 4500.
@@ -0,0 +1,77 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+
+import pytest
+
+from caffemachine.registry import Registry
+
+
+@pytest.fixture
+def registry(tmpdir):
+    return Registry(str(tmpdir.join("registry.sqlite")))
+
+
+def test_registry_query(local_tmpl, registry):
+    local_tmpl.set_registry(registry)
+    nets = local_tmpl.render_many(
+        [("net{}".format(i), {"name": "a", "num_output": i})
+         for i in range(20)], processes=2)
+    assert registry.directories(local_tmpl.key()) == \
+        [net.directory for net in nets]
+    assert local_tmpl.available_networks() == [net.directory for net in nets]
+    for i, net in enumerate(nets):
+        registry.record_results(net.directory, accuracy=i / 20,
+                                avg_forward=float(i))
+    registry.record_results(nets[5].directory, weights="w.caffemodel")
+
+    top = registry.query('accuracy', limit=3, max_forward=10)
+    assert [r.name for r in top] == ["net10", "net9", "net8"]
+    fastest = registry.query('forward', limit=1)[0]
+    assert fastest.name == "net0" and fastest.status == "rendered"
+    record = registry.query(min_accuracy=0.25, max_forward=5)[0]
+    assert record.weights == "w.caffemodel" and record.accuracy == 0.25
+    assert record.args == {"name": "a", "num_output": 5}
+
+    found = registry.find(local_tmpl.key(), "net3",
+                          {"name": "a", "num_output": 3})
+    assert found.directory == nets[3].directory
+    assert registry.find(local_tmpl.key(), "net3", {}) is None
+
+
+def test_registry_tracks_training(local_tmpl, registry, train_caffe):
+    local_tmpl.set_registry(registry)
+    train_caffe.set_registry(registry)
+    net = local_tmpl.render("net", {"name": "a", "num_output": 1,
+                                    "max_iter": 300})
+    with open(net.solver_file(), "a") as f:
+        f.write("# quality: 0.9\n")
+    assert train_caffe.train(net, output=io.StringIO()) == 0
+    record, = registry.query(status='trained')
+    assert record.iteration == 300
+    assert [i for i, _ in registry.snapshots(net.directory)] == \
+        net.snapshot_index().iterations()
+
+
+def test_registry_scan(local_tmpl, registry):
+    nets = [local_tmpl.render("net", {"name": "a", "num_output": i})
+            for i in range(3)]
+    networks_dir = os.path.dirname(local_tmpl.networks_dir.rstrip("/"))
+    assert registry.scan(networks_dir) == 3
+    assert registry.scan(networks_dir) == 0
+    assert sorted(registry.directories(local_tmpl.key())) == \
+        sorted(net.directory for net in nets)
+    assert {r.name for r in registry.query()} == {"net"}
@@ -0,0 +1,199 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import argparse
+import io
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+import yaml
+
+from caffemachine import main
+from caffemachine.cache import ResultCache
+from caffemachine.remote import RemoteExecutor, LocalExecutor, TaskRunner, \
+    WorkerServer, _run_queue, parse_address
+
+
+@pytest.fixture
+def workers(local_tmpl, fake_caffe):
+    caffe, events = fake_caffe
+    servers = [WorkerServer(("127.0.0.1", 0),
+                            TaskRunner(caffe, templates=[local_tmpl.git_url]))
+               for _ in range(3)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, args=(0.05,),
+                         daemon=True).start()
+    yield servers
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def tasks(local_tmpl, op, n=6, **opts):
+    template = {'git_url': local_tmpl.git_url, 'git_tag': local_tmpl.git_tag}
+    result = []
+    for i in range(n):
+        task = {'op': op, 'template': template, 'name': "net{}".format(i),
+                'args': {'name': "n{}".format(i), 'num_output': i}}
+        task.update(opts)
+        result.append(task)
+    return result
+
+
+def test_remote_executor_balances_jobs(local_tmpl, workers):
+    executor = RemoteExecutor([server.address for server in workers])
+    output = io.StringIO()
+    rendered = executor.run(tasks(local_tmpl, 'render'), output=output)
+    assert all(r.ok for r in rendered)
+    timings = executor.run(tasks(local_tmpl, 'time'), output=output)
+    assert [r.value['avg_forward'] for r in timings] == [4.5] * 6
+    # the fake caffe sleeps, so all workers get some of the jobs
+    assert len({r.worker for r in timings}) == 3
+
+
+def test_remote_fetch_artifacts(local_tmpl, workers, tmpdir):
+    executor = RemoteExecutor([workers[0].address])
+    task = tasks(local_tmpl, 'fetch', n=1, files=["train.prototxt"])[0]
+    dest = str(tmpdir.join("dest"))
+    result, = executor.run([task], dest_dirs={task['name']: dest})
+    assert result.ok
+    with open(os.path.join(dest, "train.prototxt")) as f:
+        assert f.read().startswith('name: "n0"')
+
+
+def test_remote_fetch_empty_files(local_tmpl, workers, tmpdir):
+    executor = RemoteExecutor([workers[0].address])
+    task, = tasks(local_tmpl, 'render', n=1)
+    net_dir = executor.run([task])[0].value
+    open(os.path.join(net_dir, "empty.log"), "w").close()
+    fetch = dict(task, op='fetch', files=["empty.log"])
+    dest = str(tmpdir.join("dest"))
+    result, = executor.run([fetch], dest_dirs={task['name']: dest})
+    assert result.ok
+    assert os.listdir(dest) == ["empty.log"]
+
+
+def test_failing_task_does_not_block_the_queue():
+    def run_task(worker, task):
+        if task == "bad":
+            raise KeyError("type")
+        return task
+    results = _run_queue(["a", "bad", "b", "c"], ["w1", "w2"], run_task)
+    assert [results[i] for i in (0, 2, 3)] == ["a", "b", "c"]
+    assert "KeyError" in results[1].error
+    assert results[1].worker in ("w1", "w2")
+
+
+def test_unreachable_worker_is_skipped(local_tmpl, workers):
+    executor = RemoteExecutor(["127.0.0.1:1", workers[0].address])
+    results = executor.run(tasks(local_tmpl, 'render', n=3),
+                           output=io.StringIO())
+    assert all(r.ok and r.worker == workers[0].address for r in results)
+
+
+def test_errors_are_reported(local_tmpl, workers):
+    executor = RemoteExecutor([workers[0].address])
+    result, = executor.run(tasks(local_tmpl, 'unknown', n=1))
+    assert not result.ok
+    assert "Unknown operation" in result.error
+
+
+def test_worker_rejects_untrusted_tasks(local_tmpl, workers, tmpdir):
+    executor = RemoteExecutor([workers[0].address])
+    task, = tasks(local_tmpl, 'render', n=1)
+    other = dict(task, template={'git_url': "file://" + str(tmpdir)})
+    escape = dict(task, name="../../escape")
+    results = executor.run([other, escape], output=io.StringIO())
+    assert "is not allowed on this worker" in results[0].error
+    assert "Invalid network name" in results[1].error
+    assert not os.path.exists(os.path.join(local_tmpl.networks_dir, "..",
+                                           "..", "escape"))
+
+
+def test_worker_rejects_untrusted_caffe_repo():
+    runner = TaskRunner(caffe_repos=[])
+    with pytest.raises(PermissionError):
+        runner._caffe({'caffe': {'git_url': "https://example.com/caffe"}})
+
+
+def test_worker_does_not_prompt_for_download_script(tmpdir, cache_dirs,
+                                                    template_repo):
+    git_url = template_repo({
+        "train.prototxt.j2": "name: \"net\"\n",
+        "get_data.sh": "#!/bin/sh\ntouch {}\n".format(
+            tmpdir.join("downloaded")),
+    })
+    runner = TaskRunner(templates=[git_url])
+    task = {'op': 'render', 'name': "net", 'args': {'num_output': 1},
+            'template': {'git_url': git_url,
+                         'allow_download_script': True}}
+    with pytest.raises(PermissionError):
+        runner.run(task, lambda message: None)
+    assert not tmpdir.join("downloaded").exists()
+
+
+def test_local_executor(local_tmpl, fake_caffe):
+    caffe, events = fake_caffe
+    executor = LocalExecutor(TaskRunner(caffe), jobs=2)
+    results = executor.run(tasks(local_tmpl, 'time', n=2))
+    assert [r.value['avg_backward'] for r in results] == [5.5, 5.5]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_remote_train_then_local_evaluate(tmpdir, local_tmpl,
+                                          pipeline_caffe):
+    caffe, calls = pipeline_caffe
+    network = {'name': "n", 'num_output': 10, 'max_iter': 100}
+    config_file = str(tmpdir.join("config.yml"))
+    with open(config_file, "w") as f:
+        yaml.safe_dump({'git_url': local_tmpl.git_url,
+                        'networks': {'small': network}}, f)
+    # the worker has its own home directory, like another machine
+    address = "127.0.0.1:{}".format(_free_port())
+    package_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(main.__file__))))
+    env = dict(os.environ, HOME=str(tmpdir.mkdir("worker_home")),
+               PATH=os.path.dirname(caffe.executable) + os.pathsep +
+               os.environ.get('PATH', ''),
+               PYTHONPATH=package_dir)
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "caffemachine.main", "worker", address,
+         "--template", local_tmpl.git_url], env=env)
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(parse_address(address)).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        main._train_remote(argparse.Namespace(
+            config=config_file, workers=address, restart=False))
+    finally:
+        worker.terminate()
+        worker.wait()
+    net = local_tmpl.find_or_render("small", network)
+    assert os.path.exists(net.train_file())
+    caffe.set_cache(ResultCache(str(tmpdir.join("results"))))
+    assert caffe.test(net, net.highest_iteration_weights()) == 0.9
@@ -0,0 +1,199 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import threading
+
+import pytest
+
+from caffemachine import Caffe, CaffeNet
+from caffemachine.cache import ResultCache
+from caffemachine.resident import ResidentPool, ResidentWorker
+
+# stands in for pycaffe, the weights files contain the accuracy
+fake_pycaffe_source = '''
+import os, re
+
+TRAIN, TEST = 0, 1
+calls = {calls!r}
+
+
+def _log(*call):
+    with open(calls, "a") as f:
+        f.write(repr(list(call)) + "\\n")
+
+
+def set_mode_cpu():
+    pass
+
+
+class Net(object):
+    _layer_names = ["data", "ip"]
+
+    def __init__(self, model, phase):
+        _log("load", model, phase)
+        self.accuracy = None
+        # data layers open their source relative to the working directory
+        if os.path.exists(model):
+            with open(model) as f:
+                for source in re.findall(r'source: "(.*)"', f.read()):
+                    open(source).close()
+
+    def copy_from(self, weights):
+        _log("copy_from", weights)
+        with open(weights) as f:
+            self.accuracy = float(f.read())
+
+    def forward(self):
+        return {{"accuracy": self.accuracy}}
+
+    def _forward(self, start, end):
+        pass
+
+    def _backward(self, start, end):
+        pass
+'''
+
+
+def read_calls(calls):
+    with open(calls) as f:
+        return [eval(line) for line in f]
+
+
+@pytest.fixture
+def pycaffe_net(tmpdir):
+    net = CaffeNet(str(tmpdir.mkdir("net")), template_args={})
+    for iteration, accuracy in ((100, "0.5"), (200, "0.75")):
+        with open(os.path.join(net.directory, "lenet_iter_{}.caffemodel"
+                               .format(iteration)), "w") as f:
+            f.write(accuracy)
+    return net
+
+
+@pytest.fixture
+def pycaffe(tmpdir):
+    # laid out like a caffe install: lib/ and python/caffe/
+    package = tmpdir.join("install", "python", "caffe")
+    package.ensure(dir=True)
+    tmpdir.join("install", "lib").ensure(dir=True)
+    calls = str(tmpdir.join("calls"))
+    package.join("__init__.py").write(
+        fake_pycaffe_source.format(calls=calls))
+    return str(tmpdir.join("install", "lib")) + "/", calls
+
+
+def test_resident_worker_keeps_net_loaded(pycaffe, pycaffe_net, fake_caffe):
+    ld_path, calls = pycaffe
+    executable, events = fake_caffe
+    caffe = Caffe(executable.executable, caffe_ld_path=ld_path)
+    worker = ResidentWorker(caffe)
+    assert worker.available()
+    caffe.set_worker(worker)
+    weights = pycaffe_net.weights()
+    assert caffe.test(pycaffe_net, weights[0], iterations=3) == 0.5
+    assert caffe.test(pycaffe_net, weights[1], iterations=3) == 0.75
+    report = caffe.time(pycaffe_net, iterations=2)
+    assert set(report['layers']) == {"data", "ip"}
+    assert report['avg_forward'] >= 0
+    worker.close()
+    # the test net is loaded once, only the weights are swapped
+    assert read_calls(calls) == [
+        ["load", pycaffe_net.train_file(), 1],
+        ["copy_from", weights[0]],
+        ["copy_from", weights[1]],
+        ["load", pycaffe_net.test_file(), 0],
+    ]
+    # no caffe process was started
+    assert not os.path.exists(events)
+
+
+def test_resident_worker_falls_back_to_cli(tmpdir, pycaffe_net, fake_caffe):
+    caffe, events = fake_caffe
+    # no python bindings next to the libraries
+    caffe.caffe_ld_path = str(tmpdir.mkdir("lib"))
+    worker = ResidentWorker(caffe, python=str(tmpdir.join("missing")))
+    assert not worker.available()
+    worker = ResidentWorker(caffe)
+    assert not worker.available()
+    caffe.set_worker(worker)
+    assert caffe.test(pycaffe_net, pycaffe_net.weights()[0]) == 0.97
+    assert caffe.time(pycaffe_net)['avg_forward'] == 4.5
+    with open(events) as f:
+        assert [json.loads(line)[0] for line in f] == ["test", "time"]
+
+
+def test_resident_worker_resolves_relative_sources(pycaffe, pycaffe_net,
+                                                   fake_caffe):
+    ld_path, calls = pycaffe
+    executable, events = fake_caffe
+    caffe = Caffe(executable.executable, caffe_ld_path=ld_path)
+    with open(pycaffe_net.train_file(), "w") as f:
+        f.write('layer { type: "Data" data_param { source: "data/test" } }')
+    os.mkdir(os.path.join(pycaffe_net.directory, "data"))
+    open(os.path.join(pycaffe_net.directory, "data", "test"), "w").close()
+    worker = ResidentWorker(caffe)
+    caffe.set_worker(worker)
+    assert caffe.test(pycaffe_net, pycaffe_net.weights()[0]) == 0.5
+    worker.close()
+    assert not os.path.exists(events)
+
+
+def test_resident_time_is_cpu_only(tmpdir, pycaffe, pycaffe_net,
+                                   fake_caffe):
+    ld_path, calls = pycaffe
+    executable, events = fake_caffe
+    caffe = Caffe(executable.executable, caffe_ld_path=ld_path)
+    caffe.set_cache(ResultCache(str(tmpdir.join("results"))))
+    with open(pycaffe_net.test_file(), "w") as f:
+        f.write('layer { name: "ip" type: "InnerProduct" }')
+    cli_key = caffe._time_cache_key(pycaffe_net, 10, False)
+    worker = ResidentWorker(caffe)
+    caffe.set_worker(worker)
+    # timings of pycaffe are cached apart from the command line tool's
+    assert caffe._time_cache_key(pycaffe_net, 10, False) != cli_key
+    # the gpu is timed by `caffe time`
+    caffe.gpus = 0
+    gpu_key = caffe._time_cache_key(pycaffe_net, 10, False)
+    caffe.set_worker(None)
+    assert caffe._time_cache_key(pycaffe_net, 10, False) == gpu_key
+    caffe.set_worker(worker)
+    assert caffe.time(pycaffe_net)['avg_forward'] == 4.5
+    worker.close()
+    with open(events) as f:
+        assert [json.loads(line)[0] for line in f] == ["time"]
+
+
+def test_resident_pool_runs_one_worker_per_job(pycaffe, pycaffe_net,
+                                               fake_caffe):
+    ld_path, calls = pycaffe
+    executable, _ = fake_caffe
+    caffe = Caffe(executable.executable, caffe_ld_path=ld_path)
+    pool = ResidentPool(caffe, jobs=2)
+    assert pool.available()
+    assert len({w._process.pid for w in pool.workers}) == 2
+    caffe.set_worker(pool)
+    weights = pycaffe_net.weights()
+    accuracies = {}
+
+    def test(w):
+        accuracies[w] = caffe.test(pycaffe_net, w, iterations=2)
+    threads = [threading.Thread(target=test, args=(w,))
+               for w in weights * 2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.close()
+    assert accuracies == {weights[0]: 0.5, weights[1]: 0.75}
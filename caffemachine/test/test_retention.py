@@ -0,0 +1,125 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import zipfile
+
+import pytest
+
+from caffemachine import logparser
+from caffemachine.retention import RetentionPolicy, archive_snapshots
+
+
+def test_retention_policy():
+    iterations = list(range(100, 1100, 100))
+    accuracies = {0: 0.1, 290: 0.9, 500: 0.5}
+    assert RetentionPolicy(keep_last=2).keep(iterations, accuracies) == \
+        {300, 900, 1000}
+    policy = RetentionPolicy(keep_last=0, keep_best=False, keep_every=500)
+    assert policy.keep(iterations) == {500, 1000}
+
+
+def test_archive_and_restore(empty_net, touch_snapshot):
+    net = empty_net
+    for i in range(100, 1100, 100):
+        touch_snapshot(net, i)
+        with open(net.weights()[-1], "w") as f:
+            f.write("weights {}".format(i) * 100)
+    with logparser.MetricsWriter(net.metrics_file()) as metrics:
+        metrics.write(logparser.TestRecord(300, 0.99, 0.1))
+        metrics.write(logparser.TestRecord(1000, 0.5, 0.1))
+    archived = archive_snapshots(net, RetentionPolicy(keep_last=1))
+    assert len(archived) == 16
+    assert [net.iteration_of_weights(w) for w in net.weights()] == \
+        [300, 1000]
+    assert net.latest_solverstate().endswith("_iter_1000.solverstate")
+    assert len(net.archived_snapshots()) == 8
+    assert len(net.archived_snapshots('solverstate')) == 8
+
+    weights = net.archived_snapshots()[0]
+    assert not os.path.exists(weights)
+    assert net.restore_snapshot(weights)
+    with open(weights) as f:
+        assert f.read() == "weights 100" * 100
+    assert not net.restore_snapshot(os.path.join(net.directory,
+                                                 "lenet_iter_5.caffemodel"))
+    # restored snapshots are not archived twice
+    assert archive_snapshots(net, RetentionPolicy(keep_last=1)) == \
+        [os.path.basename(weights)]
+    assert len(net.archived_snapshots()) == 8
+
+
+def test_test_restores_archived_weights(empty_net, touch_snapshot,
+                                        fake_caffe):
+    caffe, _ = fake_caffe
+    for i in (100, 200):
+        touch_snapshot(empty_net, i)
+    archive_snapshots(empty_net, RetentionPolicy(keep_last=1))
+    weights = empty_net.archived_snapshots()[0]
+    assert caffe.test(empty_net, weights) == 0.97
+    assert os.path.exists(weights)
+
+
+def test_resume_from_archived_iteration(empty_net, touch_snapshot,
+                                        train_caffe):
+    net = empty_net
+    with open(net.solver_file(), "w") as f:
+        f.write("max_iter: 200\n# quality: 0.9\n")
+    for i in (100, 150):
+        touch_snapshot(net, i)
+    archive_snapshots(net, RetentionPolicy(keep_last=1, keep_best=False))
+    solverstate = net.archived_snapshots('solverstate')[0]
+    weights = net.archived_snapshots()[0]
+    assert not os.path.exists(weights)
+    with open(os.devnull, "w") as devnull:
+        assert train_caffe.train(net, snapshot=solverstate,
+                                 output=devnull) == 0
+    assert os.path.exists(solverstate) and os.path.exists(weights)
+    assert net.latest_iteration() == 200
+
+
+def test_archive_keeps_old_archive_on_failure(empty_net, touch_snapshot,
+                                              monkeypatch):
+    for i in (100, 200, 300):
+        touch_snapshot(empty_net, i)
+    archive_snapshots(empty_net, RetentionPolicy(keep_last=2))
+    with open(empty_net.snapshot_archive_file(), "rb") as f:
+        archive = f.read()
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(zipfile.ZipFile, "write", fail)
+    with pytest.raises(OSError):
+        archive_snapshots(empty_net, RetentionPolicy(keep_last=1))
+    with open(empty_net.snapshot_archive_file(), "rb") as f:
+        assert f.read() == archive
+    assert len(empty_net.weights()) == 2
+    assert sorted(os.listdir(empty_net.directory)) == [
+        "lenet_iter_200.caffemodel", "lenet_iter_200.solverstate",
+        "lenet_iter_300.caffemodel", "lenet_iter_300.solverstate",
+        os.path.basename(empty_net.snapshot_archive_file())]
+
+
+def test_archive_appends_without_recompressing(empty_net, touch_snapshot,
+                                               monkeypatch):
+    for i in (100, 200, 300):
+        touch_snapshot(empty_net, i)
+    archive_snapshots(empty_net, RetentionPolicy(keep_last=2))
+
+    def read_member(*args, **kwargs):
+        raise AssertionError("archived snapshots are decompressed")
+    monkeypatch.setattr(zipfile, "ZipExtFile", read_member)
+    assert len(archive_snapshots(empty_net, RetentionPolicy(keep_last=1))) \
+        == 2
+    assert len(empty_net.archived_snapshots()) == 2
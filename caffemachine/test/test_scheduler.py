@@ -0,0 +1,84 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import threading
+
+from caffemachine import Caffe
+from caffemachine.scheduler import Job, Scheduler, Slot, make_slots, \
+    parse_cpu_list, partition_cpus
+
+
+def test_parse_cpu_list():
+    assert parse_cpu_list("0-3,8,10-11") == [0, 1, 2, 3, 8, 10, 11]
+
+
+def test_partition_cpus():
+    groups = partition_cpus(3, list(range(8)), nodes=[list(range(8))])
+    assert groups == [[0, 1, 2], [3, 4, 5], [6, 7]]
+
+
+def test_partition_cpus_numa():
+    nodes = [list(range(0, 8)), list(range(8, 16))]
+    cpus = list(range(16))
+    assert partition_cpus(4, cpus, nodes) == \
+        [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 10, 11], [12, 13, 14, 15]]
+    # no group spans both nodes, even if the split is uneven
+    groups = partition_cpus(3, cpus, nodes)
+    assert all(set(g) <= set(nodes[0]) or set(g) <= set(nodes[1])
+               for g in groups)
+    assert len(groups) == 3 and sum(map(len, groups)) == 16
+    assert partition_cpus(1, cpus, nodes) == [cpus]
+    # only the allowed cpus are used
+    assert partition_cpus(2, [0, 1, 8, 9], nodes) == [[0, 1], [8, 9]]
+
+
+def test_make_slots_gpus():
+    slots = make_slots(2, cpu_groups=[[0, 1], [2, 3]], gpus=[0, 1])
+    assert [s.cpus for s in slots] == [[0, 1], [2, 3]]
+    assert [s.gpus for s in slots] == [0, 1]
+
+
+def test_scheduler_runs_concurrently_and_isolates_failures(tmpdir):
+    barrier = threading.Barrier(2, timeout=5)
+
+    def ok(caffe, output):
+        barrier.wait()
+        print("ok", caffe.gpus, file=output)
+        return 0
+
+    def fails(caffe, output):
+        barrier.wait()
+        raise RuntimeError("boom")
+
+    jobs = [Job("a", ok, str(tmpdir.join("a.log"))),
+            Job("b", fails, str(tmpdir.join("b.log"))),
+            Job("c", lambda caffe, output: 1, str(tmpdir.join("c.log")))]
+    scheduler = Scheduler(Caffe(), [Slot(gpus=0), Slot(gpus=1)])
+    results = scheduler.run(jobs)
+    assert [r.name for r in results] == ["a", "b", "c"]
+    assert results[0].ok
+    assert "boom" in results[1].error
+    assert results[2].returncode == 1
+    assert tmpdir.join("a.log").read().startswith("ok")
+
+
+def test_blas_threads_match_cpus():
+    caffe = Caffe()
+    assert caffe._env().get("OPENBLAS_NUM_THREADS") == \
+        os.environ.get("OPENBLAS_NUM_THREADS")
+    caffe.set_cpus([2, 3, 4])
+    env = caffe._env()
+    assert env["OMP_NUM_THREADS"] == env["OPENBLAS_NUM_THREADS"] == "3"
@@ -0,0 +1,90 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+from caffemachine import CaffeNet
+from caffemachine import selection
+from caffemachine.evaluator import Evaluation
+
+
+def make_evaluation(name, accuracy, forward, backward):
+    e = Evaluation(name, None, name + ".caffemodel")
+    e.accuracy = accuracy
+    e.timings = {'avg_forward': forward, 'avg_backward': backward}
+    return e
+
+
+def test_pareto_front():
+    evaluations = [make_evaluation("a", 0.90, 5, 10),
+                   make_evaluation("b", 0.95, 10, 20),
+                   make_evaluation("c", 0.93, 12, 22),
+                   make_evaluation("d", 0.97, 20, 15),
+                   make_evaluation("e", 0.89, 6, 8)]
+    front = selection.pareto_front(evaluations)
+    assert [e.name for e in front] == ["a", "e", "b", "d"]
+    forward_front = selection.pareto_front(evaluations, ('avg_forward',))
+    assert [e.name for e in forward_front] == ["a", "b", "d"]
+
+    assert selection.most_accurate(evaluations, max_forward=15).name == "b"
+    assert selection.most_accurate(evaluations, max_forward=1) is None
+    assert selection.most_accurate(evaluations, max_backward=9).name == "e"
+    assert selection.fastest(evaluations, min_accuracy=0.94).name == "b"
+
+
+def test_select_times_every_network_once(tmpdir, fake_caffe):
+    caffe, events = fake_caffe
+    nets = []
+    for i in range(2):
+        net = CaffeNet(str(tmpdir.mkdir("net{}".format(i))), template_args={})
+        for iteration in (100, 200):
+            open("{}/n_iter_{}.caffemodel".format(net.directory, iteration),
+                 "w").close()
+        nets.append(net)
+    evaluations = [e for i, net in enumerate(nets)
+                   for e in selection.candidates("net{}".format(i), net,
+                                                 all_snapshots=True)]
+    selection.evaluate(caffe, evaluations, jobs=4)
+    assert len(evaluations) == 4
+    assert all(e.timings['avg_forward'] == 4.5 for e in evaluations)
+    with open(events) as f:
+        kinds = [json.loads(line)[0] for line in f]
+    assert kinds.count("test") == 4 and kinds.count("time") == 2
+
+
+# the accuracy and forward time depend on the network directory
+per_net_caffe_source = '''#!{python}
+import os, sys
+args = dict(zip(sys.argv[2::2], sys.argv[3::2]))
+net = int(os.path.basename(os.path.dirname(args["-model"]))[len("net"):])
+if sys.argv[1] == "test":
+    sys.stderr.write("I caffe.cpp:313] accuracy = %f\\n"
+                     % [0.5, 0.9, 0.7][net])
+else:
+    forward = [5.0, 4.0, 3.0][net]
+    sys.stderr.write("I caffe.cpp:376] Average Forward pass: %f ms.\\n"
+                     "I caffe.cpp:378] Average Backward pass: %f ms.\\n"
+                     % (forward, 2 * forward))
+'''
+
+
+def test_get_fastest_and_most_accurate(tmpdir, caffe_script):
+    caffe = caffe_script(per_net_caffe_source)
+    nets = []
+    for i in range(3):
+        net = CaffeNet(str(tmpdir.mkdir("net{}".format(i))), template_args={})
+        open(net.directory + "/n_iter_1.caffemodel", "w").close()
+        nets.append(net)
+    assert caffe.get_fastest(nets) is nets[2]
+    assert caffe.get_most_accurate(nets, jobs=2) is nets[1]
@@ -0,0 +1,52 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from caffemachine.scheduler import Scheduler, Slot
+from caffemachine.sweep import SweepRun, SuccessiveHalving, MedianStopping
+
+
+def make_runs(make_net, qualities, max_iter=1000):
+    runs = []
+    for i, quality in enumerate(qualities):
+        name = "net{}".format(i)
+        runs.append(SweepRun(name, make_net(max_iter, quality, name=name)))
+    return runs
+
+
+def test_successive_halving(make_net, train_caffe, capsys):
+    runs = make_runs(make_net,
+                     [0.5, 0.9, 0.7, 0.6, 0.8, 0.55, 0.95, 0.65, 0.75])
+    scheduler = Scheduler(train_caffe, [Slot(), Slot(), Slot()])
+    SuccessiveHalving(scheduler, min_iter=100, eta=3).run(runs)
+    by_name = {run.name: run for run in runs}
+    assert by_name["net6"].stopped_at is None
+    assert by_name["net6"].iteration >= 990
+    finished = [run for run in runs if run.stopped_at is None]
+    assert len(finished) == 1
+    # the worst third is stopped after the first rung
+    for name in ["net0", "net5", "net3"]:
+        assert by_name[name].stopped_at < 300
+    # stopped runs snapshot where they stopped, promoted runs resumed
+    assert by_name["net1"].net.latest_solverstate() is not None
+    assert by_name["net6"].net.weights()[-1].endswith("_iter_1000.caffemodel")
+
+
+def test_median_stopping(make_net, train_caffe, capsys):
+    runs = make_runs(make_net, [0.9, 0.8, 0.85, 0.2], max_iter=500)
+    scheduler = Scheduler(train_caffe, [Slot()])
+    MedianStopping(scheduler, grace_iter=100).run(runs)
+    assert [run.stopped_at for run in runs[:3]] == [None, None, None]
+    assert runs[3].stopped_at == 100
+    assert runs[3].iteration < 200
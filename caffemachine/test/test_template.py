@@ -1,4 +1,11 @@
+import io
 import os
+import subprocess
+import sys
+
+import pytest
+
+from caffemachine import CaffeTemplate
 
 
 def test_template_git_clone(test_tmpl):
@@ -15,3 +22,131 @@ def test_config(net):
     assert os.path.exists(net.train_file())
     assert os.path.exists(net.test_file())
     assert os.path.exists(net.template_args_file())
+
+
+def read_network(net):
+    files = {}
+    for name in sorted(os.listdir(net.directory)):
+        with open(os.path.join(net.directory, name), "rb") as f:
+            files[name] = f.read()
+    return files
+
+
+def test_extract_variables_local(local_tmpl):
+    assert local_tmpl.extract_variables() == {"name", "max_iter",
+                                              "num_output"}
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_render_many_matches_render(local_tmpl, processes):
+    networks = [("net{}".format(i), {"name": "n{}".format(i),
+                                     "num_output": 10 * i})
+                for i in range(5)]
+    nets = local_tmpl.render_many(networks, processes=processes, chunksize=2)
+    expected = {}
+    for net in nets:
+        expected[net.directory] = read_network(net)
+        for name in os.listdir(net.directory):
+            os.remove(os.path.join(net.directory, name))
+        os.rmdir(net.directory)
+    for name, args in networks:
+        net = local_tmpl.render(name, args)
+        assert read_network(net) == expected[net.directory]
+    assert read_network(nets[3])["train.prototxt"] == \
+        b'name: "n3"\nlayer { name: "ip1" type: "InnerProduct" ' \
+        b'inner_product_param { num_output: 30 } }'
+
+
+def test_template_tags_share_object_store(cache_dirs, template_repo,
+                                         monkeypatch):
+    git_url = template_repo()
+    repo_dir = git_url[len("file://"):]
+    subprocess.check_call(["git", "tag", "v1"], cwd=repo_dir)
+    master = CaffeTemplate(git_url)
+    v1 = CaffeTemplate(git_url, "v1")
+    assert master.template_dir != v1.template_dir
+    for tmpl in (master, v1):
+        assert os.path.exists(tmpl.template_dir + "/train.prototxt.j2")
+        # worktrees have a `.git` file that points to the shared store
+        assert os.path.isfile(tmpl.template_dir + "/.git")
+    assert os.path.isdir(CaffeTemplate.object_store(git_url))
+
+    calls = []
+    git = CaffeTemplate._git
+    monkeypatch.setattr(CaffeTemplate, "_git", classmethod(
+        lambda cls, args, **kwargs: calls.append(args[0]) or
+        git(args, **kwargs)))
+    CaffeTemplate(git_url, "v1")
+    assert calls == ["ls-remote"]
+    commit = master._recorded_commit()
+    calls.clear()
+    CaffeTemplate(git_url, commit)
+    assert "ls-remote" not in calls
+    calls.clear()
+    CaffeTemplate(git_url, commit)
+    assert calls == []
+
+
+def test_network_does_not_copy_git_file(local_tmpl):
+    net = local_tmpl.render("net", {"name": "a", "num_output": 1})
+    assert not os.path.exists(os.path.join(net.directory, ".git"))
+
+
+def test_find_or_render_returns_rendered_net(local_tmpl):
+    args = {"name": "a", "num_output": 1}
+    net = local_tmpl.find_or_render("net", args)
+    assert net is not None and os.path.exists(net.solver_file())
+    assert local_tmpl.find_or_render("net", args).directory == net.directory
+
+
+def test_networks_share_blobs(local_tmpl):
+    nets = [local_tmpl.render("net", {"name": "a", "num_output": i})
+            for i in range(3)]
+    readmes = [os.stat(os.path.join(net.directory, "README.md"))
+               for net in nets]
+    assert len({(s.st_dev, s.st_ino) for s in readmes}) == 1
+    store = local_tmpl.blob_store()
+    directories = [net.directory for net in nets]
+    assert store.verify(directories) == []
+
+    broken = os.path.join(nets[1].directory, "layers.inc")
+    os.remove(broken)
+    with open(broken, "w") as f:
+        f.write("changed")
+    os.remove(os.path.join(nets[2].directory, "README.md"))
+    problems = store.verify(directories)
+    assert sorted(p for _, _, p in problems) == ["missing", "modified"]
+    store.verify(directories, repair=True)
+    assert store.verify(directories) == []
+    with open(broken) as f:
+        assert f.read().startswith("layer {")
+
+
+def test_blob_store_repairs_corrupt_blob(local_tmpl):
+    net = local_tmpl.render("net", {"name": "a", "num_output": 1})
+    store = local_tmpl.blob_store()
+    readme = os.path.join(net.directory, "README.md")
+    blob = store.blob_path(store.digest(readme))
+    os.chmod(blob, 0o644)
+    with open(blob, "w") as f:
+        f.write("corrupt")
+    problems = store.verify([net.directory], repair=True)
+    assert [p for _, _, p in problems] == ["blob-corrupt, repaired",
+                                           "modified, repaired"]
+    assert store.verify([net.directory]) == []
+    with open(readme) as f:
+        assert f.read() == "A test template\n"
+    assert store.prune([]) == 2
+
+
+def test_security_prompt_aborts_at_end_of_input(tmpdir, cache_dirs,
+                                                template_repo, monkeypatch):
+    git_url = template_repo({
+        "train.prototxt.j2": "name: \"net\"\n",
+        "get_data.sh": "#!/bin/sh\ntouch {}\n".format(
+            tmpdir.join("downloaded")),
+    })
+    monkeypatch.setattr(sys, "stdin", io.StringIO(""))
+    with pytest.raises(SystemExit):
+        CaffeTemplate(git_url)
+    assert not tmpdir.join("downloaded").exists()
@@ -0,0 +1,79 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from caffemachine import CaffeTemplate
+from caffemachine.tuner import ThroughputTuner, parse_variable
+
+tuner_template_files = {
+    "deploy.prototxt.j2":
+        "layer { name: \"data\" type: \"Input\" top: \"data\"\n"
+        "  input_param { shape { dim: {{ batch_size }} dim: 100 } } }\n"
+        "layer { name: \"ip\" type: \"InnerProduct\" bottom: \"data\"\n"
+        "  top: \"ip\" inner_product_param { num_output: {{ width }} } }\n",
+}
+
+# the forward time grows linearly with the batch size and the width
+fake_time_source = '''#!{python}
+import re, sys
+args = dict(zip(sys.argv[2::2], sys.argv[3::2]))
+model = open(args["-model"]).read()
+batch, width = [int(d) for d in re.findall(r"(?:dim|num_output): (\\d+)",
+                                           model)[::2]]
+forward = 2 + 0.5 * batch * width / 10
+sys.stderr.write("I caffe.cpp:376] Average Forward pass: %f ms.\\n"
+                 "I caffe.cpp:378] Average Backward pass: %f ms.\\n"
+                 % (forward, 2 * forward))
+with open({calls!r}, "a") as f:
+    f.write("%d %d\\n" % (batch, width))
+'''
+
+
+@pytest.fixture
+def tuner_setup(tmpdir, cache_dirs, caffe_script, template_repo):
+    calls = str(tmpdir.join("calls"))
+    tmpl = CaffeTemplate(template_repo(tuner_template_files, name="repo"))
+    return caffe_script(fake_time_source, calls=calls), tmpl, calls
+
+
+def test_parse_variable():
+    assert parse_variable("batch_size=1,2,4") == ("batch_size", [1, 2, 4])
+    assert parse_variable("pool=MAX,AVE") == ("pool", ["MAX", "AVE"])
+
+
+def test_tuner_finds_largest_batch_within_latency(tuner_setup):
+    caffe, tmpl, calls = tuner_setup
+    batches = [2 ** i for i in range(10)]
+    tuner = ThroughputTuner(caffe, tmpl, "net", {"width": 10},
+                            {"batch_size": batches}, max_latency=20)
+    best = tuner.run()
+    # 2 + 0.5 * 32 = 18ms, 64 would take 34ms
+    assert best.args == {"width": 10, "batch_size": 32}
+    assert best.feasible and best.images_per_sec == 32 * 1000 / 18
+    with open(calls) as f:
+        timed = f.readlines()
+    assert len(timed) == len(tuner.trials) < len(batches)
+
+
+def test_tuner_respects_memory_limit(tuner_setup):
+    caffe, tmpl, calls = tuner_setup
+    tuner = ThroughputTuner(
+        caffe, tmpl, "net", {"batch_size": 1, "width": 10},
+        {"batch_size": [1, 4, 16, 64, 256], "width": [10, 20]},
+        max_memory=16 * 100 * 4 * 2.5)
+    best = tuner.run()
+    assert best.args["batch_size"] == 16
+    assert all(t.forward_ms is None for t in tuner.trials if
+               t.memory_bytes > tuner.max_memory)
@@ -0,0 +1,139 @@
+# Copyright 2015 Leon Sixt
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from collections import namedtuple
+
+from .costmodel import analyze_net
+
+Trial = namedtuple('Trial', ['args', 'batch_size', 'forward_ms',
+                             'backward_ms', 'images_per_sec', 'memory_bytes',
+                             'feasible', 'score'])
+
+
+def parse_variable(spec):
+    """Parses `batch_size=1,2,4,8` into `('batch_size', [1, 2, 4, 8])`.
+    The values are json, strings may be written without quotes."""
+    name, values = spec.split("=", 1)
+
+    def parse(value):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return name, [parse(v) for v in values.split(",")]
+
+
+class ThroughputTuner(object):
+    """Searches the template variables for the highest images / sec of the
+    forward pass within a latency and memory limit.
+
+    Every variable has an ordered list of candidate values. Starting from the
+    given args, the tuner walks along one variable at a time as long as the
+    score improves and repeats until no variable improves anymore, so only
+    a small part of the grid is rendered and timed."""
+
+    def __init__(self, caffe, tmpl, name, base_args, variables,
+                 max_latency=None, max_memory=None, input_shapes=None,
+                 iterations=10, batch_variable='batch_size'):
+        self.caffe = caffe
+        self.tmpl = tmpl
+        self.name = name
+        self.base_args = dict(base_args)
+        self.variables = variables
+        self.max_latency = max_latency
+        self.max_memory = max_memory
+        self.input_shapes = input_shapes
+        self.iterations = iterations
+        self.batch_variable = batch_variable
+        self.trials = []
+        self._trials = {}
+
+    def _batch_size(self, args, cost):
+        if cost is not None and cost.layers and cost.layers[0].output_shapes:
+            return cost.layers[0].output_shapes[0][0]
+        return args.get(self.batch_variable, 1)
+
+    def _score(self, forward_ms, memory_bytes):
+        # > 1 means over the limit, used to walk back into the limits
+        overshoot = 0.
+        if self.max_latency is not None and forward_ms is not None:
+            overshoot = max(overshoot, forward_ms / self.max_latency)
+        if self.max_memory is not None and memory_bytes is not None:
+            overshoot = max(overshoot, memory_bytes / self.max_memory)
+        return overshoot
+
+    def evaluate(self, args):
+        key = json.dumps(args, sort_keys=True)
+        if key in self._trials:
+            return self._trials[key]
+        net = self.tmpl.render(self.name, args)
+        try:
+            cost = analyze_net(net, self.input_shapes)
+        except ValueError:
+            # layers the cost model does not know, no memory estimate
+            cost = None
+        memory_bytes = cost.memory_bytes if cost is not None else None
+        batch_size = self._batch_size(args, cost)
+        forward_ms = backward_ms = images_per_sec = None
+        overshoot = self._score(None, memory_bytes)
+        if overshoot <= 1:
+            # networks over the memory limit are not timed at all
+            report = self.caffe.time(net, iterations=self.iterations)
+            forward_ms = report['avg_forward']
+            backward_ms = report['avg_backward']
+            images_per_sec = batch_size * 1000. / forward_ms
+            overshoot = self._score(forward_ms, memory_bytes)
+        feasible = overshoot <= 1
+        score = images_per_sec if feasible else -overshoot
+        trial = Trial(dict(args), batch_size, forward_ms, backward_ms,
+                      images_per_sec, memory_bytes, feasible, score)
+        self._trials[key] = trial
+        self.trials.append(trial)
+        return trial
+
+    @staticmethod
+    def _better(trial, best):
+        return (trial.feasible, trial.score) > (best.feasible, best.score)
+
+    def _walk(self, current, best, var, values, step):
+        i = values.index(current[var]) + step
+        moved = False
+        while 0 <= i < len(values):
+            candidate = dict(current)
+            candidate[var] = values[i]
+            trial = self.evaluate(candidate)
+            if not self._better(trial, best):
+                break
+            current, best, moved = candidate, trial, True
+            i += step
+        return current, best, moved
+
+    def run(self):
+        current = dict(self.base_args)
+        for var, values in self.variables.items():
+            if current.get(var) not in values:
+                current[var] = values[len(values) // 2]
+        best = self.evaluate(current)
+        improved = True
+        while improved:
+            improved = False
+            for var, values in self.variables.items():
+                current, best, moved = self._walk(current, best, var,
+                                                  values, 1)
+                if not moved:
+                    current, best, moved = self._walk(current, best, var,
+                                                      values, -1)
+                improved = improved or moved
+        return best